@@ -0,0 +1,163 @@
+# activity_stats.py
+"""
+Active-user analytics (DAU/WAU/MAU, new vs. returning) from HyperLogLog sketches.
+
+Each day gets one fixed-size sketch (2^precision bytes, 16 KB by default), so memory is bounded
+no matter how many users there are. Sketches merge by taking the register-wise maximum,
+which is idempotent: merging the same data twice (e.g. from several workers) is harmless.
+"""
+import datetime
+import hashlib
+import math
+
+# 2^-r for every possible register value, precomputed for count()
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+class HyperLogLog:
+    """Cardinality sketch with about 1.04 / sqrt(2^precision) relative error (0.8% at precision 14)."""
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision: int = 14, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, item):
+        hashed = int.from_bytes(hashlib.blake2b(str(item).encode(), digest_size=8).digest(), 'big')
+        remaining_bits = 64 - self.precision
+        index = hashed >> remaining_bits
+        remainder = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - remainder.bit_length() + 1 # Position of the leftmost 1-bit
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        """Folds another sketch of the same precision into this one (set union)."""
+        if len(other.registers) != len(self.registers):
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def copy(self) -> "HyperLogLog":
+        return HyperLogLog(self.precision, self.registers)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(_INVERSE_POWERS[rank] for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros) # Linear counting is more accurate for small sets
+        return round(estimate)
+
+
+# Document ID of the sketch holding every user seen before the retained days
+LIFETIME_SKETCH_ID = 'lifetime'
+
+
+def _today() -> datetime.date:
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def day_sketch_id(day: datetime.date) -> str:
+    return f"day-{day.isoformat()}"
+
+
+class ActivityTracker:
+    """
+    Keeps one sketch per UTC day for the last `retention_days` days, plus a lifetime sketch.
+    Days that fall out of the window are folded into the lifetime sketch before being dropped.
+    """
+    def __init__(self, precision: int = 14, retention_days: int = 30):
+        self.precision = precision
+        self.retention_days = retention_days
+        self.daily = {} # date -> HyperLogLog
+        self.lifetime = HyperLogLog(precision)
+        self.dirty_days = set() # Days changed since the last persist
+
+    def record(self, user_id, day: datetime.date = None):
+        day = day or _today()
+        sketch = self.daily.get(day)
+        if sketch is None:
+            sketch = self.daily[day] = HyperLogLog(self.precision)
+            self._drop_expired(day)
+        sketch.add(user_id)
+        self.dirty_days.add(day)
+
+    def _drop_expired(self, today: datetime.date):
+        oldest_kept = today - datetime.timedelta(days=self.retention_days - 1)
+        for day in [day for day in self.daily if day < oldest_kept]:
+            self.lifetime.merge(self.daily.pop(day))
+
+    def sketch_ids(self, today: datetime.date = None):
+        """Returns the IDs of every persisted sketch this tracker covers (retained days and lifetime)."""
+        today = today or _today()
+        days = [today - datetime.timedelta(days=offset) for offset in range(self.retention_days)]
+        return [day_sketch_id(day) for day in days] + [LIFETIME_SKETCH_ID]
+
+    def merge_sketch(self, sketch_id: str, registers, today: datetime.date = None):
+        """Merges persisted registers (e.g. written by another worker) into the matching sketch."""
+        if len(registers) != 1 << self.precision:
+            return # Sketch written with another precision; ignore it
+        incoming = HyperLogLog(self.precision, registers)
+        if sketch_id == LIFETIME_SKETCH_ID:
+            self.lifetime.merge(incoming)
+            return
+        day = datetime.date.fromisoformat(sketch_id.removeprefix("day-"))
+        today = today or _today()
+        if day <= today - datetime.timedelta(days=self.retention_days):
+            self.lifetime.merge(incoming) # Too old to keep separately
+            return
+        self.daily.setdefault(day, HyperLogLog(self.precision)).merge(incoming)
+
+    def take_dirty(self, today: datetime.date = None) -> dict:
+        """
+        Returns sketch_id -> registers for every day changed since the last call, plus the
+        lifetime sketch, and marks them clean. Pass the result to mark_dirty() if persisting fails.
+        """
+        if not self.dirty_days:
+            return {}
+        today = today or _today()
+        dirty = {day_sketch_id(day): bytes(self.daily[day].registers)
+                 for day in self.dirty_days if day in self.daily}
+        dirty[LIFETIME_SKETCH_ID] = bytes(self.lifetime_before(today).registers)
+        self.dirty_days.clear()
+        return dirty
+
+    def mark_dirty(self, sketch_ids):
+        for sketch_id in sketch_ids:
+            if sketch_id != LIFETIME_SKETCH_ID:
+                self.dirty_days.add(datetime.date.fromisoformat(sketch_id.removeprefix("day-")))
+
+    def _union(self, days: int, today: datetime.date) -> HyperLogLog:
+        union = HyperLogLog(self.precision)
+        for offset in range(days):
+            sketch = self.daily.get(today - datetime.timedelta(days=offset))
+            if sketch is not None:
+                union.merge(sketch)
+        return union
+
+    def lifetime_before(self, today: datetime.date) -> HyperLogLog:
+        """Union of every day before `today`: the users who had been seen before."""
+        before = self.lifetime.copy()
+        for day, sketch in list(self.daily.items()): # May run in a worker thread while updates arrive
+            if day < today:
+                before.merge(sketch)
+        return before
+
+    def summary(self, today: datetime.date = None) -> dict:
+        """Returns estimated dau, wau, mau, new_today and returning_today."""
+        today = today or _today()
+        today_sketch = self.daily.get(today, HyperLogLog(self.precision))
+        before = self.lifetime_before(today)
+        before_count = before.count()
+        before.merge(today_sketch)
+        dau = today_sketch.count()
+        # Users in today's sketch that the sketch of all earlier days doesn't explain are new
+        new_today = min(dau, max(0, before.count() - before_count))
+        return {
+            'dau': dau,
+            'wau': self._union(7, today).count(),
+            'mau': self._union(min(30, self.retention_days), today).count(),
+            'new_today': new_today,
+            'returning_today': dau - new_today,
+        }
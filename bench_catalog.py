@@ -0,0 +1,106 @@
+# bench_catalog.py
+"""
+Compares the memory footprint and lookup speed of the compact MovieCatalog against the
+dict-of-dicts that get_all_movies_data() returns. Runs offline on a synthetic catalog:
+
+    python bench_catalog.py --movies 100000
+"""
+import argparse
+import datetime
+import gc
+import random
+import timeit
+import tracemalloc
+
+from movie_catalog import MovieCatalog
+
+
+def make_documents(count: int, seed: int):
+    """Builds movie dicts shaped like Firestore's to_dict() output, including a datetime timestamp."""
+    words = ["avatar", "spiderman", "tarjima", "kino", "qasoskorlar", "titanik", "forsaj", "shrek", "jumong", "batman"]
+    rng = random.Random(seed)
+    base_time = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    documents = {}
+    for code in range(1, count + 1):
+        name = " ".join(rng.choice(words).capitalize() for _ in range(rng.randint(1, 3))) + f" {code % 500}"
+        documents[str(code)] = {
+            'file_id': f"BAACAgIAAxkBAAI{code:012d}{rng.getrandbits(64):016x}",
+            'name': name,
+            'timestamp': base_time + datetime.timedelta(seconds=code * 37),
+        }
+    return documents
+
+
+# A frequent word, a specific title and a miss, like real user queries
+SEARCH_QUERIES = ["avatar", "shrek jumong 12", "interstellar"]
+
+
+def fresh_documents(source: dict):
+    """Yields (code, dict) pairs built from new objects, as if freshly decoded from Firestore."""
+    for code, data in source.items():
+        yield code.encode().decode(), {
+            'file_id': data['file_id'].encode().decode(),
+            'name': data['name'].encode().decode(),
+            'timestamp': datetime.datetime.fromtimestamp(data['timestamp'].timestamp(), datetime.timezone.utc),
+        }
+
+
+def measure_memory(build):
+    """Returns (result, bytes allocated) for building a structure with build()."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def dict_search(movies: dict, query: str):
+    # The name search handle_code_or_name did before the compact catalog
+    return [{'code': code, 'data': data} for code, data in movies.items() if query in data['name'].lower()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MovieCatalog against dict-of-dicts.")
+    parser.add_argument("--movies", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=200000, help="Code lookups per timing run")
+    parser.add_argument("--searches", type=int, default=20, help="Name searches per timing run")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    source = make_documents(args.movies, args.seed)
+    dict_of_dicts, dict_bytes = measure_memory(lambda: dict(fresh_documents(source)))
+
+    def build_catalog():
+        catalog = MovieCatalog.from_documents(fresh_documents(source))
+        catalog.search("warm-up") # Include the lazily built search string in the measurement
+        return catalog
+
+    catalog, catalog_bytes = measure_memory(build_catalog)
+
+    rng = random.Random(args.seed)
+    codes = [str(rng.randint(1, args.movies * 2)) for _ in range(args.lookups)] # ~50% misses
+
+    dict_lookup = timeit.timeit(lambda: [dict_of_dicts.get(code) for code in codes], number=3) / 3
+    catalog_lookup = timeit.timeit(lambda: [catalog.get(code) for code in codes], number=3) / 3
+    search_times = []
+    for query in SEARCH_QUERIES:
+        search_times.append((
+            query,
+            timeit.timeit(lambda: dict_search(dict_of_dicts, query), number=args.searches) / args.searches,
+            timeit.timeit(lambda: catalog.search(query), number=args.searches) / args.searches,
+            len(catalog.search(query)),
+        ))
+
+    print(f"Movies: {args.movies}")
+    print(f"{'':28}{'dict-of-dicts':>16}{'MovieCatalog':>16}")
+    print(f"{'Memory (MiB)':28}{dict_bytes / 2 ** 20:>16.1f}{catalog_bytes / 2 ** 20:>16.1f}")
+    print(f"{'Bytes per movie':28}{dict_bytes / args.movies:>16.0f}{catalog_bytes / args.movies:>16.0f}")
+    print(f"{'Code lookup (ns)':28}{dict_lookup / args.lookups * 1e9:>16.0f}{catalog_lookup / args.lookups * 1e9:>16.0f}")
+    for query, dict_time, catalog_time, matches in search_times:
+        label = f"Search '{query}' (ms)"
+        print(f"{label:28}{dict_time * 1e3:>16.2f}{catalog_time * 1e3:>16.2f}   ({matches} matches)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# bench_json.py
+"""
+Measures the per-update cost of the JSON codecs in json_codec.py on recorded webhook traffic
+(WEBHOOK_RECORD_FILE / load_replay.py format). For every codec it times decoding the raw
+update body, as SimpleRequestHandler does, and encoding the update again, which stands in for
+the reply markups and entities the session encodes on outgoing calls:
+
+    python bench_json.py recorded_updates.jsonl --rounds 200
+
+aiogram's pydantic validation of the decoded update is timed as well, for scale.
+"""
+import argparse
+import json
+import timeit
+
+from aiogram.types import Update
+
+from json_codec import CODECS
+
+
+def load_bodies(path: str):
+    """Returns the recorded updates as raw request bodies (bytes), as Telegram would post them."""
+    bodies = []
+    with open(path, encoding="utf-8") as record_file:
+        for line in record_file:
+            if line.strip():
+                bodies.append(json.dumps(json.loads(line)["update"], ensure_ascii=False).encode())
+    return bodies
+
+
+def per_update_us(function, items, rounds: int) -> float:
+    total = timeit.timeit(lambda: [function(item) for item in items], number=rounds)
+    return total / rounds / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON codecs on recorded webhook updates.")
+    parser.add_argument("recording", help="JSON-lines file written with WEBHOOK_RECORD_FILE")
+    parser.add_argument("--rounds", type=int, default=200, help="Passes over the recording per timing run")
+    args = parser.parse_args()
+
+    bodies = load_bodies(args.recording)
+    updates = [json.loads(body) for body in bodies]
+    print(f"Updates: {len(bodies)}, average body {sum(map(len, bodies)) / len(bodies):.0f} bytes")
+    print(f"{'Codec':10}{'parse (us)':>14}{'serialize (us)':>16}")
+    for name, (loads, dumps) in CODECS.items():
+        parse = per_update_us(loads, bodies, args.rounds)
+        serialize = per_update_us(dumps, updates, args.rounds)
+        print(f"{name:10}{parse:>14.2f}{serialize:>16.2f}")
+    validate = per_update_us(Update.model_validate, updates, max(1, args.rounds // 10))
+    print(f"For scale, Update.model_validate: {validate:.2f} us per update")
+
+
+if __name__ == "__main__":
+    main()
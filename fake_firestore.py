@@ -0,0 +1,392 @@
+# fake_firestore.py
+"""
+In-memory stand-in for the small part of the Firestore client API that firebase_utils.py uses.
+Enabled with FIREBASE_FAKE=1 so the bot can run locally (load tests, webhook replays)
+without credentials or Firestore quota.
+
+It is NOT a full emulator: only the calls the bot makes are supported, and queries are
+evaluated by scanning the collection. Optional artificial latency (FIREBASE_FAKE_LATENCY_MS)
+makes load tests behave more like the real network-bound client.
+"""
+import copy
+import datetime
+import json
+import threading
+import time
+
+from google.api_core.exceptions import AlreadyExists
+
+
+class FakeAggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, field_paths=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and field_paths is not None:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        # Stored documents are never mutated in place (writes replace them), so no copy is needed here
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self.exists else None
+
+    def get(self, field_path):
+        value = self._data
+        for part in field_path.split('.'):
+            value = value[part]
+        return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection_name, document_id):
+        self._client = client
+        self._collection_name = collection_name
+        self.id = document_id
+
+    def get(self, field_paths=None, **kwargs):
+        self._client._simulate_latency()
+        with self._client._lock:
+            data = self._client._collection(self._collection_name).get(self.id)
+            return FakeDocumentSnapshot(self, data, field_paths)
+
+    def set(self, document_data, merge=False, **kwargs):
+        self._client._simulate_latency()
+        with self._client._lock:
+            self._set(document_data, merge)
+
+    def create(self, document_data, **kwargs):
+        self._client._simulate_latency()
+        with self._client._lock:
+            documents = self._client._collection(self._collection_name)
+            if self.id in documents:
+                raise AlreadyExists(f"Document already exists: {self._collection_name}/{self.id}")
+            documents[self.id] = self._client._apply({}, document_data, deep_merge=False)
+
+    def update(self, field_updates, **kwargs):
+        self._client._simulate_latency()
+        with self._client._lock:
+            self._update(field_updates)
+
+    def delete(self, **kwargs):
+        self._client._simulate_latency()
+        with self._client._lock:
+            self._delete()
+
+    # The methods below apply a write without latency; callers hold the client lock
+
+    def _set(self, document_data, merge):
+        documents = self._client._collection(self._collection_name)
+        current = documents.get(self.id) if merge else None
+        documents[self.id] = self._client._apply(copy.deepcopy(current) if current else {}, document_data,
+                                                  deep_merge=merge)
+
+    def _update(self, field_updates):
+        documents = self._client._collection(self._collection_name)
+        if self.id not in documents:
+            raise KeyError(f"No document to update: {self._collection_name}/{self.id}")
+        data = copy.deepcopy(documents[self.id])
+        for field_path, value in field_updates.items():
+            # Dotted keys address nested fields, like Firestore's update()
+            *parents, leaf = field_path.split('.')
+            target = data
+            for part in parents:
+                target = target.setdefault(part, {})
+            self._client._apply(target, {leaf: value}, deep_merge=False)
+        documents[self.id] = data
+
+    def _delete(self):
+        self._client._collection(self._collection_name).pop(self.id, None)
+
+
+class FakeQuery:
+    def __init__(self, client, collection_name):
+        self._client = client
+        self._collection_name = collection_name
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._field_paths = None
+        self._start_after = None
+
+    def _copy(self):
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        query = self._copy()
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        query = self._copy()
+        query._orders.append((str(field_path), direction == "DESCENDING"))
+        return query
+
+    def limit(self, count):
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def select(self, field_paths):
+        query = self._copy()
+        query._field_paths = list(field_paths)
+        return query
+
+    def start_after(self, document_fields_or_snapshot):
+        query = self._copy()
+        query._start_after = document_fields_or_snapshot
+        return query
+
+    def count(self, alias='count'):
+        return FakeAggregationQuery(self, alias)
+
+    def _matching(self):
+        with self._client._lock:
+            documents = list(self._client._collection(self._collection_name).items())
+        rows = [(document_id, data) for document_id, data in documents
+                if all(_matches(document_id, data, *condition) for condition in self._filters)]
+        # Like Firestore, documents missing an ordered field are left out of the result
+        rows = [row for row in rows if all(_field(*row, field) is not _MISSING for field, _ in self._orders)]
+        order = self._orders or [("__name__", False)]
+        for field, descending in reversed(order):
+            rows.sort(key=lambda row: _sort_key(_field(*row, field)), reverse=descending)
+        if self._start_after is not None:
+            rows = rows[self._start_position(rows, order):]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return rows
+
+    def _start_position(self, rows, order):
+        cursor = self._start_after
+        if isinstance(cursor, FakeDocumentSnapshot):
+            cursor_row = (cursor.id, cursor._data or {})
+            cursor_key = [_sort_key(_field(*cursor_row, field)) for field, _ in order]
+        else:
+            cursor_key = [_sort_key(cursor["__name__"] if field == "__name__" else cursor[field])
+                          for field, _ in order]
+        for position, row in enumerate(rows):
+            row_key = [_sort_key(_field(*row, field)) for field, _ in order]
+            after = False
+            for (field, descending), row_value, cursor_value in zip(order, row_key, cursor_key):
+                if row_value != cursor_value:
+                    after = (row_value < cursor_value) if descending else (row_value > cursor_value)
+                    break
+            if after:
+                return position
+        return len(rows)
+
+    def stream(self, **kwargs):
+        self._client._simulate_latency()
+        for document_id, data in self._matching():
+            reference = FakeDocumentReference(self._client, self._collection_name, document_id)
+            yield FakeDocumentSnapshot(reference, data, self._field_paths)
+
+    def get(self, **kwargs):
+        return list(self.stream(**kwargs))
+
+
+class FakeAggregationQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, **kwargs):
+        self._query._client._simulate_latency()
+        return [[FakeAggregationResult(self._alias, len(self._query._matching()))]]
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, collection_name):
+        super().__init__(client, collection_name)
+        self.id = collection_name
+
+    def document(self, document_id):
+        return FakeDocumentReference(self._client, self._collection_name, document_id)
+
+
+class FakeWriteBatch:
+    """Collects writes and applies them together, atomically with respect to other fake calls."""
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(lambda: reference._set(document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(lambda: reference._update(field_updates))
+
+    def delete(self, reference):
+        self._writes.append(reference._delete)
+
+    def commit(self, **kwargs):
+        # One round trip for the whole batch, taken outside the lock so other calls are not held up
+        self._client._simulate_latency()
+        with self._client._lock:
+            for write in self._writes:
+                write()
+        self._writes = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Transaction for functions decorated with firestore.transactional. Transactions run one at
+    a time (from _begin() to commit or rollback) and their writes are applied together on commit,
+    so a read-modify-write inside one cannot lose a concurrent transaction's write.
+    Writes made outside of transactions are not held back, unlike on the real server.
+    """
+    _max_attempts = 1
+    _read_only = False
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    # The methods below are the ones firestore.transactional calls
+
+    def _begin(self, retry_id=None):
+        self._client._transaction_lock.acquire()
+        self._id = b"fake-transaction"
+
+    def _clean_up(self):
+        self._writes = []
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._end()
+
+    def _rollback(self):
+        self._writes = []
+        self._end()
+
+    def _end(self):
+        if self._id is not None:
+            self._id = None
+            self._client._transaction_lock.release()
+
+
+class FakeFirestoreClient:
+    """
+    Thread-safe, in-memory replacement for google.cloud.firestore.Client.
+    `server_timestamp` is the SDK's SERVER_TIMESTAMP sentinel; it is replaced with the
+    current UTC time on write, as the real server does.
+    """
+    def __init__(self, server_timestamp=None, seed_path=None, latency_ms=0.0):
+        self._collections = {}
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.Lock()
+        self._server_timestamp = server_timestamp
+        self._latency = latency_ms / 1000.0
+        if seed_path:
+            with open(seed_path, encoding='utf-8') as seed_file:
+                for collection_name, documents in json.load(seed_file).items():
+                    self._collections[collection_name] = dict(documents)
+
+    def collection(self, collection_name):
+        return FakeCollectionReference(self, collection_name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def _collection(self, collection_name):
+        return self._collections.setdefault(collection_name, {})
+
+    def _simulate_latency(self):
+        if self._latency:
+            time.sleep(self._latency)
+
+    def _apply(self, target, values, deep_merge):
+        """Writes values into target, resolving field transforms like SERVER_TIMESTAMP."""
+        for key, value in values.items():
+            if self._server_timestamp is not None and value is self._server_timestamp:
+                target[key] = datetime.datetime.now(datetime.timezone.utc)
+            elif type(value).__name__ == 'Sentinel' and 'delete' in getattr(value, 'description', '').lower():
+                target.pop(key, None)
+            elif type(value).__name__ == 'Increment':
+                target[key] = target.get(key, 0) + value.value
+            elif type(value).__name__ == 'ArrayUnion':
+                current = list(target.get(key) or [])
+                target[key] = current + [item for item in value.values if item not in current]
+            elif type(value).__name__ == 'ArrayRemove':
+                target[key] = [item for item in target.get(key) or [] if item not in value.values]
+            elif deep_merge and isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._apply(target[key], value, deep_merge=True)
+            elif isinstance(value, dict):
+                target[key] = self._apply({}, value, deep_merge=False)
+            else:
+                target[key] = value
+        return target
+
+
+_MISSING = object()
+
+
+def _field(document_id, data, field_path):
+    if field_path == "__name__":
+        return document_id
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _sort_key(value):
+    # Firestore orders values by type first; this is enough for the types the bot stores
+    if value is None or value is _MISSING:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime.datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    return (5, repr(value))
+
+
+def _matches(document_id, data, field_path, op_string, value):
+    actual = _field(document_id, data, field_path)
+    if actual is _MISSING:
+        return False
+    if op_string == "==":
+        return actual == value
+    if op_string == "!=":
+        return actual != value
+    if op_string == "in":
+        return actual in value
+    if op_string == "not-in":
+        return actual not in value
+    if op_string == "array_contains":
+        return isinstance(actual, list) and value in actual
+    if op_string == "array_contains_any":
+        return isinstance(actual, list) and any(item in actual for item in value)
+    actual_key, value_key = _sort_key(actual), _sort_key(value)
+    if actual_key[0] != value_key[0]:
+        return False # Range filters only match values of the same type
+    if op_string == "<":
+        return actual_key < value_key
+    if op_string == "<=":
+        return actual_key <= value_key
+    if op_string == ">":
+        return actual_key > value_key
+    if op_string == ">=":
+        return actual_key >= value_key
+    raise ValueError(f"Unsupported operator in fake Firestore: {op_string}")
@@ -1,10 +1,20 @@
 # firebase_utils.py
 import os
 import json
+import asyncio
+import hashlib
+import math
+import threading
+import time
+import datetime
 import base64 # New import for base64 decoding
+from collections import Counter, OrderedDict, deque
+from functools import wraps
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists
 from dotenv import load_dotenv
+from movie_catalog import MovieCatalog, normalize_movie_name, name_tokens, code_sort_key
 
 # Load environment variables for local development (ignored by Heroku)
 load_dotenv()
@@ -13,6 +23,92 @@ load_dotenv()
 # It will be initialized once when init_firebase() is called.
 db = None
 
+# --- FIRESTORE CONNECTION TUNING ---
+# gRPC channel options applied when the Firestore channel is first opened (see init_firebase()).
+FIRESTORE_KEEPALIVE_TIME_MS = int(os.getenv("FIRESTORE_KEEPALIVE_TIME_MS", "30000"))
+FIRESTORE_KEEPALIVE_TIMEOUT_MS = int(os.getenv("FIRESTORE_KEEPALIVE_TIMEOUT_MS", "10000"))
+# Keep pinging an idle channel so the first request after a quiet period doesn't reconnect.
+FIRESTORE_KEEPALIVE_WITHOUT_CALLS = os.getenv("FIRESTORE_KEEPALIVE_WITHOUT_CALLS", "true").lower() in ("1", "true", "yes")
+# "true" gives the client its own subchannel (connection) pool instead of gRPC's process-wide one.
+FIRESTORE_LOCAL_SUBCHANNEL_POOL = os.getenv("FIRESTORE_LOCAL_SUBCHANNEL_POOL", "false").lower() in ("1", "true", "yes")
+# Deadline in seconds for every kind of Firestore call whose own deadline below is not set.
+FIRESTORE_CALL_TIMEOUT = os.getenv("FIRESTORE_CALL_TIMEOUT")
+# Per-operation deadlines in seconds: point reads, queries, writes and whole-collection scans.
+# They are passed to the SDK and also bound how long async callers wait (see _single_flight()).
+FIRESTORE_DEADLINES = {
+    'read': float(os.getenv("FIRESTORE_READ_DEADLINE") or FIRESTORE_CALL_TIMEOUT or "3"),
+    'query': float(os.getenv("FIRESTORE_QUERY_DEADLINE") or FIRESTORE_CALL_TIMEOUT or "8"),
+    'write': float(os.getenv("FIRESTORE_WRITE_DEADLINE") or FIRESTORE_CALL_TIMEOUT or "8"),
+    'scan': float(os.getenv("FIRESTORE_SCAN_DEADLINE") or FIRESTORE_CALL_TIMEOUT or "60"),
+}
+# Consecutive failed or timed-out calls that open the circuit breaker, and how long it stays
+# open before one trial call is let through.
+FIRESTORE_BREAKER_FAILURES = int(os.getenv("FIRESTORE_BREAKER_FAILURES", "5"))
+FIRESTORE_BREAKER_RESET_SECONDS = float(os.getenv("FIRESTORE_BREAKER_RESET_SECONDS", "30"))
+
+# --- CATALOG CACHE CONFIG ---
+# The full catalog is kept in memory as a compact MovieCatalog and reloaded when older than this.
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "60"))
+# Set to "false" on memory-constrained hosts: handlers then stream only the fields they need
+# page by page (see stream_movies_async()) instead of holding the whole catalog in memory.
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Refresh the cached catalog with delta queries (documents whose 'timestamp' is newer than the last
+# sync, plus tombstones of deleted codes) instead of re-reading the whole collection.
+CATALOG_DELTA_SYNC_ENABLED = os.getenv("CATALOG_DELTA_SYNC_ENABLED", "true").lower() in ("1", "true", "yes")
+# Full reload interval as a safety net for changes made outside this code (e.g. in the Firebase console)
+CATALOG_FULL_RELOAD_SECONDS = float(os.getenv("CATALOG_FULL_RELOAD_SECONDS", "3600"))
+# Every save and delete also increments a shared catalog version document. Each worker watches it
+# ("listener": a Firestore snapshot listener, "poll": a point read every CATALOG_VERSION_POLL_SECONDS,
+# "off": rely on the TTL alone) and delta-syncs its cache as soon as another worker changes the catalog.
+CATALOG_VERSION_WATCH = os.getenv("CATALOG_VERSION_WATCH", "listener").lower()
+CATALOG_VERSION_POLL_SECONDS = float(os.getenv("CATALOG_VERSION_POLL_SECONDS", "5"))
+# Documents per page for streaming catalog reads
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "500"))
+# Search names in Firestore (see search_movies_by_name()) when the catalog is not loaded,
+# instead of streaming every name. Needs the fields written by backfill_name_search_fields().
+NAME_SEARCH_SERVER_SIDE = os.getenv("NAME_SEARCH_SERVER_SIDE", "true").lower() in ("1", "true", "yes")
+# Maximum documents read per query by the server-side name search
+NAME_SEARCH_LIMIT = int(os.getenv("NAME_SEARCH_LIMIT", "50"))
+# Firestore accepts at most 500 writes per batch
+_MAX_BATCH_WRITES = 500
+
+# --- MOVIE CODE LOOKUP FILTER CONFIG ---
+# A Bloom filter of existing movie codes lets get_movie_data() answer "definitely not a code"
+# without a Firestore read (most text messages are movie names, not codes).
+# Misses confirmed by Firestore are also remembered in a short-TTL negative cache.
+MOVIE_CODE_FILTER_CAPACITY = int(os.getenv("MOVIE_CODE_FILTER_CAPACITY", "200000"))
+MOVIE_CODE_FILTER_ERROR_RATE = float(os.getenv("MOVIE_CODE_FILTER_ERROR_RATE", "0.01"))
+# The filter is refreshed this often, so codes saved by other workers are picked up: through a
+# delta sync of the cached catalog when there is one, otherwise by a keys-only scan of 'movies'.
+MOVIE_CODE_FILTER_REFRESH_SECONDS = float(os.getenv("MOVIE_CODE_FILTER_REFRESH_SECONDS", "300"))
+NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "30"))
+NEGATIVE_CACHE_MAX_SIZE = int(os.getenv("NEGATIVE_CACHE_MAX_SIZE", "10000"))
+
+def _call_options(operation: str):
+    """Keyword arguments passed to every Firestore call (currently the deadline for its kind of operation)."""
+    return {'timeout': FIRESTORE_DEADLINES[operation]}
+
+def _apply_channel_tuning():
+    """
+    Replaces the Firestore SDK's default gRPC channel options with our tuned ones.
+    Must run before the channel is first opened. The SDK has no public hook for this,
+    so if its internals change we keep the defaults rather than failing startup.
+    """
+    try:
+        from google.cloud.firestore_v1 import base_client
+        base_client._DEFAULT_CHANNEL_OPTIONS = [
+            option for option in base_client._DEFAULT_CHANNEL_OPTIONS
+            if not option[0].startswith("grpc.keepalive")
+        ] + [
+            ("grpc.keepalive_time_ms", FIRESTORE_KEEPALIVE_TIME_MS),
+            ("grpc.keepalive_timeout_ms", FIRESTORE_KEEPALIVE_TIMEOUT_MS),
+            ("grpc.keepalive_permit_without_calls", int(FIRESTORE_KEEPALIVE_WITHOUT_CALLS)),
+            ("grpc.http2.max_pings_without_data", 0),
+            ("grpc.use_local_subchannel_pool", int(FIRESTORE_LOCAL_SUBCHANNEL_POOL)),
+        ]
+    except Exception as e:
+        print(f"Firebase: Could not apply gRPC channel tuning ({e}). Using SDK defaults.")
+
 def init_firebase():
     """
     Initializes the Firebase Admin SDK.
@@ -22,9 +118,22 @@ def init_firebase():
     """
     global db
 
+    # --- LOCAL LOAD TESTING: in-memory Firestore stand-in ---
+    # FIREBASE_FAKE=1 runs the bot against fake_firestore.py instead of a real project.
+    if os.getenv("FIREBASE_FAKE", "").lower() in ("1", "true", "yes"):
+        from fake_firestore import FakeFirestoreClient
+        db = FakeFirestoreClient(
+            server_timestamp=firestore.SERVER_TIMESTAMP,
+            seed_path=os.getenv("FIREBASE_FAKE_SEED"), # Optional JSON file: {"movies": {"<code>": {...}}}
+            latency_ms=float(os.getenv("FIREBASE_FAKE_LATENCY_MS", "0"))
+        )
+        print("Firebase: Using in-memory fake Firestore (FIREBASE_FAKE is set).")
+        return
+
     # Check if Firebase has already been initialized to prevent multiple initializations
     if firebase_admin._apps:
         print("Firebase app already initialized. Skipping initialization.")
+        _apply_channel_tuning()
         db = firestore.client() # Ensure db client is set even if already initialized
         return
 
@@ -76,43 +185,589 @@ def init_firebase():
             exit(1) # Exit the application
 
     # Once Firebase is initialized, get the Firestore client
+    _apply_channel_tuning()
     db = firestore.client()
     print("Firestore client successfully obtained.")
 
 
-def save_movie_data(code: str, file_id: str, name: str):
+class FirestoreUnavailableError(Exception):
+    """Raised instead of calling Firestore while the circuit breaker is open, or when a call timed out."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing backend: after `failure_threshold` consecutive failures the breaker
+    opens and calls are rejected immediately. After `reset_timeout` seconds one trial call is
+    let through (half-open); its success closes the breaker, its failure opens it again.
+    """
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.stats = Counter() # 'failures', 'opened', 'rejected'
+        self._failures = 0
+        self._opened_at = None # Monotonic time the breaker (re)opened; None while closed
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        return 'open' if time.monotonic() - self._opened_at < self.reset_timeout else 'half-open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print("Firebase: Circuit breaker closed; Firestore calls resumed.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self.stats['failures'] += 1
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.stats['opened'] += 1
+                print(f"Firebase: Circuit breaker opened after {self._failures} consecutive failures; "
+                      f"retrying in {self.reset_timeout:.0f}s.")
+            self._trial_in_flight = False
+
+
+firestore_breaker = CircuitBreaker(FIRESTORE_BREAKER_FAILURES, FIRESTORE_BREAKER_RESET_SECONDS)
+
+
+def _guarded(func):
+    """
+    Runs a Firestore helper through the circuit breaker. Raises FirestoreUnavailableError
+    without calling Firestore while the breaker is open. Guarded helpers must not call each other.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not firestore_breaker.allow():
+            raise FirestoreUnavailableError(f"Firestore circuit breaker is open ({func.__name__} not attempted)")
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            firestore_breaker.record_failure()
+            raise
+        firestore_breaker.record_success()
+        return result
+    return wrapper
+
+
+class BloomFilter:
+    """
+    A compact set-membership filter over strings with no false negatives.
+    Sized for `capacity` items at the given false-positive `error_rate`.
+    Items cannot be removed; deleted codes are covered by the negative cache instead.
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: derive all bit positions from one 128-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+# Filter state shared by all threads running Firestore helpers
+_code_filter = None
+_code_filter_built_at = 0.0
+_code_filter_lock = threading.Lock()
+_background_refresh_lock = threading.Lock() # Held while a lookup-triggered catalog refresh runs
+_negative_cache = OrderedDict() # code -> monotonic expiry time
+_negative_cache_lock = threading.Lock()
+# Counts how get_movie_data() lookups were answered: 'negative_cache', 'filter', 'firestore'
+movie_lookup_stats = Counter()
+
+
+def _is_valid_document_id(code: str) -> bool:
+    """Returns False for strings Firestore can never use as a document ID."""
+    return (0 < len(code.encode('utf-8')) <= 1500 and '/' not in code and code not in ('.', '..')
+            and not (code.startswith('__') and code.endswith('__')))
+
+def _rebuild_code_filter(codes):
+    """Builds a fresh Bloom filter from the given codes and swaps it in atomically."""
+    global _code_filter, _code_filter_built_at
+    codes = list(codes)
+    new_filter = BloomFilter(max(MOVIE_CODE_FILTER_CAPACITY, len(codes) * 2), MOVIE_CODE_FILTER_ERROR_RATE)
+    for code in codes:
+        new_filter.add(code)
+    _code_filter = new_filter
+    _code_filter_built_at = time.monotonic()
+
+def _refresh_catalog_in_background():
+    """Starts a get_movie_catalog() refresh in a daemon thread unless one is already running."""
+    if not _background_refresh_lock.acquire(blocking=False):
+        return
+
+    def refresh():
+        try:
+            get_movie_catalog()
+        except Exception as e:
+            print(f"Firebase: Background catalog refresh failed ({e}).")
+        finally:
+            _background_refresh_lock.release()
+
+    threading.Thread(target=refresh, name="catalog-refresh", daemon=True).start()
+
+def _get_code_filter():
+    """
+    Returns the current movie code filter, refreshing it when it is missing or older than
+    MOVIE_CODE_FILTER_REFRESH_SECONDS: with a background delta sync when the catalog is cached
+    (it keeps the filter current; lookups use the current filter meanwhile instead of waiting),
+    otherwise with a keys-only scan. Returns None if no filter is usable, in which case callers
+    must fall back to reading Firestore.
+    """
+    if _code_filter is not None and time.monotonic() - _code_filter_built_at < MOVIE_CODE_FILTER_REFRESH_SECONDS:
+        return _code_filter
+    if _catalog is not None:
+        if not _catalog_is_fresh():
+            _refresh_catalog_in_background() # A fresh catalog means a current filter
+        return _code_filter
+    # Only one thread rebuilds; the others keep using the previous filter (or Firestore) meanwhile.
+    # While the circuit breaker is not closed, keep the previous filter rather than scanning.
+    if firestore_breaker.state == 'closed' and _code_filter_lock.acquire(blocking=False):
+        try:
+            # select([]) projects no fields, so only document IDs are transferred
+            _rebuild_code_filter(doc.id for doc in db.collection('movies').select([]).stream(**_call_options('scan')))
+            print("Firebase: Movie code filter rebuilt.")
+        except Exception as e:
+            firestore_breaker.record_failure()
+            print(f"Firebase: Could not rebuild movie code filter ({e}). Falling back to direct reads.")
+        finally:
+            _code_filter_lock.release()
+    return _code_filter
+
+def _remember_missing_code(code: str):
+    """Adds a code to the negative cache, evicting the oldest entries when full."""
+    with _negative_cache_lock:
+        _negative_cache[code] = time.monotonic() + NEGATIVE_CACHE_TTL_SECONDS
+        _negative_cache.move_to_end(code)
+        while len(_negative_cache) > NEGATIVE_CACHE_MAX_SIZE:
+            _negative_cache.popitem(last=False)
+
+def _is_known_missing_code(code: str) -> bool:
+    """Returns True if the code was confirmed missing within the negative cache TTL."""
+    with _negative_cache_lock:
+        expires_at = _negative_cache.get(code)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _negative_cache[code]
+            return False
+        return True
+
+def _forget_missing_code(code: str):
+    with _negative_cache_lock:
+        _negative_cache.pop(code, None)
+
+
+def warm_up_firestore():
+    """
+    Opens the Firestore gRPC channel and mints the auth token by issuing one cheap read
+    (a single document ID, no fields). Call it before the bot starts taking traffic so the
+    first user request doesn't pay for connection setup. Returns the measured latency in seconds.
+    """
+    if db is None:
+        init_firebase()
+
+    started = time.perf_counter()
+    try:
+        db.collection('movies').select([]).limit(1).get(**_call_options('read'))
+    except Exception as e:
+        print(f"Firebase: Warm-up read failed after {time.perf_counter() - started:.3f}s: {e}")
+        return None
+    latency = time.perf_counter() - started
+    # A second read shows the steady-state latency once the channel is open
+    second_started = time.perf_counter()
+    try:
+        db.collection('movies').select([]).limit(1).get(**_call_options('read'))
+        print(f"Firebase: Warm-up done. First read {latency:.3f}s, "
+              f"warm read {time.perf_counter() - second_started:.3f}s.")
+    except Exception as e:
+        print(f"Firebase: Warm-up done in {latency:.3f}s (second read failed: {e}).")
+    return latency
+
+
+# Cached catalog shared by all handlers; replaced as a whole on full reload
+_catalog = None
+_catalog_loaded_at = 0.0 # Last successful full reload or delta sync (monotonic clock)
+# Incremented whenever this process's view of the movies changes (see catalog_revision())
+_catalog_revision = 0
+_catalog_revision_lock = threading.Lock()
+_catalog_full_loaded_at = 0.0
+# Server-side sync watermarks: newest movie 'timestamp' and tombstone 'deleted_at' seen so far (epoch seconds)
+_catalog_watermark = None
+_tombstone_watermark = None
+_catalog_lock = threading.Lock()
+# Counts catalog requests answered with the last known (stale) catalog ('stale') and
+# catch-ups with changes made by other workers ('version_syncs')
+catalog_stats = Counter()
+
+def _catalog_is_fresh() -> bool:
+    return _catalog is not None and time.monotonic() - _catalog_loaded_at < CATALOG_CACHE_TTL_SECONDS
+
+def _as_datetime(seconds: float):
+    # Step back 1 ms so float rounding never skips a document; re-reading one is harmless
+    return datetime.datetime.fromtimestamp(seconds - 0.001, datetime.timezone.utc)
+
+def _timestamp_of(data: dict, field: str):
+    value = (data or {}).get(field)
+    return value.timestamp() if hasattr(value, 'timestamp') else None
+
+def _load_full_catalog():
+    """Reads the whole 'movies' collection into a new MovieCatalog and resets the sync watermarks."""
+    global _catalog, _catalog_full_loaded_at, _catalog_watermark, _tombstone_watermark
+    catalog = MovieCatalog()
+    watermark = None
+    for doc in db.collection('movies').stream(**_call_options('scan')):
+        data = doc.to_dict()
+        catalog.upsert(doc.id, data)
+        timestamp = _timestamp_of(data, 'timestamp')
+        if timestamp is not None and (watermark is None or timestamp > watermark):
+            watermark = timestamp
+    _rebuild_code_filter(catalog.codes()) # A full scan refreshes the code filter for free
+    _catalog = catalog
+    _bump_catalog_revision()
+    _catalog_full_loaded_at = time.monotonic()
+    # Tombstones older than the newest movie are already reflected in this snapshot
+    _catalog_watermark = _tombstone_watermark = watermark
+    print(f"Firebase: Movie catalog loaded ({len(catalog)} movies).")
+
+def _apply_catalog_delta():
+    """
+    Brings the cached catalog up to date by reading only movies written and tombstones created
+    since the last sync. Costs reads proportional to what changed, not to catalog size.
+    """
+    global _catalog_watermark, _tombstone_watermark, _code_filter_built_at
+    changed = {}
+    for doc in db.collection('movies').where('timestamp', '>=', _as_datetime(_catalog_watermark)) \
+            .stream(**_call_options('query')):
+        changed[doc.id] = doc.to_dict()
+    tombstones = {}
+    tombstone_query = db.collection('movie_tombstones')
+    if _tombstone_watermark is not None:
+        tombstone_query = tombstone_query.where('deleted_at', '>=', _as_datetime(_tombstone_watermark))
+    for doc in tombstone_query.stream(**_call_options('query')):
+        tombstones[doc.id] = _timestamp_of(doc.to_dict(), 'deleted_at') or 0.0
+
+    previous_watermark = _catalog_watermark
+    removed = 0
+    for code, deleted_at in tombstones.items():
+        written_at = _catalog.timestamp(code)
+        # A movie returned by the delta query exists right now; a row newer than the tombstone was re-added
+        if code not in changed and written_at is not None and written_at <= deleted_at:
+            _catalog.remove(code)
+            _remember_missing_code(code)
+            removed += 1
+        if _tombstone_watermark is None or deleted_at > _tombstone_watermark:
+            _tombstone_watermark = deleted_at
+    for code, data in changed.items():
+        _catalog.upsert(code, data)
+        if _code_filter is not None:
+            _code_filter.add(code)
+        _forget_missing_code(code)
+        timestamp = _timestamp_of(data, 'timestamp')
+        if timestamp is not None and timestamp > _catalog_watermark:
+            _catalog_watermark = timestamp
+    if _code_filter is not None:
+        _code_filter_built_at = time.monotonic() # The codes added above keep it current without a scan
+    # The >= queries re-read the newest document each time; only report what is really new
+    new_count = sum(1 for data in changed.values() if (_timestamp_of(data, 'timestamp') or 0) > previous_watermark)
+    if new_count or removed:
+        _bump_catalog_revision()
+        print(f"Firebase: Movie catalog delta applied ({new_count} changed, {removed} removed).")
+
+@_guarded
+def _refresh_catalog():
+    global _catalog_loaded_at
+    needs_full_reload = (
+        _catalog is None or not CATALOG_DELTA_SYNC_ENABLED or _catalog_watermark is None
+        or time.monotonic() - _catalog_full_loaded_at > CATALOG_FULL_RELOAD_SECONDS
+    )
+    if needs_full_reload:
+        _load_full_catalog()
+    else:
+        _apply_catalog_delta()
+    _catalog_loaded_at = time.monotonic()
+
+def get_movie_catalog():
+    """
+    Returns the in-memory MovieCatalog, refreshing it when it is older than CATALOG_CACHE_TTL_SECONDS.
+    Refreshes are incremental (see _apply_catalog_delta()) when possible, and full reloads otherwise.
+    Saves and deletes made through this module are applied to the cached catalog immediately.
+    If the refresh fails or the circuit breaker is open, the last known catalog is returned
+    (see catalog_is_stale()); only a process that never loaded it gets the error.
+    """
+    if db is None:
+        init_firebase()
+
+    with _catalog_lock: # Concurrent callers wait for one load instead of each scanning the collection
+        if _catalog_is_fresh():
+            return _catalog
+        try:
+            _refresh_catalog()
+        except Exception as e:
+            if _catalog is None:
+                raise
+            catalog_stats['stale'] += 1
+            if not isinstance(e, FirestoreUnavailableError):
+                print(f"Firebase: Catalog refresh failed ({e}). Serving the last known catalog.")
+        return _catalog
+
+def _bump_catalog_revision():
+    global _catalog_revision
+    with _catalog_revision_lock: # Saves, deletes and syncs run in different worker threads
+        _catalog_revision += 1
+
+def catalog_revision() -> int:
+    """
+    Changes whenever movies saved, deleted or synced (including other workers' changes picked
+    up through the catalog version) may change lookup results. Use it to key derived caches.
+    """
+    return _catalog_revision
+
+def catalog_is_stale() -> bool:
+    """True while the cached catalog is older than its TTL, i.e. refreshes have been failing."""
+    return _catalog is not None and not _catalog_is_fresh()
+
+def _movie_from_last_known_catalog(code: str, error: Exception):
+    """
+    Answers a movie lookup from the cached catalog when Firestore cannot. Raises
+    FirestoreUnavailableError if no catalog was ever loaded.
+    """
+    if _catalog is None:
+        raise FirestoreUnavailableError(f"Firestore unavailable and no cached catalog ({error})") from error
+    movie_lookup_stats['stale_catalog'] += 1
+    movie = _catalog.get(code)
+    return movie.to_dict() if movie is not None else None
+
+
+def catalog_is_loaded() -> bool:
+    """True once the in-memory catalog exists; refreshing a loaded catalog is cheap (delta sync)."""
+    return _catalog is not None
+
+
+# Catalog version ("epoch") shared by all workers, stored in catalog_meta/version
+_CATALOG_VERSION_BUMP = {'version': firestore.Increment(1), 'updated_at': firestore.SERVER_TIMESTAMP}
+_catalog_version = None # Version this process has caught up with
+_catalog_version_reported = None # Newest version reported by the listener or the last poll
+_catalog_version_changed = threading.Event()
+_catalog_version_stop = threading.Event()
+_catalog_version_watch = None # The snapshot listener's watch handle, if one is used
+
+def _catalog_version_ref():
+    return db.collection('catalog_meta').document('version')
+
+def _version_of(snapshot) -> int:
+    return (snapshot.to_dict() or {}).get('version', 0) if snapshot.exists else 0
+
+@_guarded
+def _read_catalog_version() -> int:
+    return _version_of(_catalog_version_ref().get(**_call_options('read')))
+
+def _on_catalog_version_snapshot(snapshots, changes, read_time):
+    # Runs on the SDK's listener thread: only hand the version over to the watcher thread
+    global _catalog_version_reported
+    for snapshot in snapshots:
+        _catalog_version_reported = _version_of(snapshot)
+    _catalog_version_changed.set()
+
+def _catch_up_with_catalog_version(version: int):
+    """
+    Applies whatever other workers changed up to `version`: a delta sync of the cached catalog,
+    which also updates the code filter and negative cache, or, without a cached catalog,
+    dropping the negative cache and expiring the code filter.
+    """
+    global _catalog_version, _code_filter_built_at
+    if _catalog_version is not None: # The first version seen is only the starting point
+        if _catalog is not None:
+            with _catalog_lock:
+                _refresh_catalog()
+        else:
+            with _negative_cache_lock:
+                _negative_cache.clear()
+            _code_filter_built_at = 0.0 # Rebuilt on the next filtered lookup
+            _bump_catalog_revision()
+        catalog_stats['version_syncs'] += 1
+    _catalog_version = version
+
+def _watch_catalog_version(use_listener: bool):
+    global _catalog_version_reported
+    while not _catalog_version_stop.is_set():
+        try:
+            if not use_listener:
+                _catalog_version_reported = _read_catalog_version()
+            reported = _catalog_version_reported
+            if reported is not None and reported != _catalog_version:
+                _catch_up_with_catalog_version(reported)
+        except Exception as e:
+            # Not caught up: retried on the next change or poll, and the cache TTL still applies
+            if not isinstance(e, FirestoreUnavailableError):
+                print(f"Firebase: Catalog version sync failed ({e}).")
+        # With a listener this wakes on the next change; the timeout only retries a failed sync
+        _catalog_version_changed.wait(CATALOG_VERSION_POLL_SECONDS)
+        _catalog_version_changed.clear()
+
+def start_catalog_version_watch():
+    """
+    Starts following the shared catalog version in a daemon thread (see CATALOG_VERSION_WATCH),
+    so saves and deletes made by other workers reach this process's caches within seconds.
+    """
+    global _catalog_version_watch
+    if CATALOG_VERSION_WATCH == 'off':
+        return
+    if db is None:
+        init_firebase()
+    # The in-memory fake Firestore has no snapshot listeners; poll it instead
+    use_listener = CATALOG_VERSION_WATCH == 'listener' and hasattr(_catalog_version_ref(), 'on_snapshot')
+    _catalog_version_stop.clear()
+    if use_listener:
+        _catalog_version_watch = _catalog_version_ref().on_snapshot(_on_catalog_version_snapshot)
+    threading.Thread(target=_watch_catalog_version, args=(use_listener,), name="catalog-version-watch",
+                     daemon=True).start()
+    print(f"Firebase: Following the catalog version ({'listener' if use_listener else 'polling'}).")
+
+def stop_catalog_version_watch():
+    global _catalog_version_watch
+    _catalog_version_stop.set()
+    _catalog_version_changed.set()
+    if _catalog_version_watch is not None:
+        _catalog_version_watch.unsubscribe()
+        _catalog_version_watch = None
+
+
+def _name_search_fields(name: str) -> dict:
+    """Precomputed fields that let Firestore answer name searches (see search_movies_by_name())."""
+    normalized = normalize_movie_name(name)
+    return {'name_normalized': normalized, 'name_tokens': name_tokens(normalized)}
+
+
+@_guarded
+def save_movie_data(code: str, file_id: str, name: str, file_unique_id: str = None):
     """
     Saves movie data to the 'movies' collection in Firestore.
     Each movie is stored as a document with its 'code' as the Document ID.
-    Includes a server timestamp for when the movie was added.
+    Includes a server timestamp for when the movie was added, and the normalized
+    name fields used by the server-side name search.
+    With a file_unique_id (the same for every upload of a file), the file is also recorded in
+    the 'movie_files' index used by find_movie_by_file().
     """
     if db is None: # Defensive check: ensure db is initialized before use
         init_firebase() # Re-initialize if for some reason it's None (shouldn't happen in normal flow)
 
     movie_ref = db.collection('movies').document(code)
-    movie_ref.set({
-        'file_id': file_id,
-        'name': name,
+    movie = {'file_id': file_id, 'name': name}
+    if file_unique_id:
+        movie['file_unique_id'] = file_unique_id
+    # Bump the catalog version in the same atomic batch so other workers pick the movie up
+    batch = db.batch()
+    batch.set(movie_ref, {
+        **movie,
+        **_name_search_fields(name),
         'timestamp': firestore.SERVER_TIMESTAMP
     })
+    if file_unique_id:
+        batch.set(db.collection('movie_files').document(file_unique_id), {'code': code})
+    batch.set(_catalog_version_ref(), _CATALOG_VERSION_BUMP, merge=True)
+    batch.commit(**_call_options('write'))
+    # Keep the lookup filters and the cached catalog in sync so the new code is found immediately
+    if _code_filter is not None:
+        _code_filter.add(code)
+    with _catalog_lock: # A full reload in progress would otherwise replace the catalog without the movie
+        if _catalog is not None:
+            _catalog.upsert(code, {**movie, 'timestamp': time.time()})
+    _forget_missing_code(code)
+    _bump_catalog_revision()
     print(f"Firebase: Movie '{name}' with code '{code}' saved.")
 
-def get_movie_data(code: str):
+@_guarded
+def _read_movie_document(code: str):
+    return db.collection('movies').document(code).get(**_call_options('read'))
+
+def get_movie_data(code: str, use_filters: bool = True):
     """
     Retrieves a single movie's data from the 'movies' collection by its 'code'.
     Returns a dictionary of movie data if found, otherwise None.
+    Unless use_filters is False, the negative cache and the movie code Bloom filter are
+    consulted first so most non-existent codes are answered without a Firestore read,
+    and if Firestore fails (or its circuit breaker is open) the cached catalog answers instead.
+    Pass use_filters=False when the answer must be authoritative (e.g. code uniqueness checks).
+    A code merged into another movie (see merge_duplicate_movies()) returns that movie's data.
     """
     if db is None:
         init_firebase()
 
-    movie_ref = db.collection('movies').document(code)
-    doc = movie_ref.get()
+    if not _is_valid_document_id(code):
+        return None
+
+    if use_filters:
+        if _is_known_missing_code(code):
+            movie_lookup_stats['negative_cache'] += 1
+            return None
+        code_filter = _get_code_filter()
+        if code_filter is not None and code not in code_filter:
+            movie_lookup_stats['filter'] += 1
+            return None
+
+    movie_lookup_stats['firestore'] += 1
+    try:
+        doc = _read_movie_document(code)
+    except Exception as e:
+        if not use_filters:
+            raise # Authoritative lookups must not be answered from a possibly stale catalog
+        if not isinstance(e, FirestoreUnavailableError):
+            print(f"Firebase: Reading movie '{code}' failed ({e}). Answering from the last known catalog.")
+        return _movie_from_last_known_catalog(code, e)
     if doc.exists:
-        return doc.to_dict()
+        _forget_missing_code(code)
+        data = doc.to_dict()
+        if data.get('alias_of'):
+            return _follow_movie_alias(code, data['alias_of'], use_filters)
+        return data
     else:
-        print(f"Firebase: Movie with code '{code}' not found.")
+        _remember_missing_code(code)
         return None
 
+def _follow_movie_alias(code: str, target_code: str, use_filters: bool):
+    """Reads the movie a merged code points to; None if that movie has been deleted since."""
+    if not _is_valid_document_id(target_code):
+        return None
+    try:
+        doc = _read_movie_document(target_code)
+    except Exception as e:
+        if not use_filters:
+            raise
+        return _movie_from_last_known_catalog(code, e)
+    data = doc.to_dict() if doc.exists else None
+    return data if data and not data.get('alias_of') else None
+
+@_guarded
 def get_all_movies_data():
     """
     Retrieves all movie data from the 'movies' collection.
@@ -121,24 +776,236 @@ def get_all_movies_data():
     if db is None:
         init_firebase()
 
-    movies_collection = db.collection('movies').stream()
+    movies_collection = db.collection('movies').stream(**_call_options('scan'))
     all_movies = {}
     for doc in movies_collection:
         all_movies[doc.id] = doc.to_dict()
+    _rebuild_code_filter(all_movies.keys()) # A full scan refreshes the code filter for free
     print(f"Firebase: Retrieved {len(all_movies)} movies.")
     return all_movies
 
+def iter_movie_pages(fields=('name',), page_size: int = CATALOG_PAGE_SIZE, include_aliases: bool = False):
+    """
+    Generator over the 'movies' collection that yields pages (lists) of (code, data) pairs,
+    where data holds only the requested fields (pass an empty tuple for codes only).
+    Uses field projection and document-ID cursors, so only the needed bytes are transferred
+    and at most one page is held in memory at a time.
+    Codes merged into another movie are left out unless include_aliases is True.
+    """
+    if db is None:
+        init_firebase()
+
+    projection = list(fields) if include_aliases else [*fields, 'alias_of']
+    query = db.collection('movies').select(projection).order_by('__name__').limit(page_size)
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc is not None else query
+        docs = page_query.get(**_call_options('query'))
+        page = [(doc.id, doc.to_dict()) for doc in docs]
+        if not include_aliases:
+            page = [(code, data) for code, data in page if not data.get('alias_of')]
+        if page:
+            yield page
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+@_guarded
+def search_movies_by_name(query: str, limit: int = NAME_SEARCH_LIMIT):
+    """
+    Searches movie names in Firestore without downloading the collection, for when the
+    in-memory catalog is not available. Returns (code, data) pairs whose normalized name
+    contains the normalized query.
+    Two indexed queries find the candidates: names starting with the query (a range query
+    on 'name_normalized') and names containing the query's longest word ('array_contains'
+    on 'name_tokens'). Unlike the in-memory search, a query that only matches the middle of
+    a word is not found. Documents saved before these fields existed need
+    backfill_name_search_fields() first.
+    """
+    if db is None:
+        init_firebase()
+
+    normalized = normalize_movie_name(query)
+    if not normalized:
+        return []
+    movies = db.collection('movies')
+    queries = [movies.where('name_normalized', '>=', normalized)
+                     .where('name_normalized', '<', normalized + '\uf8ff').limit(limit)]
+    tokens = name_tokens(normalized)
+    if tokens:
+        queries.append(movies.where('name_tokens', 'array_contains', max(tokens, key=len)).limit(limit))
+    matches = {}
+    for candidate_query in queries:
+        for doc in candidate_query.stream(**_call_options('query')):
+            data = doc.to_dict()
+            if normalized in data.get('name_normalized', ''):
+                matches[doc.id] = data
+    return list(matches.items())
+
+@_guarded
+def backfill_name_search_fields(page_size: int = CATALOG_PAGE_SIZE):
+    """
+    Migration: adds or refreshes 'name_normalized' and 'name_tokens' on every movie document
+    whose stored values differ from what save_movie_data() would write now.
+    Leaves 'timestamp' untouched, so catalog delta syncs don't re-read the whole collection.
+    Returns the number of documents updated.
+    """
+    if db is None:
+        init_firebase()
+
+    updated = 0
+    fields = ('name', 'name_normalized', 'name_tokens')
+    for page in iter_movie_pages(fields, min(page_size, _MAX_BATCH_WRITES)):
+        batch = db.batch()
+        pending = 0
+        for code, data in page:
+            search_fields = _name_search_fields(str(data.get('name', '')))
+            if all(data.get(field) == value for field, value in search_fields.items()):
+                continue
+            batch.update(db.collection('movies').document(code), search_fields)
+            pending += 1
+        if pending:
+            batch.commit(**_call_options('write'))
+            updated += pending
+    print(f"Firebase: Name search fields backfilled on {updated} movies.")
+    return updated
+
+def _forget_deleted_code(code: str):
+    # The Bloom filter cannot forget the code; the negative cache covers it until the next rebuild
+    _remember_missing_code(code)
+    with _catalog_lock:
+        if _catalog is not None:
+            _catalog.remove(code)
+
+@_guarded
 def delete_movie_code(code: str):
     """
-    Deletes a movie document from the 'movies' collection by its 'code'.
+    Deletes a movie document from the 'movies' collection by its 'code'
+    and records a tombstone in 'movie_tombstones' for incremental catalog sync.
+    A 'movie_files' entry still pointing at the code is left behind; find_movie_by_file() ignores it.
     """
     if db is None:
         init_firebase()
 
     movie_ref = db.collection('movies').document(code)
-    movie_ref.delete()
+    # Leave a tombstone and bump the catalog version in the same atomic batch,
+    # so other workers notice the deletion and their delta syncs apply it
+    batch = db.batch()
+    batch.delete(movie_ref)
+    batch.set(db.collection('movie_tombstones').document(code), {'deleted_at': firestore.SERVER_TIMESTAMP})
+    batch.set(_catalog_version_ref(), _CATALOG_VERSION_BUMP, merge=True)
+    batch.commit(**_call_options('write'))
+    _forget_deleted_code(code)
+    _bump_catalog_revision()
     print(f"Firebase: Movie with code '{code}' deleted.")
 
+def find_movie_by_file(file_unique_id: str):
+    """
+    Returns (code, movie data) of a stored movie uploaded from the same file, or None.
+    Answered in O(1) from the cached catalog's file index when the cache is enabled, otherwise
+    with point reads of the 'movie_files' index entry and the movie it names.
+    """
+    if db is None:
+        init_firebase()
+
+    if CATALOG_CACHE_ENABLED:
+        catalog = get_movie_catalog()
+        code = catalog.code_for_file(file_unique_id)
+        movie = catalog.get(code) if code is not None else None
+        return (code, movie.to_dict()) if movie is not None else None
+    return _read_movie_file_entry(file_unique_id)
+
+@_guarded
+def _read_movie_file_entry(file_unique_id: str):
+    entry = db.collection('movie_files').document(file_unique_id).get(**_call_options('read'))
+    code = (entry.to_dict() or {}).get('code') if entry.exists else None
+    if code is None:
+        return None
+    doc = db.collection('movies').document(code).get(**_call_options('read'))
+    data = doc.to_dict() if doc.exists else None
+    if not data or data.get('file_unique_id') != file_unique_id:
+        return None # The movie was deleted or replaced since the entry was written
+    return code, data
+
+@_guarded
+def find_duplicate_movies(page_size: int = CATALOG_PAGE_SIZE):
+    """
+    Scans the 'movies' collection (three fields per document) for movies stored from the same file.
+    Movies are grouped by file_unique_id; older movies saved without one can only be grouped
+    when their file_id is identical. Returns a list of groups, each a dict with the group's
+    'file_unique_id' (or None) and its 'movies' as (code, name) pairs, lowest code first.
+    """
+    groups = {} # ('unique', file_unique_id) or ('file', file_id) -> [(code, name), ...]
+    for page in iter_movie_pages(('name', 'file_id', 'file_unique_id'), page_size):
+        for code, data in page:
+            if data.get('file_unique_id'):
+                key = ('unique', data['file_unique_id'])
+            elif data.get('file_id'):
+                key = ('file', data['file_id'])
+            else:
+                continue
+            groups.setdefault(key, []).append((code, data.get('name', 'Nomsiz Film')))
+    duplicates = []
+    for (kind, value), movies in groups.items():
+        if len(movies) > 1:
+            movies.sort(key=lambda movie: code_sort_key(movie[0]))
+            duplicates.append({'file_unique_id': value if kind == 'unique' else None, 'movies': movies})
+    duplicates.sort(key=lambda group: code_sort_key(group['movies'][0][0]))
+    return duplicates
+
+@_guarded
+def merge_duplicate_movies(groups):
+    """
+    Merges each group returned by find_duplicate_movies() into its first (lowest) code.
+    The other codes' documents are replaced by aliases ({'alias_of': kept code}), so codes
+    already shared with users keep opening the movie while listings, searches and later
+    duplicate scans no longer show them. The 'movie_files' entry is pointed at the kept code.
+    Writes go out in batches of at most _MAX_BATCH_WRITES, each bumping the catalog version.
+    Returns the number of codes merged.
+    """
+    if db is None:
+        init_firebase()
+
+    # Each unit is ((merged code, kept code) or None, writes that must land in the same batch)
+    units = deque()
+    for group in groups:
+        kept_code, *duplicate_codes = [code for code, _ in group['movies']]
+        for code in duplicate_codes:
+            units.append(((code, kept_code), [
+                lambda batch, code=code, kept_code=kept_code: batch.set(
+                    db.collection('movies').document(code),
+                    {'alias_of': kept_code, 'timestamp': firestore.SERVER_TIMESTAMP}),
+            ]))
+        if group['file_unique_id']:
+            units.append((None, [
+                lambda batch, group=group, kept_code=kept_code: batch.set(
+                    db.collection('movie_files').document(group['file_unique_id']), {'code': kept_code}),
+            ]))
+
+    merged = 0
+    while units:
+        batch, writes, committed = db.batch(), 0, []
+        # Leave room for the catalog version bump
+        while units and writes + len(units[0][1]) < _MAX_BATCH_WRITES:
+            alias, unit_writes = units.popleft()
+            for write in unit_writes:
+                write(batch)
+            writes += len(unit_writes)
+            committed.append(alias)
+        batch.set(_catalog_version_ref(), _CATALOG_VERSION_BUMP, merge=True)
+        batch.commit(**_call_options('write'))
+        # Update local state per committed batch, so a later failing batch leaves it consistent
+        with _catalog_lock:
+            for alias in committed:
+                if alias is not None:
+                    if _catalog is not None:
+                        _catalog.upsert(alias[0], {'alias_of': alias[1], 'timestamp': time.time()})
+                    merged += 1
+        _bump_catalog_revision()
+    print(f"Firebase: Merged {len(groups)} duplicate groups ({merged} codes now point to the kept movie).")
+    return merged
+
+@_guarded
 def add_user_to_stats(user_id: str):
     """
     Adds a new user to the 'user_stats' collection or updates an existing user's
@@ -153,9 +1020,10 @@ def add_user_to_stats(user_id: str):
     user_ref.set({
         'first_joined': firestore.SERVER_TIMESTAMP,
         'last_seen': firestore.SERVER_TIMESTAMP
-    }, merge=True)
+    }, merge=True, **_call_options('write'))
     print(f"Firebase: User '{user_id}' stats updated/added.")
 
+@_guarded
 def get_user_count():
     """
     Returns the total number of unique users in the 'user_stats' collection.
@@ -166,20 +1034,206 @@ def get_user_count():
 
     try:
         # Attempt to use the count aggregation query (requires Firebase SDK >= 2.13.0)
-        count_query_result = db.collection('user_stats').count().get()
-        count = count_query_result[0].get('count')
+        count_query_result = db.collection('user_stats').count().get(**_call_options('query'))
+        # get() returns one list of AggregationResult objects per aggregation
+        count = count_query_result[0][0].value
         print(f"Firebase: Total users (aggregated count): {count}")
         return count
     except Exception as e:
         # Fallback to streaming all documents and counting them if aggregation fails
         print(f"Firebase: Error getting user count with aggregation ({e}). Falling back to streaming.")
-        users_collection = db.collection('user_stats').stream()
+        users_collection = db.collection('user_stats').stream(**_call_options('scan'))
         count = 0
         for _ in users_collection:
             count += 1
         print(f"Firebase: Total users (streamed count): {count}")
         return count
 
+@_guarded
+def save_channel_membership(user_id: str, channel_id: str, is_member: bool):
+    """
+    Records whether a user is currently a member of a mandatory channel in the
+    'channel_memberships' collection (one document per user, one field per channel).
+    This is the persistent side of the bot's subscription replica.
+    """
+    if db is None:
+        init_firebase()
+
+    db.collection('channel_memberships').document(user_id).set({
+        channel_id: is_member,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    }, merge=True, **_call_options('write'))
+
+@_guarded
+def get_channel_memberships(user_id: str):
+    """
+    Returns a dictionary of channel_id -> is_member for the given user, as recorded by
+    save_channel_membership(). Returns an empty dictionary if nothing is known yet.
+    """
+    if db is None:
+        init_firebase()
+
+    doc = db.collection('channel_memberships').document(user_id).get(**_call_options('read'))
+    if not doc.exists:
+        return {}
+    memberships = doc.to_dict()
+    memberships.pop('updated_at', None)
+    return memberships
+
+@firestore.transactional
+def _merge_sketch_registers(transaction, doc_ref, registers: bytes):
+    doc = doc_ref.get(transaction=transaction)
+    stored = doc.to_dict().get('registers') if doc.exists else None
+    if stored is not None and len(stored) == len(registers):
+        registers = bytes(map(max, stored, registers))
+    transaction.set(doc_ref, {'registers': bytes(registers), 'updated_at': firestore.SERVER_TIMESTAMP})
+    return registers
+
+@_guarded
+def merge_activity_sketch(sketch_id: str, registers: bytes):
+    """
+    Merges HyperLogLog registers into the 'activity_sketches' document sketch_id by taking the
+    register-wise maximum with what is already stored, and returns the merged registers.
+    The read and the write run in one transaction, so workers persisting the same day's
+    sketch at the same time cannot overwrite each other's registers.
+    """
+    if db is None:
+        init_firebase()
+
+    doc_ref = db.collection('activity_sketches').document(sketch_id)
+    return _merge_sketch_registers(db.transaction(), doc_ref, bytes(registers))
+
+@_guarded
+def get_activity_sketches(sketch_ids):
+    """
+    Returns a dictionary of sketch_id -> registers (bytes) for the given 'activity_sketches'
+    documents. Missing documents are left out.
+    """
+    if db is None:
+        init_firebase()
+
+    sketches = {}
+    for sketch_id in sketch_ids:
+        doc = db.collection('activity_sketches').document(sketch_id).get(**_call_options('read'))
+        if doc.exists:
+            sketches[sketch_id] = doc.to_dict().get('registers') or b''
+    return sketches
+
+@_guarded
+def claim_update(update_key: str, window_seconds: float) -> bool:
+    """
+    Atomically records an update as taken for processing in 'processed_updates', shared by all
+    workers. Returns False if any worker claimed it before. The 'expires_at' field is meant for
+    a Firestore TTL policy that deletes old claims.
+    """
+    if db is None:
+        init_firebase()
+
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=window_seconds)
+    try:
+        # create() fails if the document exists, so exactly one worker wins
+        db.collection('processed_updates').document(update_key).create(
+            {'claimed_at': firestore.SERVER_TIMESTAMP, 'expires_at': expires_at}, **_call_options('write'))
+    except AlreadyExists:
+        return False
+    return True
+
+@_guarded
+def release_update(update_key: str):
+    """Deletes a claim, so a redelivery of an update whose processing failed is handled again."""
+    if db is None:
+        init_firebase()
+
+    db.collection('processed_updates').document(update_key).delete(**_call_options('write'))
+
+
+# --- ASYNC ACCESS WITH REQUEST COALESCING ---
+# Concurrent identical lookups (e.g. hundreds of users sending the same code right after
+# a channel announcement) share one in-flight Firestore request instead of each issuing
+# their own. Keys map to the asyncio task currently running the blocking call.
+_inflight_requests = {}
+
+async def _single_flight(key: tuple, func, *args, deadline: float = None):
+    """
+    Runs the blocking function func(*args) in a worker thread, or joins the identical call
+    that is already in flight for the same key. All callers receive the same result
+    (or exception), so returned data must be treated as read-only.
+    With a deadline, callers stop waiting after that many seconds and get
+    FirestoreUnavailableError; the call itself keeps running for anyone still joined to it.
+    The SDK's own timeout does not bound its retries, so this is what bounds handler latency.
+    """
+    task = _inflight_requests.get(key)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        _inflight_requests[key] = task
+        # Forget the task as soon as it finishes so the next lookup hits the backend again
+        task.add_done_callback(lambda _: _inflight_requests.pop(key, None))
+    # shield() keeps a cancelled or timed-out caller from cancelling the request shared by the others
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), deadline)
+    except asyncio.TimeoutError as e:
+        # Only the call itself counts towards the breaker (see _guarded()), not how long a caller waited
+        raise FirestoreUnavailableError(f"{func.__name__} did not finish within {deadline}s") from e
+
+async def get_movie_data_async(code: str, use_filters: bool = True):
+    """
+    Async, coalesced variant of get_movie_data() for use inside bot handlers.
+    Does not block the event loop, and waits at most the 'read' deadline before answering
+    from the last known catalog (filtered lookups only).
+    """
+    try:
+        return await _single_flight(('movie', code, use_filters), get_movie_data, code, use_filters,
+                                    deadline=FIRESTORE_DEADLINES['read'])
+    except FirestoreUnavailableError as e:
+        if not use_filters:
+            raise
+        return _movie_from_last_known_catalog(code, e)
+
+async def get_movie_catalog_async():
+    """
+    Async, coalesced variant of get_movie_catalog() for use inside bot handlers.
+    Does not block the event loop while the catalog is (re)loaded, and falls back to the
+    last known catalog if a refresh takes longer than the 'scan' deadline.
+    """
+    if _catalog_is_fresh():
+        return _catalog # Fast path: no thread hop when the cache is warm
+    try:
+        return await _single_flight(('catalog',), get_movie_catalog, deadline=FIRESTORE_DEADLINES['scan'])
+    except FirestoreUnavailableError:
+        if _catalog is None:
+            raise
+        catalog_stats['stale'] += 1
+        return _catalog
+
+async def search_movies_by_name_async(query: str):
+    """Async, coalesced variant of search_movies_by_name() for use inside bot handlers."""
+    return await _single_flight(('search', normalize_movie_name(query)), search_movies_by_name, query,
+                                deadline=FIRESTORE_DEADLINES['query'])
+
+async def find_movie_by_file_async(file_unique_id: str):
+    """Async, coalesced variant of find_movie_by_file() for use inside bot handlers."""
+    # With the cache enabled, the first call may have to load the whole catalog
+    deadline = FIRESTORE_DEADLINES['scan' if CATALOG_CACHE_ENABLED else 'read']
+    return await _single_flight(('file', file_unique_id), find_movie_by_file, file_unique_id, deadline=deadline)
+
+async def claim_update_async(update_key: str, window_seconds: float) -> bool:
+    """Async variant of claim_update() that waits at most the 'write' deadline."""
+    return await _single_flight(('claim', update_key), claim_update, update_key, window_seconds,
+                                deadline=FIRESTORE_DEADLINES['write'])
+
+async def stream_movies_async(fields=('name',), page_size: int = CATALOG_PAGE_SIZE, include_aliases: bool = False):
+    """
+    Async generator variant of iter_movie_pages() that yields (code, data) pairs one by one.
+    Each page is fetched in a worker thread, so the event loop is never blocked.
+    """
+    pages = iter_movie_pages(fields, page_size, include_aliases)
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            return
+        for item in page:
+            yield item
+
 # Optional: Example usage for local testing of firebase_utils.py directly
 if __name__ == '__main__':
     print("--- Running firebase_utils.py for local testing ---")
@@ -0,0 +1,42 @@
+# json_codec.py
+"""
+JSON encoder/decoder used for incoming webhook updates and outgoing Bot API calls.
+
+aiogram decodes webhook bodies and Bot API responses with `session.json_loads` and encodes
+request parameters (reply markups, entities, ...) with `session.json_dumps`; both default to
+the stdlib json module. orjson is several times faster at both, so it is used when installed.
+JSON_CODEC=json forces the stdlib codec, e.g. to rule the codec out while debugging.
+"""
+import json
+import os
+
+JSON_CODEC = os.getenv("JSON_CODEC", "orjson").lower()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _stdlib_dumps(obj) -> str:
+    # Compact and unescaped, like orjson, so both codecs send identical payloads to Telegram
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _orjson_dumps(obj) -> str:
+    # aiogram needs str (it is put into form fields and aiohttp responses); orjson returns UTF-8 bytes
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+CODECS = {"json": (json.loads, _stdlib_dumps)}
+if orjson is not None:
+    CODECS["orjson"] = (orjson.loads, _orjson_dumps)
+
+if JSON_CODEC not in CODECS:
+    print(f"JSON codec '{JSON_CODEC}' is not available; using the stdlib json module.")
+    CODEC_NAME = "json"
+else:
+    CODEC_NAME = JSON_CODEC
+
+# Both accept str or bytes, like json.loads
+json_loads, json_dumps = CODECS[CODEC_NAME]
@@ -0,0 +1,222 @@
+# load_replay.py
+"""
+Replays webhook traffic recorded by the bot (WEBHOOK_RECORD_FILE) against a locally running
+instance and reports sustained throughput and latency percentiles.
+
+The tool also serves a fake Telegram Bot API, so the bot never talks to Telegram. Typical run:
+
+    # 1. Start the replayer (it serves the fake Bot API on port 8081 and waits for the bot)
+    python load_replay.py replay recorded_updates.jsonl --speed 5
+
+    # 2. In another terminal, start the bot against the fakes
+    FIREBASE_FAKE=1 FIREBASE_FAKE_SEED=seed.json TELEGRAM_API_BASE=http://127.0.0.1:8081 \\
+    WEBHOOK_URL=http://127.0.0.1:5000/webhook WEBHOOK_HANDLE_IN_BACKGROUND=false \\
+    BOT_TOKEN=123456:fake python main_movie_bot.py
+
+Updates recorded from additional bots (EXTRA_BOTS_CONFIG) carry their webhook path and are
+sent to that path on the --target host, so the bot must be started with the same extra bots.
+
+A seed catalog for the fake Firestore can be generated with:
+
+    python load_replay.py seed --movies 5000 --out seed.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+# Bot API methods whose result is a Message object; everything else not listed gets `true`
+_MESSAGE_METHODS = {"sendMessage", "sendVideo", "sendDocument", "sendPhoto", "editMessageText",
+                    "editMessageReplyMarkup", "copyMessage", "forwardMessage"}
+
+
+class FakeBotAPI:
+    """
+    Minimal Telegram Bot API stand-in: accepts every method on /bot<token>/<method>,
+    returns plausible results and counts the calls it received.
+    """
+    def __init__(self):
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = await request.post() # aiogram sends every request as form data
+        self.calls[method] += 1
+        return web.json_response({"ok": True, "result": await self._result(method, params)})
+
+    async def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+        if method == "getChatMember":
+            user_id = _int_param(params, "user_id")
+            return {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": "User"}}
+        if method == "getUpdates":
+            await asyncio.sleep(1) # Nothing to deliver; avoid a busy loop if the bot polls us
+            return []
+        if method in _MESSAGE_METHODS:
+            self._message_id += 1
+            chat_id = _int_param(params, "chat_id")
+            return {"message_id": self._message_id, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+                    "text": params.get("text") or params.get("caption") or ""}
+        return True
+
+
+def _int_param(params, name):
+    try:
+        return int(params.get(name, 0))
+    except ValueError:
+        return 0 # e.g. "@channelusername"
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def load_records(path, repeat):
+    """Loads recorded updates and, with repeat > 1, appends shifted copies for longer runs."""
+    with open(path, encoding="utf-8") as record_file:
+        records = [json.loads(line) for line in record_file if line.strip()]
+    if not records:
+        raise SystemExit(f"No updates found in {path}")
+    duration = records[-1]["t"] - records[0]["t"]
+    start = records[0]["t"]
+    return [dict(record, t=record["t"] - start + round_number * (duration + 1))
+            for round_number in range(repeat) for record in records]
+
+
+async def wait_for_target(session, target_url, timeout):
+    """Polls the bot's health check until it answers, so replay starts only once the bot is up."""
+    parsed = urlparse(target_url)
+    health_url = f"{parsed.scheme}://{parsed.netloc}/"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(health_url) as response:
+                if response.status == 200:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"Bot did not answer on {health_url} within {timeout} seconds.")
+
+
+async def replay(args):
+    records = load_records(args.updates, args.repeat)
+    fake_api = FakeBotAPI()
+
+    fake_app = web.Application()
+    fake_app.router.add_post("/bot{token}/{method}", fake_api.handle)
+    runner = web.AppRunner(fake_app)
+    await runner.setup()
+    await web.TCPSite(runner, args.fake_api_host, args.fake_api_port).start()
+    print(f"Fake Bot API listening on http://{args.fake_api_host}:{args.fake_api_port}")
+
+    latencies = []
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    # Fresh update IDs, so repeated runs aren't dropped as redeliveries
+    base_update_id = random.randint(1, 2 ** 30)
+    parsed_target = urlparse(args.target)
+
+    async with ClientSession(timeout=ClientTimeout(total=args.request_timeout)) as session:
+        print(f"Waiting for the bot on {args.target}...")
+        await wait_for_target(session, args.target, args.wait)
+        startup_calls = sum(fake_api.calls.values())
+
+        async def send(index, record):
+            async with semaphore:
+                update = dict(record["update"], update_id=base_update_id + index)
+                started = time.perf_counter()
+                try:
+                    target = args.target
+                    if "path" in record: # An additional bot's update
+                        target = f"{parsed_target.scheme}://{parsed_target.netloc}{record['path']}"
+                    async with session.post(target, json=update) as response:
+                        await response.read()
+                        statuses[response.status] += 1
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        print(f"Replaying {len(records)} updates at {'max' if args.speed <= 0 else f'{args.speed}x'} speed...")
+        loop = asyncio.get_running_loop()
+        replay_started = loop.time()
+        tasks = []
+        for index, record in enumerate(records):
+            if args.speed > 0:
+                # Keep the recorded inter-arrival times, compressed by the speed multiplier
+                delay = record["t"] / args.speed - (loop.time() - replay_started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(index, record)))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - replay_started
+
+    await runner.cleanup()
+
+    latencies.sort()
+    print("\n--- Replay report ---")
+    print(f"Updates sent:        {len(records)}")
+    print(f"Elapsed:             {elapsed:.2f} s")
+    print(f"Throughput:          {len(records) / elapsed:.1f} updates/s")
+    for percent in (50, 90, 95, 99):
+        print(f"Latency p{percent}:         {_percentile(latencies, percent) * 1000:.1f} ms")
+    print(f"Latency max:         {latencies[-1] * 1000:.1f} ms")
+    print(f"Responses:           {dict(statuses)}")
+    print(f"Bot API calls:       {sum(fake_api.calls.values()) - startup_calls} "
+          f"({dict(fake_api.calls.most_common())})")
+
+
+def write_seed(args):
+    """Writes a fake Firestore seed file with a synthetic movie catalog."""
+    words = ["avatar", "spiderman", "tarjima", "kino", "qasoskorlar", "titanik", "forsaj", "shrek", "jumong", "batman"]
+    rng = random.Random(args.random_seed)
+    movies = {}
+    for code in range(1, args.movies + 1):
+        name = " ".join(rng.choice(words).capitalize() for _ in range(rng.randint(1, 3))) + f" {code}"
+        movies[str(code)] = {"file_id": f"FAKE_FILE_ID_{code}", "name": name}
+    with open(args.out, "w", encoding="utf-8") as seed_file:
+        json.dump({"movies": movies}, seed_file, ensure_ascii=False)
+    print(f"Wrote {len(movies)} movies to {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded webhook traffic against a local bot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="Replay recorded updates and report latency.")
+    replay_parser.add_argument("updates", help="JSON-lines file written via WEBHOOK_RECORD_FILE")
+    replay_parser.add_argument("--target", default="http://127.0.0.1:5000/webhook", help="Bot webhook URL")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="Speed multiplier for recorded timing; 0 sends as fast as possible")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="Replay the recording this many times")
+    replay_parser.add_argument("--concurrency", type=int, default=200, help="Maximum requests in flight")
+    replay_parser.add_argument("--request-timeout", type=float, default=60, help="Per-request timeout in seconds")
+    replay_parser.add_argument("--wait", type=float, default=120, help="Seconds to wait for the bot to come up")
+    replay_parser.add_argument("--fake-api-host", default="127.0.0.1")
+    replay_parser.add_argument("--fake-api-port", type=int, default=8081)
+
+    seed_parser = subparsers.add_parser("seed", help="Generate a fake Firestore seed catalog.")
+    seed_parser.add_argument("--movies", type=int, default=1000)
+    seed_parser.add_argument("--out", default="seed.json")
+    seed_parser.add_argument("--random-seed", type=int, default=42)
+
+    args = parser.parse_args()
+    if args.command == "replay":
+        asyncio.run(replay(args))
+    else:
+        write_seed(args)
+
+
+if __name__ == "__main__":
+    main()
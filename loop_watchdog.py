@@ -0,0 +1,97 @@
+# loop_watchdog.py
+"""
+Opt-in detector for event-loop stalls caused by blocking code inside coroutines.
+
+A heartbeat task on the loop records a timestamp every `interval` seconds. A watchdog thread
+checks it, and when the heartbeat is late by more than `threshold` it captures the stack of the
+loop thread while the stall is still in progress. Each stall is attributed to the aiogram
+handler that was running and to the outermost firebase_utils function on the stack, then
+logged and counted once the loop recovers.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+# aiogram calls every handler from HandlerObject.call() in this file
+_AIOGRAM_HANDLER_FILE = os.path.join("aiogram", "dispatcher", "event", "handler.py")
+_STACK_LIMIT = 25 # Innermost frames included in a stall report
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float, interval: float = 0.05, data_layer_file: str = "firebase_utils.py"):
+        self.threshold = threshold
+        self.interval = interval
+        self.data_layer_file = data_layer_file
+        self.stall_counts = Counter() # "handler / firebase function" -> number of stalls
+        self.stall_seconds = Counter() # Same keys -> total stalled time
+        self.max_stall = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._heartbeat_task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts watching the running event loop. Must be called from a coroutine on that loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        print(f"Loop watchdog: reporting event-loop stalls longer than {self.threshold * 1000:.0f} ms.")
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    @property
+    def total_stalls(self) -> int:
+        return sum(self.stall_counts.values())
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        captured = None # (heartbeat the stall started after, handler, data-layer function, stack)
+        while not self._stopped.wait(self.interval / 2):
+            beat = self._last_beat
+            if captured is None:
+                if time.monotonic() - beat - self.interval > self.threshold:
+                    # The loop is still stuck, so its current stack shows the culprit
+                    frame = sys._current_frames().get(self._loop_thread_id)
+                    captured = (beat, *self._describe(frame))
+            elif beat != captured[0]:
+                self._report(beat - captured[0] - self.interval, *captured[1:])
+                captured = None
+
+    def _describe(self, frame):
+        """Returns (handler name, data-layer function name, formatted stack) for a loop-thread frame."""
+        handler = None
+        data_function = None
+        innermost = frame
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if handler is None and filename.endswith(_AIOGRAM_HANDLER_FILE) and frame.f_code.co_name == "call":
+                callback = getattr(frame.f_locals.get("self"), "callback", None)
+                handler = getattr(callback, "__name__", None)
+            if os.path.basename(filename) == self.data_layer_file:
+                data_function = frame.f_code.co_name # Keep walking: the outermost one is the public entry point
+            frame = frame.f_back
+        stack = "".join(traceback.format_stack(innermost, limit=_STACK_LIMIT)) if innermost else ""
+        return handler or "unknown", data_function or "-", stack
+
+    def _report(self, duration: float, handler: str, data_function: str, stack: str):
+        key = f"{handler} / {data_function}"
+        self.stall_counts[key] += 1
+        self.stall_seconds[key] += duration
+        self.max_stall = max(self.max_stall, duration)
+        print(f"Loop watchdog: event loop stalled for {duration * 1000:.0f} ms "
+              f"in handler '{handler}' ({self.data_layer_file}: {data_function}). Stack:\n{stack}")
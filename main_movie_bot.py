@@ -1,8 +1,14 @@
 # main_movie_bot.py (CONTINUED)
 # main_movie_bot.py
 import asyncio
+import hmac
+import json
 import os
+import queue
 import re
+import threading
+import time
+from urllib.parse import urlparse
 from functools import wraps # Import wraps for decorators
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.enums import ParseMode
@@ -13,13 +19,31 @@ from dotenv import load_dotenv
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 from aiogram.client.default import DefaultBotProperties # Essential for aiogram 3.7+
-from aiogram.filters import Command, StateFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from movie_catalog import code_sort_key, normalize_movie_name
+from activity_stats import ActivityTracker
+from query_cache import QueryResultCache
+from update_dedup import UpdateDeduplicator
+from update_lanes import UpdateLanes, select_lane
+from update_anonymizer import anonymize_update
+from throttling import ThrottlingMiddleware
+from subscription_replica import MembershipReplica
+from loop_watchdog import LoopWatchdog
+from sampling_profiler import SamplingProfiler
+from json_codec import json_loads, json_dumps, CODEC_NAME as JSON_CODEC_NAME
 
 # Import your Firebase utility functions. This file MUST exist alongside main_movie_bot.py
 # Ensure firebase_utils.py is correct and configured for your Firebase project.
-from firebase_utils import init_firebase, save_movie_data, get_movie_data, get_all_movies_data, delete_movie_code, \
-    add_user_to_stats, get_user_count
+from firebase_utils import init_firebase, save_movie_data, get_movie_data_async, get_movie_catalog_async, \
+    stream_movies_async, CATALOG_CACHE_ENABLED, NAME_SEARCH_SERVER_SIDE, catalog_is_loaded, \
+    search_movies_by_name_async, backfill_name_search_fields, find_movie_by_file_async, find_duplicate_movies, \
+    merge_duplicate_movies, claim_update_async, release_update, catalog_is_stale, FirestoreUnavailableError, \
+    firestore_breaker, catalog_stats, catalog_revision, start_catalog_version_watch, stop_catalog_version_watch, \
+    delete_movie_code, add_user_to_stats, get_user_count, save_channel_membership, get_channel_memberships, \
+    warm_up_firestore, merge_activity_sketch, get_activity_sketches, movie_lookup_stats
 
 # Load environment variables from .env file for local development
 # On Heroku, environment variables are set directly in the Config Vars.
@@ -46,21 +70,179 @@ MANDATORY_CHANNELS = [
     # Add more channels if needed:
     # {"id": "@another_channel", "link": "https://t.me/another_channel", "name": "Another Channel Name"}
 ]
+# When enabled, the bot (which must be an admin of every mandatory channel) listens to
+# chat_member updates and keeps a local, Firestore-backed replica of who joined or left.
+# Subscription checks are then answered from the replica; get_chat_member is only used
+# for users the replica has not seen yet and to confirm that a user is not subscribed.
+SUBSCRIPTION_REPLICA_ENABLED = os.getenv("SUBSCRIPTION_REPLICA_ENABLED", "false").lower() in ("1", "true", "yes")
+# A user's replica entry is reloaded from Firestore after this long, picking up chat_member
+# updates that other workers or bots received.
+SUBSCRIPTION_REPLICA_TTL_SECONDS = float(os.getenv("SUBSCRIPTION_REPLICA_TTL_SECONDS", "3600"))
+# At most this many (bot, user) entries are kept in memory; the least recently checked are
+# evicted first and reloaded from Firestore when needed.
+SUBSCRIPTION_REPLICA_MAX_USERS = int(os.getenv("SUBSCRIPTION_REPLICA_MAX_USERS", "100000"))
 # --- END MANDATORY SUBSCRIPTION CONFIG ---
 
+# --- CONFIGURE ADDITIONAL BOTS HERE ---
+# More bots can be served by this same process. They share the Firestore client, the movie
+# catalog cache and the FSM storage, but each has its own token, webhook path, admins and
+# mandatory channels. EXTRA_BOTS_CONFIG is a JSON list, or the path of a JSON file holding one:
+#   [{"token": "123:abc", "webhook_path": "/webhook/kino2", "admin_user_ids": [111],
+#     "mandatory_channels": [{"id": "@kino2", "link": "https://t.me/kino2", "name": "Kino 2"}]}]
+# Their webhook URLs use the scheme and host of WEBHOOK_URL with their own webhook_path.
+EXTRA_BOTS_CONFIG = os.getenv("EXTRA_BOTS_CONFIG")
+# --- END ADDITIONAL BOTS CONFIG ---
+
+# --- CONFIGURE FLOOD CONTROL HERE ---
+# Each non-admin user may trigger the same handler at most THROTTLE_RATE_LIMIT times
+# within any sliding window of THROTTLE_WINDOW_SECONDS seconds. Extra events are dropped.
+# Individual handlers can override this with flags={"rate_limit": (limit, window_seconds)}.
+# A limit of 0 disables flood control.
+THROTTLE_RATE_LIMIT = int(os.getenv("THROTTLE_RATE_LIMIT", "5"))
+THROTTLE_WINDOW_SECONDS = float(os.getenv("THROTTLE_WINDOW_SECONDS", "10"))
+# --- END FLOOD CONTROL CONFIG ---
+
+# --- CONFIGURE UPDATE DEDUPLICATION HERE ---
+# Telegram redelivers updates the webhook answered slowly or with an error. Update IDs seen within
+# the last UPDATE_DEDUP_WINDOW_SECONDS (at most UPDATE_DEDUP_MAX_SIZE of them) are dropped before
+# any handler runs. With several workers/dynos behind one webhook, UPDATE_DEDUP_SHARED=true also
+# claims every update in Firestore ('processed_updates'; one write per update), so a redelivery
+# that reaches another worker is dropped too.
+UPDATE_DEDUP_WINDOW_SECONDS = float(os.getenv("UPDATE_DEDUP_WINDOW_SECONDS", "600"))
+UPDATE_DEDUP_MAX_SIZE = int(os.getenv("UPDATE_DEDUP_MAX_SIZE", "50000"))
+UPDATE_DEDUP_SHARED = os.getenv("UPDATE_DEDUP_SHARED", "false").lower() in ("1", "true", "yes")
+# --- END UPDATE DEDUPLICATION CONFIG ---
+
+# --- CONFIGURE PRIORITY LANES HERE ---
+# Updates are handled in lanes with separate concurrency limits, so a flood of user searches
+# cannot delay admins, button presses (callback queries) or admins in the middle of an FSM flow
+# (adding or deleting a movie). The user lane's limit also bounds how many Firestore worker
+# threads a flood can occupy. In polling mode the lanes replace POLLING_CONCURRENCY, and fetching
+# only pauses once POLLING_MAX_PENDING fetched updates are waiting or running.
+UPDATE_LANES_ENABLED = os.getenv("UPDATE_LANES_ENABLED", "true").lower() in ("1", "true", "yes")
+UPDATE_LANE_CONCURRENCY = {
+    'admin': int(os.getenv("ADMIN_LANE_CONCURRENCY", "4")),
+    'callback': int(os.getenv("CALLBACK_LANE_CONCURRENCY", "16")),
+    'fsm': int(os.getenv("FSM_LANE_CONCURRENCY", "8")),
+    'user': int(os.getenv("USER_LANE_CONCURRENCY", "32")),
+}
+POLLING_MAX_PENDING = int(os.getenv("POLLING_MAX_PENDING", "1000"))
+# --- END PRIORITY LANES CONFIG ---
+
+# --- CONFIGURE SEARCH RESULT CACHE HERE ---
+# The final answer to a text query (the movie found, the list of matches or "not found") is kept
+# for repeated queries, keyed by the normalized query and the catalog revision, so any save,
+# delete or sync invalidates it. QUERY_CACHE_MAX_SIZE=0 disables the cache.
+QUERY_CACHE_MAX_SIZE = int(os.getenv("QUERY_CACHE_MAX_SIZE", "2000"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "300"))
+# --- END SEARCH RESULT CACHE CONFIG ---
+
+# --- CONFIGURE ACTIVITY ANALYTICS HERE ---
+# Active users are counted with HyperLogLog sketches (2^ACTIVITY_SKETCH_PRECISION bytes per day,
+# about 0.8% error at the default 14) and merged into Firestore every ACTIVITY_PERSIST_SECONDS.
+ACTIVITY_SKETCH_PRECISION = int(os.getenv("ACTIVITY_SKETCH_PRECISION", "14"))
+ACTIVITY_PERSIST_SECONDS = float(os.getenv("ACTIVITY_PERSIST_SECONDS", "300"))
+# --- END ACTIVITY ANALYTICS CONFIG ---
+
+# --- CONFIGURE EVENT-LOOP WATCHDOG HERE ---
+# When enabled, blocking code that stalls the event loop longer than LOOP_STALL_THRESHOLD_MS
+# is logged with its stack, the handler and the firebase_utils function involved.
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG_ENABLED", "false").lower() in ("1", "true", "yes")
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "200"))
+# --- END EVENT-LOOP WATCHDOG CONFIG ---
+
+# --- CONFIGURE ON-DEMAND PROFILING HERE ---
+# Admins can profile live traffic with /profile <seconds>. Setting PROFILE_HTTP_TOKEN also enables
+# GET /debug/profile?seconds=N, authorized with the header "Authorization: Bearer <token>".
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+PROFILE_HTTP_TOKEN = os.getenv("PROFILE_HTTP_TOKEN")
+# --- END ON-DEMAND PROFILING CONFIG ---
+
+# --- CONFIGURE RUN MODE HERE ---
+# BOT_MODE=webhook (default) serves updates through the aiohttp app below.
+# BOT_MODE=polling fetches updates with getUpdates instead (local load tests, hosts without inbound HTTPS).
+BOT_MODE = os.getenv("BOT_MODE", "webhook").lower()
+POLLING_BATCH_SIZE = int(os.getenv("POLLING_BATCH_SIZE", "100")) # Updates per getUpdates call (1-100)
+POLLING_CONCURRENCY = int(os.getenv("POLLING_CONCURRENCY", "64")) # Updates handled at the same time
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "30")) # Long-polling wait in seconds
+# Base URL of the Bot API server, e.g. a local Bot API server or the fake one in load_replay.py.
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE")
+# "false" makes the webhook respond only after the update is fully handled (useful for load tests).
+WEBHOOK_HANDLE_IN_BACKGROUND = os.getenv("WEBHOOK_HANDLE_IN_BACKGROUND", "true").lower() in ("1", "true", "yes")
+# When set, every incoming webhook update is anonymized and appended to this JSON-lines file
+# so it can be replayed later with load_replay.py.
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE")
+# The webhook path of the main bot defaults to the path part of WEBHOOK_URL, so both always match.
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or urlparse(os.getenv("WEBHOOK_URL", "")).path or "/webhook"
+# --- END RUN MODE CONFIG ---
+
 # Initialize Bot and Dispatcher
 # CRITICAL FIX for aiogram 3.7.0+: parse_mode is now passed via DefaultBotProperties
 if not BOT_TOKEN:
     print("CRITICAL ERROR: BOT_TOKEN environment variable is not set. Exiting.")
     exit(1) # Exit if bot token is not available
 
-bot = Bot(
-    token=BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-)
+class BotSettings:
+    """Configuration that differs between the bots served by this process."""
+    __slots__ = ('webhook_path', 'admin_user_ids', 'mandatory_channels')
+
+    def __init__(self, webhook_path: str, admin_user_ids, mandatory_channels):
+        self.webhook_path = webhook_path
+        self.admin_user_ids = frozenset(admin_user_ids)
+        self.mandatory_channels = list(mandatory_channels)
+
+
+def _create_bot(token: str) -> Bot:
+    # The session's codec also decodes this bot's webhook updates in SimpleRequestHandler
+    session_options = {"json_loads": json_loads, "json_dumps": json_dumps}
+    if TELEGRAM_API_BASE:
+        session_options["api"] = TelegramAPIServer.from_base(TELEGRAM_API_BASE)
+    return Bot(
+        token=token,
+        session=AiohttpSession(**session_options),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+
+def _load_extra_bots_config():
+    """Reads EXTRA_BOTS_CONFIG, given either inline as JSON or as a path to a JSON file."""
+    if not EXTRA_BOTS_CONFIG:
+        return []
+    if EXTRA_BOTS_CONFIG.lstrip().startswith("["):
+        return json.loads(EXTRA_BOTS_CONFIG)
+    with open(EXTRA_BOTS_CONFIG, encoding="utf-8") as config_file:
+        return json.load(config_file)
+
+
+bot = _create_bot(BOT_TOKEN) # The main bot, configured by BOT_TOKEN, ADMIN_USER_IDS and MANDATORY_CHANNELS
+bots = [bot]
+# bot.id -> BotSettings; bot.id is parsed from the token, so no Bot API call is needed
+bot_settings: dict[int, BotSettings] = {bot.id: BotSettings(WEBHOOK_PATH, ADMIN_USER_IDS, MANDATORY_CHANNELS)}
+for extra_bot_config in _load_extra_bots_config():
+    extra_bot = _create_bot(extra_bot_config["token"])
+    if extra_bot.id in bot_settings or any(settings.webhook_path == extra_bot_config["webhook_path"]
+                                           for settings in bot_settings.values()):
+        print(f"CRITICAL ERROR: Bot {extra_bot.id} or its webhook path is configured more than once. Exiting.")
+        exit(1)
+    bots.append(extra_bot)
+    bot_settings[extra_bot.id] = BotSettings(extra_bot_config["webhook_path"],
+                                             extra_bot_config.get("admin_user_ids", []),
+                                             extra_bot_config.get("mandatory_channels", []))
+
+# One dispatcher serves every bot; handlers receive the bot an update came from as event.bot
 dp = Dispatcher(storage=MemoryStorage()) # MemoryStorage for FSM states (resets on bot restart)
 
 
+def settings_for(current_bot: Bot) -> BotSettings:
+    """Returns the settings of the bot an update arrived through."""
+    return bot_settings[current_bot.id]
+
+
+def is_admin(user_id: int, current_bot: Bot) -> bool:
+    """True if the user is in the admin list of the given bot."""
+    return user_id in settings_for(current_bot).admin_user_ids
+
+
 # Define FSM States for Admin Movie Addition process
 class AddMovieStates(StatesGroup):
     waiting_for_movie_file = State() # Admin sends the video/document file
@@ -72,6 +254,120 @@ class DeleteMovieStates(StatesGroup):
     waiting_for_delete_code = State() # Admin inputs the movie code to delete
 
 
+# --- FLOOD CONTROL MIDDLEWARE ---
+
+# Inner middlewares run after filters, so the matched handler is known and limits are per handler.
+throttling_middleware = ThrottlingMiddleware(THROTTLE_RATE_LIMIT, THROTTLE_WINDOW_SECONDS, is_exempt=is_admin)
+dp.message.middleware(throttling_middleware)
+dp.callback_query.middleware(throttling_middleware)
+
+
+# --- ACTIVITY ANALYTICS ---
+
+activity_tracker = ActivityTracker(ACTIVITY_SKETCH_PRECISION)
+sampling_profiler = SamplingProfiler()
+loop_watchdog = LoopWatchdog(LOOP_STALL_THRESHOLD_MS / 1000) if LOOP_WATCHDOG_ENABLED else None
+query_result_cache = QueryResultCache(QUERY_CACHE_MAX_SIZE, QUERY_CACHE_TTL_SECONDS)
+update_deduplicator = UpdateDeduplicator(UPDATE_DEDUP_WINDOW_SECONDS, UPDATE_DEDUP_MAX_SIZE)
+_activity_persist_task = None
+
+
+async def deduplicate_updates(handler, event: types.Update, data):
+    """
+    Outer update middleware, registered first: drops redelivered updates before any handler runs.
+    If handling fails, the update is released so Telegram's retry is processed.
+    """
+    # update_id is only unique per bot
+    key = f"{data['bot'].id}:{event.update_id}"
+    if not update_deduplicator.claim(key):
+        update_deduplicator.stats['dropped_memory'] += 1
+        return None
+    if UPDATE_DEDUP_SHARED:
+        try:
+            claimed = await claim_update_async(key, UPDATE_DEDUP_WINDOW_SECONDS)
+        except Exception as e:
+            claimed = True # Fail open: a possible duplicate is better than a lost update
+            update_deduplicator.stats['shared_errors'] += 1
+            print(f"Error claiming update {key} in Firestore: {e}")
+        if not claimed:
+            update_deduplicator.stats['dropped_shared'] += 1
+            return None
+    update_deduplicator.stats['processed'] += 1
+    try:
+        return await handler(event, data)
+    except Exception:
+        update_deduplicator.release(key)
+        if UPDATE_DEDUP_SHARED:
+            try:
+                await asyncio.to_thread(release_update, key)
+            except Exception as e:
+                print(f"Error releasing update {key} in Firestore: {e}")
+        raise
+
+
+dp.update.outer_middleware(deduplicate_updates)
+
+
+update_lanes = UpdateLanes(UPDATE_LANE_CONCURRENCY, default='user')
+
+
+def _lane_for(event: types.Update, data) -> str:
+    user = data.get("event_from_user")
+    # raw_state is set by aiogram's FSM middleware, which runs before ours
+    return select_lane(event, data.get("raw_state"), user is not None and is_admin(user.id, data["bot"]))
+
+
+async def schedule_updates(handler, event: types.Update, data):
+    """Outer update middleware: runs each update in its priority lane (see UPDATE_LANE_CONCURRENCY)."""
+    return await update_lanes.run(_lane_for(event, data), handler, event, data)
+
+
+if UPDATE_LANES_ENABLED:
+    dp.update.outer_middleware(schedule_updates)
+
+
+async def track_activity(handler, event, data):
+    """Outer update middleware: counts the sender of every update in today's activity sketch."""
+    user = data.get("event_from_user") # Set by aiogram's own user-context middleware, which runs first
+    if user is not None and not user.is_bot:
+        activity_tracker.record(user.id)
+    return await handler(event, data)
+
+
+dp.update.outer_middleware(track_activity)
+
+
+async def persist_activity_sketches():
+    """
+    Merges the changed sketches into Firestore and folds back what other workers stored,
+    so /stats on any worker reflects all of them after the next persist.
+    """
+    dirty = activity_tracker.take_dirty()
+    if not dirty:
+        return
+    try:
+        for sketch_id, registers in dirty.items():
+            merged = await asyncio.to_thread(merge_activity_sketch, sketch_id, registers)
+            activity_tracker.merge_sketch(sketch_id, merged)
+    except Exception as e:
+        activity_tracker.mark_dirty(dirty) # Retry on the next persist
+        print(f"Error persisting activity sketches: {e}")
+
+
+async def _persist_activity_periodically():
+    """Loads the persisted sketches once, then persists local changes every ACTIVITY_PERSIST_SECONDS."""
+    try:
+        sketches = await asyncio.to_thread(get_activity_sketches, activity_tracker.sketch_ids())
+        for sketch_id, registers in sketches.items():
+            activity_tracker.merge_sketch(sketch_id, registers)
+        print(f"Loaded {len(sketches)} persisted activity sketches.")
+    except Exception as e:
+        print(f"Error loading activity sketches: {e}")
+    while True:
+        await asyncio.sleep(ACTIVITY_PERSIST_SECONDS)
+        await persist_activity_sketches()
+
+
 # Initialize Firebase globally when the bot starts
 # This will ensure 'db' is set up before any Firebase operations are attempted.
 print("Attempting to initialize Firebase for main movie bot...")
@@ -80,17 +376,79 @@ init_firebase() # Call the initialization function from firebase_utils.py
 
 # --- SUBSCRIPTION CHECK FUNCTIONS AND DECORATOR ---
 
-async def check_all_subscriptions(user_id: int) -> tuple[bool, list[dict]]:
+# Chat member statuses that count as being subscribed to a channel
+SUBSCRIBED_STATUSES = ("member", "administrator", "creator")
+
+# Subscription replica, keyed by (bot_id, user_id)
+membership_replica = MembershipReplica(SUBSCRIPTION_REPLICA_TTL_SECONDS, SUBSCRIPTION_REPLICA_MAX_USERS)
+
+
+def _mandatory_channel_index(chat: types.Chat, channels: list[dict]):
+    """Returns the index of the chat in channels, or None if it is not a mandatory channel."""
+    for index, channel in enumerate(channels):
+        channel_id = str(channel["id"])
+        if channel_id == str(chat.id):
+            return index
+        if chat.username and channel_id.lower() == f"@{chat.username}".lower():
+            return index
+    return None
+
+
+async def _load_replica_user(current_bot: Bot, user_id: int):
+    """
+    Loads a user's persisted memberships into the in-memory replica, once per process and bot
+    and again every SUBSCRIPTION_REPLICA_TTL_SECONDS.
+    """
+    replica_key = (current_bot.id, user_id)
+    if membership_replica.is_loaded(replica_key):
+        return
+    membership_replica.reset(replica_key) # Mark as loaded even if nothing is persisted yet
+    try:
+        memberships = await asyncio.to_thread(get_channel_memberships, str(user_id))
+    except Exception as e:
+        print(f"Error loading subscription replica for user {user_id}: {e}")
+        return
+    # Memberships are stored per channel, so bots sharing a channel share what is known about it
+    for index, channel in enumerate(settings_for(current_bot).mandatory_channels):
+        if str(channel["id"]) in memberships:
+            membership_replica.set_membership(replica_key, index, bool(memberships[str(channel["id"])]))
+
+
+async def _record_membership(current_bot: Bot, user_id: int, channel_index: int, is_member: bool):
+    """Updates the replica in memory and persists the change to Firestore."""
+    membership_replica.set_membership((current_bot.id, user_id), channel_index, is_member)
+    channel_id = str(settings_for(current_bot).mandatory_channels[channel_index]["id"])
+    try:
+        await asyncio.to_thread(save_channel_membership, str(user_id), channel_id, is_member)
+    except Exception as e:
+        print(f"Error saving subscription replica for user {user_id}: {e}")
+
+
+async def check_all_subscriptions(current_bot: Bot, user_id: int) -> tuple[bool, list[dict]]:
     """
-    Checks if a user is a member of ALL specified mandatory channels.
+    Checks if a user is a member of ALL mandatory channels of the given bot.
     Returns (True, []) if subscribed to all, otherwise (False, [list of unsubscribed channels]).
+    With SUBSCRIPTION_REPLICA_ENABLED, channels the replica knows the user is a member of need
+    no Bot API call. A "not a member" answer is always confirmed with Telegram, since a missed
+    chat_member update must not lock out a user who has subscribed.
     """
+    channels = settings_for(current_bot).mandatory_channels
+    to_verify = range(len(channels))
+    if SUBSCRIPTION_REPLICA_ENABLED:
+        await _load_replica_user(current_bot, user_id)
+        to_verify = membership_replica.channels_to_verify((current_bot.id, user_id), len(channels))
+
     unsubscribed_channels = []
-    for channel in MANDATORY_CHANNELS:
+    for index in to_verify:
+        channel = channels[index]
+        # Unknown to the replica or not a member there: ask Telegram directly
         try:
-            chat_member = await bot.get_chat_member(chat_id=channel["id"], user_id=user_id)
-            if chat_member.status not in ["member", "administrator", "creator"]:
+            chat_member = await current_bot.get_chat_member(chat_id=channel["id"], user_id=user_id)
+            is_member = chat_member.status in SUBSCRIBED_STATUSES
+            if not is_member:
                 unsubscribed_channels.append(channel)
+            if SUBSCRIPTION_REPLICA_ENABLED:
+                await _record_membership(current_bot, user_id, index, is_member)
         except Exception as e:
             # Log the error but continue checking other channels.
             # Treat as unsubscribed if there's an error getting chat member status.
@@ -99,19 +457,36 @@ async def check_all_subscriptions(user_id: int) -> tuple[bool, list[dict]]:
 
     return len(unsubscribed_channels) == 0, unsubscribed_channels
 
+
+async def track_channel_membership(event: types.ChatMemberUpdated):
+    """
+    Handles chat_member updates from mandatory channels (the bot must be a channel admin)
+    and records joins and leaves in the subscription replica.
+    """
+    channel_index = _mandatory_channel_index(event.chat, settings_for(event.bot).mandatory_channels)
+    if channel_index is None:
+        return
+    user_id = event.new_chat_member.user.id
+    is_member = event.new_chat_member.status in SUBSCRIBED_STATUSES
+    await _record_membership(event.bot, user_id, channel_index, is_member)
+
+
+if SUBSCRIPTION_REPLICA_ENABLED:
+    dp.chat_member.register(track_channel_membership)
+
 def subscription_required(func):
     """
     A decorator to ensure a user is subscribed to all mandatory channels.
     If not subscribed, it sends a message with subscription links and a check button.
-    Admins defined in ADMIN_USER_IDS bypass this check.
+    Admins of the bot the message arrived through bypass this check.
     """
     @wraps(func) # Preserves original function's metadata
     async def wrapper(message: types.Message, *args, **kwargs):
         # Admins bypass the subscription check
-        if message.from_user.id in ADMIN_USER_IDS:
+        if is_admin(message.from_user.id, message.bot):
             return await func(message, *args, **kwargs)
 
-        is_subscribed, unsubscribed_channels = await check_all_subscriptions(message.from_user.id)
+        is_subscribed, unsubscribed_channels = await check_all_subscriptions(message.bot, message.from_user.id)
 
         if not is_subscribed:
             # Build the inline keyboard for subscription links and a check button
@@ -144,7 +519,7 @@ async def process_check_subscription_callback(callback_query: types.CallbackQuer
     It re-checks their subscription status and updates the message.
     """
     user_id = callback_query.from_user.id
-    is_subscribed, unsubscribed_channels = await check_all_subscriptions(user_id)
+    is_subscribed, unsubscribed_channels = await check_all_subscriptions(callback_query.bot, user_id)
 
     if is_subscribed:
         # If subscribed, delete the old message and send a welcome message with main keyboard
@@ -175,31 +550,20 @@ async def process_check_subscription_callback(callback_query: types.CallbackQuer
 
 # --- Utility Functions ---
 
-def get_next_available_code():
+async def get_next_available_code():
     """
     Determines the next sequential integer code available in Firebase.
     It fetches all existing movie codes and returns the smallest positive integer
     that is not currently in use.
     """
-    all_movies_raw = get_all_movies_data() # Fetch all movies from Firebase
-    all_movies = {} # Initialize as an empty dictionary
-
-    # Ensure all_movies is a dictionary for consistent processing
-    if all_movies_raw:
-        if isinstance(all_movies_raw, dict):
-            all_movies = all_movies_raw
-        elif isinstance(all_movies_raw, list):
-            # This handles cases where Firebase might store data as an array for sequential integer keys
-            # or for robustness against unexpected data structures.
-            for i, item in enumerate(all_movies_raw):
-                if item is not None:
-                    all_movies[str(i)] = item
-
-    numerical_codes = []
+    if CATALOG_CACHE_ENABLED:
+        codes = (await get_movie_catalog_async()).codes() # Cached movie catalog
+    else:
+        # Document IDs only; merged codes stay taken so they keep opening their movie
+        codes = [code async for code, _ in stream_movies_async(fields=(), include_aliases=True)]
+
     # Extract only integer-like codes
-    for code in all_movies.keys():
-        if code.isdigit():
-            numerical_codes.append(int(code))
+    numerical_codes = [int(code) for code in codes if code.isdigit()]
 
     if not numerical_codes:
         return 1 # If no numerical codes exist, start from 1
@@ -212,6 +576,12 @@ def get_next_available_code():
 
 
 # --- User Reply Keyboard ---
+# Shown when Firestore is unavailable and there is no cached data to answer from
+DATA_UNAVAILABLE_TEXT = ("Hozir filmlar bazasi bilan bog'lanib bo'lmadi. Iltimos, birozdan so'ng qayta urinib ko'ring.")
+# Appended to lists built from the last known catalog while Firestore is unavailable
+STALE_DATA_NOTE = "\n<i>⚠️ Ro'yxat vaqtincha saqlangan nusxadan olindi va to'liq yangilanmagan bo'lishi mumkin.</i>"
+
+
 def get_user_main_keyboard():
     """
     Returns a ReplyKeyboardMarkup for regular users with main navigation buttons.
@@ -240,7 +610,7 @@ async def admin_help_command(message: types.Message):
     Admin command to list all available admin commands and their usage.
     Only accessible by users in ADMIN_USER_IDS.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         return
 
@@ -252,6 +622,14 @@ async def admin_help_command(message: types.Message):
         "  Film kodini o'chiradi. Sizdan film kodi so'raladi.\n\n"
         "• <b>/listallmovies</b>\n"
         "  Firebase'da saqlangan barcha filmlar kodlari va sarlavhalarini ro'yxatini ko'rsatadi.\n\n"
+        "• <b>/stats</b>\n"
+        "  Faol foydalanuvchilar (kunlik, haftalik, oylik) va bot hisoblagichlarini ko'rsatadi.\n\n"
+        "• <b>/backfillsearch</b>\n"
+        "  Eski filmlarga server tomonidagi nom qidiruvi uchun maydonlarni qo'shadi (migratsiya).\n\n"
+        "• <b>/duplicates</b> [merge]\n"
+        "  Bir xil fayldan saqlangan takroriy filmlarni ko'rsatadi; <code>merge</code> bilan ularni birlashtiradi.\n\n"
+        "• <b>/profile &lt;soniya&gt;</b>\n"
+        "  Botni berilgan soniya davomida profillaydi va eng ko'p vaqt olgan funksiyalarni fayl qilib yuboradi.\n\n"
         "• <b>/myid</b>\n"
         "  Sizning Telegram User IDingizni ko'rsatadi (admin IDsni sozlash uchun foydali).\n\n"
         "• <b>/cancel</b>\n"
@@ -272,11 +650,15 @@ async def add_movie_start(message: types.Message, state: FSMContext):
     Prompts the admin to send the movie file and suggests the next available code.
     Sets the FSM state to waiting_for_movie_file.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         return
 
-    next_code_suggestion = get_next_available_code() # Get a suggested code from Firebase data
+    try:
+        next_code_suggestion = await get_next_available_code() # Get a suggested code from Firebase data
+    except FirestoreUnavailableError:
+        await message.answer(DATA_UNAVAILABLE_TEXT)
+        return
 
     await message.answer(
         "Yangi film qo'shish uchun, iltimos, film faylini (video yoki hujjat) menga yuboring yoki o'tkazing."
@@ -295,7 +677,7 @@ async def delete_movie_start(message: types.Message, state: FSMContext):
     Prompts the admin to send the movie code to be deleted.
     Sets the FSM state to waiting_for_delete_code.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         return
 
@@ -312,16 +694,21 @@ async def process_delete_movie_code(message: types.Message, state: FSMContext):
     Handles the movie code provided by the admin for deletion.
     It attempts to delete the movie from Firebase based on the given code.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         await state.clear() # Clear state if unauthorized user somehow gets here
         return
 
     movie_code = message.text.strip().lower() # Normalize input code
 
-    existing_movie = get_movie_data(movie_code) # Check if movie exists in Firebase
+    try:
+        existing_movie = await get_movie_data_async(movie_code, use_filters=False) # Check if movie exists in Firebase
+        if existing_movie:
+            await asyncio.to_thread(delete_movie_code, movie_code) # Delete movie from Firebase
+    except FirestoreUnavailableError:
+        await message.answer(DATA_UNAVAILABLE_TEXT) # Keep the state, so the admin can send the code again
+        return
     if existing_movie:
-        delete_movie_code(movie_code) # Delete movie from Firebase
         await message.answer(
             f"Film <b>'{existing_movie.get('name', 'Nomsiz Film')}'</b> (kod: <b>{movie_code}</b>) muvaffaqiyatli o'chirildi."
         )
@@ -340,34 +727,25 @@ async def list_all_movies(message: types.Message):
     Sorts numerical codes numerically and non-numerical codes alphabetically.
     Handles messages longer than Telegram's 4096 character limit by splitting.
     """
-    movies_data_raw = get_all_movies_data() # Fetch all movies from Firebase
-    movies_data = {} # Initialize as an empty dictionary
-
-    # Ensure movies_data is a dictionary for consistent processing
-    if movies_data_raw:
-        if isinstance(movies_data_raw, dict):
-            movies_data = movies_data_raw
-        elif isinstance(movies_data_raw, list):
-            for i, item in enumerate(movies_data_raw):
-                if item is not None:
-                    movies_data[str(i)] = item
+    # Sort codes: numerical first (as integers), then alphabetical for others
+    try:
+        if CATALOG_CACHE_ENABLED:
+            sorted_movies = (await get_movie_catalog_async()).sorted_names() # Cached movie catalog
+        else:
+            # No cache: stream only the names, page by page
+            sorted_movies = sorted([(code, data.get('name', 'Nomsiz Film'))
+                                    async for code, data in stream_movies_async()],
+                                   key=lambda item: code_sort_key(item[0]))
+    except FirestoreUnavailableError:
+        await message.answer(DATA_UNAVAILABLE_TEXT)
+        return
 
-    if movies_data:
+    if sorted_movies:
         response_text = "<b>Barcha Filmlar Ro'yxati:</b>\n\n"
-        try:
-            # Sort codes: numerical first (as integers), then alphabetical for others
-            sorted_codes = sorted(movies_data.keys(), key=lambda x: (int(x) if x.isdigit() else float('inf'), x))
-        except ValueError:
-            # Fallback for unexpected non-digit codes if error occurs during int conversion
-            sorted_codes = sorted(movies_data.keys())
-
-        for code in sorted_codes:
-            movie_info = movies_data.get(code)
-            if isinstance(movie_info, dict):
-                movie_name = movie_info.get('name', 'Nomsiz Film') # Fallback name if 'name' key is missing
-                response_text += f"Kod: <b>{code}</b> - {movie_name}\n"
-            else:
-                response_text += f"Kod: <b>{code}</b> (Ma'lumot topilmadi yoki xato formatda)\n"
+        for code, movie_name in sorted_movies:
+            response_text += f"Kod: <b>{code}</b> - {movie_name}\n"
+        if CATALOG_CACHE_ENABLED and catalog_is_stale():
+            response_text += STALE_DATA_NOTE
 
         # Split long messages into chunks to comply with Telegram API limits
         if len(response_text) > 4096: # Telegram's message character limit
@@ -380,6 +758,157 @@ async def list_all_movies(message: types.Message):
         await message.answer("Hozircha hech qanday film qo'shilmagan. Adminlar hali film qo'shmaganlar.")
 
 
+@dp.message(Command("stats"))
+async def show_stats(message: types.Message):
+    """
+    Admin command showing estimated active users (from the activity sketches),
+    the total user count and the bot's flood-control and lookup counters.
+    """
+    if not is_admin(message.from_user.id, message.bot):
+        await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
+        return
+
+    # Merging a month of sketches takes tens of milliseconds; keep it off the event loop
+    summary = await asyncio.to_thread(activity_tracker.summary)
+    try:
+        total_users = await asyncio.to_thread(get_user_count)
+    except Exception as e:
+        print(f"Error counting users for /stats: {e}")
+        total_users = "?"
+    lookups = ", ".join(f"{source}: {count}" for source, count in movie_lookup_stats.most_common()) or "yo'q"
+    dedup = update_deduplicator.stats
+    stats_text = (
+        "<b>📊 Bot statistikasi</b> (taxminiy, UTC kunlari bo'yicha)\n\n"
+        f"• Jami foydalanuvchilar: <b>{total_users}</b>\n"
+        f"• Bugun faol (DAU): <b>{summary['dau']}</b>\n"
+        f"• 7 kunda faol (WAU): <b>{summary['wau']}</b>\n"
+        f"• 30 kunda faol (MAU): <b>{summary['mau']}</b>\n"
+        f"• Bugun yangi: <b>{summary['new_today']}</b>, qaytganlar: <b>{summary['returning_today']}</b>\n\n"
+        f"• Cheklangan so'rovlar: <b>{sum(throttling_middleware.throttled_events.values())}</b>\n"
+        f"• Takroriy yangilanishlar tashlandi: <b>{dedup['dropped_memory'] + dedup['dropped_shared']}</b> "
+        f"(xotira: {dedup['dropped_memory']}, Firestore: {dedup['dropped_shared']})\n"
+        f"• Kod qidiruvlari javobi: {lookups}\n"
+        f"• Katalog: boshqa workerlardan sinxronlar: {catalog_stats['version_syncs']}, "
+        f"eskirgan javoblar: {catalog_stats['stale']}\n"
+        f"• Qidiruv keshi: <b>{query_result_cache.hit_rate:.0%}</b> (topildi: {query_result_cache.stats['hits']}, "
+        f"topilmadi: {query_result_cache.stats['misses']}, yozuvlar: {len(query_result_cache)})\n"
+        f"• Firestore holati: <b>{firestore_breaker.state}</b> "
+        f"(xatolar: {firestore_breaker.stats['failures']}, ochilgan: {firestore_breaker.stats['opened']}, "
+        f"rad etilgan: {firestore_breaker.stats['rejected']})"
+    )
+    if UPDATE_LANES_ENABLED:
+        for name, lane in update_lanes.lanes.items():
+            lane_summary = lane.summary()
+            stats_text += (f"\n• Navbat <b>{name}</b> ({lane.concurrency} joy): {lane_summary['handled']} ta, "
+                           f"p50 {lane_summary['p50_ms']:.0f} ms, p95 {lane_summary['p95_ms']:.0f} ms, "
+                           f"kutish p95 {lane_summary['wait_p95_ms']:.0f} ms, kutmoqda {lane_summary['waiting']}")
+    if loop_watchdog is not None:
+        worst = ", ".join(f"{key}: {count}" for key, count in loop_watchdog.stall_counts.most_common(3)) or "yo'q"
+        stats_text += (f"\n• Event loop to'xtashlari: <b>{loop_watchdog.total_stalls}</b> "
+                       f"(eng uzuni {loop_watchdog.max_stall * 1000:.0f} ms; {worst})")
+    await message.answer(stats_text)
+
+
+@dp.message(Command("backfillsearch"))
+async def backfill_search_command(message: types.Message):
+    """
+    Admin migration command: writes the normalized name fields used by the server-side
+    name search to every movie saved before they existed. Safe to run more than once.
+    """
+    if not is_admin(message.from_user.id, message.bot):
+        await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
+        return
+
+    await message.answer("Film nomlari qidiruv uchun yangilanmoqda...")
+    try:
+        updated = await asyncio.to_thread(backfill_name_search_fields)
+    except Exception as e:
+        print(f"Error backfilling name search fields: {e}")
+        await message.answer("Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring.")
+        return
+    await message.answer(f"Tayyor: <b>{updated}</b> ta film yangilandi.")
+
+
+def _parse_profile_seconds(value) -> float | None:
+    """
+    Returns the requested profile duration (1 to PROFILE_MAX_SECONDS seconds, fractions allowed),
+    or None if it is missing or out of range.
+    """
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if 1 <= seconds <= PROFILE_MAX_SECONDS else None
+
+
+@dp.message(Command("duplicates"))
+async def duplicates_command(message: types.Message, command: CommandObject):
+    """
+    Admin command listing movies stored more than once from the same file.
+    "/duplicates merge" keeps the lowest code of each group and turns the others into aliases of it.
+    """
+    if not is_admin(message.from_user.id, message.bot):
+        await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
+        return
+
+    merge = (command.args or "").strip().lower() == "merge"
+    await message.answer("Takroriy filmlar qidirilmoqda...")
+    try:
+        groups = await asyncio.to_thread(find_duplicate_movies)
+        merged = await asyncio.to_thread(merge_duplicate_movies, groups) if merge and groups else 0
+    except Exception as e:
+        print(f"Error finding or merging duplicate movies: {e}")
+        await message.answer(f"Xatolik yuz berdi: {e}")
+        return
+
+    if not groups:
+        await message.answer("Takroriy filmlar topilmadi.")
+        return
+    lines = []
+    for group in groups:
+        (kept_code, kept_name), *duplicates = group['movies']
+        duplicate_codes = ", ".join(f"<b>{code}</b>" for code, _ in duplicates)
+        lines.append(f"• <b>{kept_code}</b> - {kept_name} ← {duplicate_codes}")
+    if merge:
+        header = (f"<b>{len(groups)}</b> guruh birlashtirildi: <b>{merged}</b> ta takroriy kod ro'yxatdan olindi, "
+                  "lekin ular chapdagi kodning filmini ochishda davom etadi:\n\n")
+    else:
+        header = (f"<b>{len(groups)}</b> guruh takroriy film topildi (chapdagi kod qoladi). "
+                  "Birlashtirish uchun: <code>/duplicates merge</code>\n\n")
+    response_text = header + "\n".join(lines)
+    for start in range(0, len(response_text), 4096): # Telegram's message character limit
+        await message.answer(response_text[start:start + 4096])
+
+
+@dp.message(Command("profile"))
+async def profile_command(message: types.Message, command: CommandObject):
+    """
+    Admin command that samples the live process for the given number of seconds and
+    sends the top functions by cumulative time as a text document.
+    """
+    if not is_admin(message.from_user.id, message.bot):
+        await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
+        return
+
+    seconds = _parse_profile_seconds(command.args)
+    if seconds is None:
+        await message.answer(f"Foydalanish: <code>/profile &lt;soniya&gt;</code> (1-{PROFILE_MAX_SECONDS:g}).")
+        return
+    if sampling_profiler.running:
+        await message.answer("Profil allaqachon olinmoqda. Iltimos, u tugashini kuting.")
+        return
+
+    await message.answer(f"⏱ {seconds:g} soniyalik profil olinmoqda...")
+    try:
+        report = await asyncio.to_thread(sampling_profiler.profile, seconds)
+    except RuntimeError:
+        await message.answer("Profil allaqachon olinmoqda. Iltimos, u tugashini kuting.")
+        return
+    filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+    await message.answer_document(types.BufferedInputFile(report.encode("utf-8"), filename=filename),
+                                  caption=f"Profil: {seconds:g} soniya")
+
+
 @dp.message(Command("cancel"), StateFilter(AddMovieStates, DeleteMovieStates))
 async def cancel_handler(message: types.Message, state: FSMContext):
     """
@@ -387,7 +916,7 @@ async def cancel_handler(message: types.Message, state: FSMContext):
     Clears the current state for the user.
     """
     # Admins only for this specific cancel, as it clears admin FSM states.
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         return
 
@@ -409,19 +938,22 @@ async def process_movie_file(message: types.Message, state: FSMContext):
     Extracts the file_id and attempts to parse suggested code/name from the caption.
     Transitions to waiting_for_movie_code state.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         await state.clear()
         return
 
     file_id = None
+    file_unique_id = None # Same for every upload of the same file, unlike file_id
     file_type_display = "hujjat" # Default display type
 
     if message.video:
         file_id = message.video.file_id
+        file_unique_id = message.video.file_unique_id
         file_type_display = "video"
 
     elif message.document:
+        file_unique_id = message.document.file_unique_id
         # Check if document is a video (e.g., .mp4 sent as document)
         if message.document.mime_type and message.document.mime_type.startswith('video/'):
             file_id = message.document.file_id
@@ -431,7 +963,7 @@ async def process_movie_file(message: types.Message, state: FSMContext):
             file_type_display = "hujjat"
 
     if file_id:
-        await state.update_data(file_id=file_id)
+        await state.update_data(file_id=file_id, file_unique_id=file_unique_id)
 
         potential_caption = message.caption.strip() if message.caption else ""
         caption_suggested_code = ""
@@ -457,6 +989,22 @@ async def process_movie_file(message: types.Message, state: FSMContext):
             "Endi, iltimos, ushbu film uchun <b>kodni</b> yuboring (Masalan: '1' yoki 'avatar')."
         )
 
+        # A re-upload of a stored movie: offer its existing code instead of a new one
+        try:
+            existing = await find_movie_by_file_async(file_unique_id) if file_unique_id else None
+        except Exception as e:
+            existing = None
+            print(f"Error checking for a duplicate of file {file_unique_id}: {e}")
+        if existing:
+            existing_code, existing_data = existing
+            prompt_message += (
+                f"\n\n⚠️ <b>Bu fayl allaqachon saqlangan:</b> kod <code>{existing_code}</code> - "
+                f"{existing_data.get('name', 'Nomsiz Film')}.\n"
+                "Mavjud kodni ishlating yoki baribir yangi kod yuboring."
+            )
+            builder.button(text=f"♻️ Mavjud kodni ishlatish: {existing_code}",
+                           callback_data=f"use_existing_code:{existing_code}")
+
         # Offer suggested codes via inline buttons
         if sequence_suggested_code:
             prompt_message += f"\n\nTaklif qilingan kod (navbatdagi): <code>{sequence_suggested_code}</code>"
@@ -489,7 +1037,7 @@ async def process_invalid_file_type(message: types.Message, state: FSMContext):
     """
     Handles non-movie messages (like text or photos) when the bot expects a movie file.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         await state.clear()
         return
@@ -505,7 +1053,7 @@ async def process_confirm_code_callback(callback_query: types.CallbackQuery, sta
     Handles callback queries for confirming a suggested movie code from inline keyboard.
     Checks for code uniqueness and transitions to waiting_for_movie_name.
     """
-    if callback_query.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(callback_query.from_user.id, callback_query.bot):
         await callback_query.answer("Sizda bu amalni bajarishga ruxsat yo'q.", show_alert=True)
         return
 
@@ -522,7 +1070,11 @@ async def process_confirm_code_callback(callback_query: types.CallbackQuery, sta
         await callback_query.answer()
         return
 
-    existing_movie = get_movie_data(confirmed_code)
+    try:
+        existing_movie = await get_movie_data_async(confirmed_code, use_filters=False)
+    except FirestoreUnavailableError:
+        await callback_query.answer(DATA_UNAVAILABLE_TEXT, show_alert=True)
+        return
     if existing_movie:
         await callback_query.message.answer(
             f"<b>Xatolik:</b> Siz tanlagan kod (<b>{confirmed_code}</b>) allaqachon mavjud.\n"
@@ -550,13 +1102,31 @@ async def process_confirm_code_callback(callback_query: types.CallbackQuery, sta
     await callback_query.answer("Kod qabul qilindi.")
 
 
+@dp.callback_query(F.data.startswith("use_existing_code:"), AddMovieStates.waiting_for_movie_code)
+async def process_use_existing_code_callback(callback_query: types.CallbackQuery, state: FSMContext):
+    """
+    Handles the admin choosing the existing code of a re-uploaded movie.
+    Nothing is saved; the addition process ends.
+    """
+    if not is_admin(callback_query.from_user.id, callback_query.bot):
+        await callback_query.answer("Sizda bu amalni bajarishga ruxsat yo'q.", show_alert=True)
+        return
+
+    existing_code = callback_query.data.split(":", 1)[1]
+    await state.clear()
+    await callback_query.message.answer(
+        f"Film qayta saqlanmadi. Foydalanuvchilar uni <b>{existing_code}</b> kodi bilan olishlari mumkin."
+    )
+    await callback_query.answer()
+
+
 @dp.message(AddMovieStates.waiting_for_movie_code, F.text)
 async def process_movie_code_input(message: types.Message, state: FSMContext):
     """
     Handles the movie code text input from admin.
     Checks for code uniqueness and transitions to waiting_for_movie_name.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         await state.clear()
         return
@@ -575,7 +1145,11 @@ async def process_movie_code_input(message: types.Message, state: FSMContext):
 
     movie_code_to_use = user_input_code
 
-    existing_movie = get_movie_data(movie_code_to_use)
+    try:
+        existing_movie = await get_movie_data_async(movie_code_to_use, use_filters=False)
+    except FirestoreUnavailableError:
+        await message.answer(DATA_UNAVAILABLE_TEXT)
+        return
     if existing_movie:
         await message.answer(
             f"<b>Xatolik:</b> Siz kiritgan kod (<b>{movie_code_to_use}</b>) allaqallon mavjud.\n"
@@ -607,13 +1181,14 @@ async def process_confirm_name_callback(callback_query: types.CallbackQuery, sta
     Handles callback queries for confirming a suggested movie name from inline keyboard.
     Saves the movie data to Firebase and clears the state.
     """
-    if callback_query.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(callback_query.from_user.id, callback_query.bot):
         await callback_query.answer("Sizda bu amalni bajarishga ruxsat yo'q.", show_alert=True)
         return
 
     confirmed_name = callback_query.data.split(":")[1]
     data = await state.get_data()
     file_id = data.get("file_id")
+    file_unique_id = data.get("file_unique_id")
     final_movie_code = data.get("final_movie_code")
 
     if not file_id or not final_movie_code:
@@ -625,7 +1200,7 @@ async def process_confirm_name_callback(callback_query: types.CallbackQuery, sta
         return
 
     try:
-        save_movie_data(final_movie_code, file_id, confirmed_name)
+        await asyncio.to_thread(save_movie_data, final_movie_code, file_id, confirmed_name, file_unique_id)
         await callback_query.message.answer(
             f"Film muvaffaqiyatli saqlandi!\n"
             f"Kod: `{final_movie_code}`\nSarlavha: <b>{confirmed_name}</b>\n"
@@ -633,6 +1208,8 @@ async def process_confirm_name_callback(callback_query: types.CallbackQuery, sta
             "Siz endi yangi film qo'shishingiz yoki botni ishlatishingiz mumkin."
         )
         await state.clear()
+    except FirestoreUnavailableError:
+        await callback_query.message.answer(DATA_UNAVAILABLE_TEXT)
     except Exception as e:
         await callback_query.message.answer(f"Firebase'ga saqlashda kutilmagan xatolik yuz berdi: {e}\n"
                                             "Iltimos, qaytadan urinib ko'ring yoki /cancel.")
@@ -646,7 +1223,7 @@ async def process_movie_name_input(message: types.Message, state: FSMContext):
     Handles the movie name text input from admin.
     Saves the movie data to Firebase and clears the state.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         await state.clear()
         return
@@ -654,6 +1231,7 @@ async def process_movie_name_input(message: types.Message, state: FSMContext):
     user_input_name = message.text.strip()
     data = await state.get_data()
     file_id = data.get("file_id")
+    file_unique_id = data.get("file_unique_id")
     final_movie_code = data.get("final_movie_code")
 
     if not file_id or not final_movie_code:
@@ -666,7 +1244,7 @@ async def process_movie_name_input(message: types.Message, state: FSMContext):
     movie_name_to_save = user_input_name
 
     try:
-        save_movie_data(final_movie_code, file_id, movie_name_to_save)
+        await asyncio.to_thread(save_movie_data, final_movie_code, file_id, movie_name_to_save, file_unique_id)
         await message.answer(
             f"Film muvaffaqiyatli saqlandi!\n"
             f"Kod: `{final_movie_code}`\nSarlavha: <b>{movie_name_to_save}</b>\n"
@@ -674,6 +1252,8 @@ async def process_movie_name_input(message: types.Message, state: FSMContext):
             "Siz endi yangi film qo'shishingiz yoki botni ishlatishingiz mumkin."
         )
         await state.clear()
+    except FirestoreUnavailableError:
+        await message.answer(DATA_UNAVAILABLE_TEXT)
     except Exception as e:
         await message.answer(f"Firebase'ga saqlashda kutilmagan xatolik yuz berdi: {e}\n"
                              "Iltimos, qaytadan urinib ko'ring yoki /cancel.")
@@ -685,7 +1265,7 @@ async def process_invalid_name_input(message: types.Message, state: FSMContext):
     """
     Handles non-text messages when the bot expects a movie name.
     """
-    if message.from_user.id not in ADMIN_USER_IDS:
+    if not is_admin(message.from_user.id, message.bot):
         await message.answer("Sizda bu buyruqni ishlatishga ruxsat yo'q.")
         await state.clear()
         return
@@ -704,9 +1284,13 @@ async def handle_start(message: types.Message):
     It adds the user to stats, sends a welcome message, and the user keyboard.
     """
     user_id = str(message.from_user.id)  # Convert to string for Firebase keys
-    add_user_to_stats(user_id)  # Add user to the stats collection or update last_seen
-
-    total_users = get_user_count()  # Get the current total user count
+    try:
+        await asyncio.to_thread(add_user_to_stats, user_id)  # Add user to the stats collection or update last_seen
+        total_users = await asyncio.to_thread(get_user_count)  # Get the current total user count
+    except Exception as e:
+        # Still greet the user when Firestore is unavailable
+        print(f"Error updating user stats for {user_id}: {e}")
+        total_users = "?"
 
     welcome_message = (
         "<b>Assalomu alaykum!</b> 👋\n\n"
@@ -717,7 +1301,7 @@ async def handle_start(message: types.Message):
         f"\n\n🥳 Baxtli foydalanuvchilar soni: <b>{total_users}</b>"
     )
 
-    if message.from_user.id in ADMIN_USER_IDS:
+    if is_admin(message.from_user.id, message.bot):
         welcome_message += "\n\n<i>Siz adminsiz! Admin buyruqlariga kirish uchun /adminhelp ni bosing.</i>"
 
     await message.answer(welcome_message, reply_markup=get_user_main_keyboard(), protect_content=True)
@@ -758,6 +1342,46 @@ async def show_user_help_button(message: types.Message):
     await user_help_command(message) # Delegates to the shared help function
 
 
+_catalog_warmup_task = None
+
+
+def _warm_catalog_in_background():
+    """Starts loading the movie catalog without making the current request wait for it."""
+    global _catalog_warmup_task
+    if _catalog_warmup_task is not None and not _catalog_warmup_task.done():
+        return
+
+    def log_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error warming up the movie catalog: {task.exception()}")
+
+    _catalog_warmup_task = asyncio.ensure_future(get_movie_catalog_async())
+    _catalog_warmup_task.add_done_callback(log_failure)
+
+
+def _build_search_result(movie_data, found_code, matched_movies):
+    """
+    Turns a lookup into what handle_code_or_name sends, in the form kept by query_result_cache:
+    ('movie', code, file_id, name), ('matches', text, keyboard) or ('none',).
+    """
+    if movie_data:
+        return 'movie', found_code, movie_data.get('file_id'), movie_data.get('name', f"Kod {found_code}")
+    if not matched_movies:
+        return ('none',)
+    builder = InlineKeyboardBuilder()
+    response_text = "Bir nechta film topildi. Qaysi biri kerak?\n\n"
+    # Sort matched movies by name for consistent display
+    matched_movies_sorted = sorted(matched_movies, key=lambda x: x['data'].get('name', '').lower())
+    for match in matched_movies_sorted:
+        code = match['code']
+        name = match['data'].get('name', 'Nomsiz Film')
+        response_text += f"Kod: <b>{code}</b> - {name}\n"
+        builder.button(text=f"{name} (Kod: {code})", callback_data=f"select_movie:{code}")
+
+    builder.adjust(1)  # Arrange buttons in a single column
+    return 'matches', response_text, builder.as_markup()
+
+
 @dp.message(F.text)  # This general handler only triggers for text messages not caught by other commands/states
 @subscription_required # Apply the decorator here to enforce subscription for general text messages
 async def handle_code_or_name(message: types.Message):
@@ -767,7 +1391,8 @@ async def handle_code_or_name(message: types.Message):
     If multiple matches are found, it provides inline buttons for selection.
     """
     # Prevent processing admin text if they are in an FSM state (e.g., adding/deleting movie)
-    current_state = await dp.fsm.get_context(bot, user_id=message.from_user.id, chat_id=message.chat.id).get_state()
+    current_state = await dp.fsm.get_context(message.bot, user_id=message.from_user.id,
+                                             chat_id=message.chat.id).get_state()
     if current_state: # If user is in ANY FSM state, do not process as general text input
         # Note: Valid FSM inputs are handled by their respective handlers.
         # This prevents accidental triggers for other states.
@@ -781,84 +1406,75 @@ async def handle_code_or_name(message: types.Message):
         return
 
     query = message.text.strip().lower()  # Normalize query for case-insensitive matching
+    name_query = normalize_movie_name(message.text)
+    # Codes are looked up by the lowercased text, so it is part of the key when normalizing changed it
+    cache_key = (catalog_revision(), name_query if query == name_query else (name_query, query))
+    result = query_result_cache.get(cache_key)
+    if result is None:
+        movie_data = None
+        found_code = None
+        matched_movies = []  # To store all potential matches for name search
 
-    movie_data = None
-    found_code = None
-    matched_movies = []  # To store all potential matches for name search
-
-    # 1. Try to find by exact code first
-    retrieved_data_by_code = get_movie_data(query)
-    if retrieved_data_by_code and isinstance(retrieved_data_by_code, dict):
-        movie_data = retrieved_data_by_code
-        found_code = query  # The code is the query itself
-    else:
-        # 2. If not found by exact code, try to find by movie name (case-insensitive, partial match)
-        all_movies_raw = get_all_movies_data()  # Fetch all movies from Firebase
-        all_movies = {}  # Initialize as empty dict
-
-        # Ensure all_movies is a dictionary for consistent processing
-        if all_movies_raw:
-            if isinstance(all_movies_raw, dict):
-                all_movies = all_movies_raw
-            elif isinstance(all_movies_raw, list):
-                for i, item in enumerate(all_movies_raw):
-                    if item is not None:
-                        all_movies[str(i)] = item
-
-        if all_movies:  # Now work with the guaranteed dictionary
-            for code, data in all_movies.items():
-                if isinstance(data, dict) and 'name' in data and query in data['name'].lower():
-                    matched_movies.append({'code': code, 'data': data})
-
-    if movie_data:  # If found by exact code
         try:
-            movie_file_id = movie_data['file_id']
-            movie_name = movie_data.get('name', f"Kod {found_code}") # Use code as fallback name
-            await message.answer_video(
-                video=movie_file_id,
-                caption=f"🎬 Siz so'ragan film: <b>{movie_name}</b> (Kod: {found_code})",
-                protect_content=True
-            )
+            # 1. Try to find by exact code first
+            retrieved_data_by_code = await get_movie_data_async(query)
+            if retrieved_data_by_code and isinstance(retrieved_data_by_code, dict):
+                movie_data = retrieved_data_by_code
+                found_code = query  # The code is the query itself
+            else:
+                # 2. If not found by exact code, try to find by movie name (normalized, partial match)
+                if CATALOG_CACHE_ENABLED and catalog_is_loaded():
+                    catalog = await get_movie_catalog_async()  # Cached movie catalog
+                    matched_movies = [{'code': movie.code, 'data': movie.to_dict()}
+                                      for movie in catalog.search(name_query)]
+                elif NAME_SEARCH_SERVER_SIDE:
+                    # Cold cache: let Firestore find the candidates instead of downloading every movie first
+                    if CATALOG_CACHE_ENABLED:
+                        _warm_catalog_in_background()
+                    found = await search_movies_by_name_async(name_query)
+                    matched_movies = [{'code': code, 'data': data} for code, data in found]
+                else:
+                    # No cache: scan only the names page by page, then fetch the full document of a single match
+                    async for code, data in stream_movies_async():
+                        if name_query in normalize_movie_name(data.get('name', '')):
+                            matched_movies.append({'code': code, 'data': data})
+                    if len(matched_movies) == 1:
+                        matched_movies[0]['data'] = await get_movie_data_async(matched_movies[0]['code']) or {}
         except Exception as e:
-            print(f"Error sending movie with file_id {movie_data.get('file_id')} for query '{query}': {e}")
-            await message.answer(
-                f"Xatolik yuz berdi: Film yuborilmadi. Iltimos, keyinroq urinib ko'ring.\n\n"
-                "<i>Agar bu xatolik tez-tez takrorlansa, bot egasiga murojaat qiling.</i>",
-                reply_markup=get_user_main_keyboard(),
-                protect_content=True
-            )
-    elif len(matched_movies) == 1:  # Found by name, exactly one match
-        movie_data = matched_movies[0]['data']
-        found_code = matched_movies[0]['code']
+            # Deadline exceeded, circuit breaker open or a Firestore error with no cached data to fall back to
+            print(f"Error looking up movie for query '{query}': {e}")
+            await message.answer(DATA_UNAVAILABLE_TEXT, reply_markup=get_user_main_keyboard())
+            return
+
+        if not movie_data and len(matched_movies) == 1:  # Found by name, exactly one match
+            movie_data = matched_movies[0]['data']
+            found_code = matched_movies[0]['code']
+        result = _build_search_result(movie_data, found_code, matched_movies)
+        # Results answered from a stale catalog or fallback are not worth keeping
+        if firestore_breaker.state == 'closed' and not (CATALOG_CACHE_ENABLED and catalog_is_stale()):
+            query_result_cache.put(cache_key, result)
+
+    if result[0] == 'movie':  # Found by exact code or by a single name match
+        _, found_code, movie_file_id, movie_name = result
         try:
-            movie_file_id = movie_data['file_id']
-            movie_name = movie_data.get('name', f"Kod {found_code}")
             await message.answer_video(
                 video=movie_file_id,
                 caption=f"🎬 Siz so'ragan film: <b>{movie_name}</b> (Kod: {found_code})",
                 protect_content=True
             )
         except Exception as e:
-            print(f"Error sending movie by name with file_id {movie_data.get('file_id')} for query '{query}': {e}")
+            print(f"Error sending movie with file_id {movie_file_id} for query '{query}': {e}")
             await message.answer(
                 f"Xatolik yuz berdi: Film yuborilmadi. Iltimos, keyinroq urinib ko'ring.\n\n"
                 "<i>Agar bu xatolik tez-tez takrorlansa, bot egasiga murojaat qiling.</i>",
                 reply_markup=get_user_main_keyboard(),
                 protect_content=True
             )
-    elif len(matched_movies) > 1:  # Found by name, multiple matches
-        builder = InlineKeyboardBuilder()
-        response_text = "Bir nechta film topildi. Qaysi biri kerak?\n\n"
-        # Sort matched movies by name for consistent display
-        matched_movies_sorted = sorted(matched_movies, key=lambda x: x['data'].get('name', '').lower())
-        for match in matched_movies_sorted:
-            code = match['code']
-            name = match['data'].get('name', 'Nomsiz Film')
-            response_text += f"Kod: <b>{code}</b> - {name}\n"
-            builder.button(text=f"{name} (Kod: {code})", callback_data=f"select_movie:{code}")
-
-        builder.adjust(1)  # Arrange buttons in a single column
-        await message.answer(response_text, reply_markup=builder.as_markup())
+    elif result[0] == 'matches':  # Found by name, multiple matches
+        _, response_text, reply_markup = result
+        if CATALOG_CACHE_ENABLED and catalog_is_stale():
+            response_text += STALE_DATA_NOTE
+        await message.answer(response_text, reply_markup=reply_markup)
     else:  # No movie found by code or name
         await message.answer(
             f"Kechirasiz, <b>'{message.text}'</b> kodli yoki sarlavhali film topilmadi. "
@@ -876,7 +1492,11 @@ async def process_select_movie_callback(callback_query: types.CallbackQuery):
     Retrieves and sends the selected movie.
     """
     selected_code = callback_query.data.split(":")[1]
-    movie_data = get_movie_data(selected_code)
+    try:
+        movie_data = await get_movie_data_async(selected_code)
+    except FirestoreUnavailableError:
+        await callback_query.answer(DATA_UNAVAILABLE_TEXT, show_alert=True)
+        return
 
     if movie_data:
         try:
@@ -921,40 +1541,218 @@ async def handle_unrecognized_message(message: types.Message):
     )
 
 
-# Main function to run the bot
+async def _process_polled_update(current_bot: Bot, update: types.Update, semaphore: asyncio.Semaphore):
+    """Feeds one polled update to the dispatcher and frees its slot afterwards."""
+    try:
+        await dp.feed_update(current_bot, update)
+    except Exception as e:
+        print(f"Error processing update {update.update_id}: {e}")
+    finally:
+        semaphore.release()
+
+
+async def _poll_bot(current_bot: Bot, semaphore: asyncio.Semaphore, running_tasks: set):
+    """Long-polls one bot forever, handing its updates to the shared slots."""
+    allowed_updates = dp.resolve_used_update_types()
+    # Wait a bit longer than the long-polling timeout so the HTTP request itself doesn't time out first
+    request_timeout = int(current_bot.session.timeout + POLLING_TIMEOUT)
+    offset = None
+    while True:
+        try:
+            updates = await current_bot.get_updates(offset=offset, limit=POLLING_BATCH_SIZE, timeout=POLLING_TIMEOUT,
+                                                    allowed_updates=allowed_updates, request_timeout=request_timeout)
+        except Exception as e:
+            print(f"Failed to fetch updates for bot {current_bot.id}: {e}. Retrying in 5 seconds...")
+            await asyncio.sleep(5)
+            continue
+
+        for update in updates:
+            # Confirm the update on the next getUpdates call
+            offset = update.update_id + 1
+            await semaphore.acquire()
+            task = asyncio.create_task(_process_polled_update(current_bot, update, semaphore))
+            running_tasks.add(task)
+            task.add_done_callback(running_tasks.discard)
+
+
+# Main function to run the bot in long-polling mode
 async def main():
+    """
+    Runs every configured bot with long polling. Updates are fetched in batches of
+    POLLING_BATCH_SIZE and handled concurrently, at most POLLING_CONCURRENCY at a time across
+    all bots. When all slots are busy, fetching pauses, so a flood of updates never piles up
+    unbounded tasks in memory. With priority lanes, the lanes limit concurrency instead and a
+    slot only bounds fetched updates (POLLING_MAX_PENDING): a slot held by an update queued in
+    the user lane must not stop admin or callback updates behind it from being fetched.
+    Uses the same startup and shutdown hooks as the webhook app.
+    """
     # Ensure BOT_TOKEN is available before starting polling
     if not BOT_TOKEN:
         print("CRITICAL ERROR: BOT_TOKEN environment variable not set. Bot cannot start.")
         exit(1) # Exit if token is missing
 
-    print("Starting bot polling...")
-    # This function will start the bot and keep it running, listening for updates.
-    await dp.start_polling(bot)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    await on_startup()
+
+    slots = POLLING_MAX_PENDING if UPDATE_LANES_ENABLED else POLLING_CONCURRENCY
+    semaphore = asyncio.Semaphore(slots)
+    running_tasks = set()
+
+    print(f"Starting polling for {len(bots)} bot(s) (batch size {POLLING_BATCH_SIZE}, "
+          f"{'pending limit' if UPDATE_LANES_ENABLED else 'concurrency'} {slots})...")
+    try:
+        await asyncio.gather(*(_poll_bot(current_bot, semaphore, running_tasks) for current_bot in bots))
+    finally:
+        print("Polling stopped. Waiting for running handlers to finish...")
+        if running_tasks:
+            await asyncio.gather(*running_tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await on_shutdown()
+
+
+async def on_startup(app=None):
+    """
+    Startup hook shared by webhook and polling mode.
+    Runs after the dispatcher startup event, before any update is processed.
+    """
+    global _activity_persist_task
+    print(f"JSON codec for updates and Bot API calls: {JSON_CODEC_NAME}")
+    # Pay for the Firestore channel setup and token minting now, not on the first user request
+    await asyncio.to_thread(warm_up_firestore)
+    # Follow saves and deletes made by other workers/dynos so cached movies stay coherent
+    start_catalog_version_watch()
+    _activity_persist_task = asyncio.create_task(_persist_activity_periodically())
+    if loop_watchdog is not None:
+        loop_watchdog.start()
+
+    if BOT_MODE == "polling":
+        # Telegram refuses getUpdates while a webhook is set
+        for current_bot in bots:
+            await current_bot.delete_webhook()
+        print("Polling mode: webhook removed.")
+        return
 
-async def on_startup(app):
     # Set Telegram webhook
     webhook_url = os.getenv("WEBHOOK_URL")  # You'll set this env var in Render
     if webhook_url:
-        await bot.set_webhook(url=webhook_url)
-        print(f"Webhook set to {webhook_url}")
+        parsed_url = urlparse(webhook_url)
+        for current_bot in bots:
+            # The main bot keeps WEBHOOK_URL as is; extra bots get their own path on the same host
+            bot_webhook_url = webhook_url if current_bot is bot else \
+                f"{parsed_url.scheme}://{parsed_url.netloc}{settings_for(current_bot).webhook_path}"
+            # Request exactly the update types our handlers use (includes chat_member when the replica is on)
+            await current_bot.set_webhook(url=bot_webhook_url, allowed_updates=dp.resolve_used_update_types())
+            print(f"Webhook set to {bot_webhook_url}")
     else:
         print("ERROR: WEBHOOK_URL environment variable not set")
 
-async def on_shutdown(app):
-    await bot.delete_webhook()
-    await bot.session.close()
+async def on_shutdown(app=None):
+    """Shutdown hook shared by webhook and polling mode."""
+    if _activity_persist_task is not None:
+        _activity_persist_task.cancel()
+    if loop_watchdog is not None:
+        loop_watchdog.stop()
+    stop_catalog_version_watch()
+    await asyncio.to_thread(stop_recording_writer)
+    await persist_activity_sketches()
+    for current_bot in bots:
+        if BOT_MODE != "polling":
+            await current_bot.delete_webhook()
+        await current_bot.session.close()
+
+# --- WEBHOOK TRAFFIC RECORDER ---
+
+_recording_started = time.monotonic()
+_recorded_paths = {settings.webhook_path for settings in bot_settings.values()}
+# Lines waiting for the writer thread, so webhook requests never wait for the disk
+_recording_queue = queue.SimpleQueue()
+_recording_writer = None
+
+
+def _write_recorded_updates():
+    """Writer thread: appends queued lines through one open file handle until it gets None."""
+    with open(WEBHOOK_RECORD_FILE, "a", encoding="utf-8") as record_file:
+        while True:
+            line = _recording_queue.get()
+            if line is None:
+                return
+            record_file.write(line)
+            if _recording_queue.empty(): # Flush once per burst rather than once per update
+                record_file.flush()
+
+
+def start_recording_writer():
+    global _recording_writer
+    _recording_writer = threading.Thread(target=_write_recorded_updates, name="webhook-recorder", daemon=True)
+    _recording_writer.start()
+
+
+def stop_recording_writer():
+    """Writes out the queued lines and closes the recording file."""
+    global _recording_writer
+    if _recording_writer is not None:
+        _recording_queue.put(None)
+        _recording_writer.join()
+        _recording_writer = None
+
+
+@web.middleware
+async def record_webhook_updates(request, handler):
+    """
+    aiohttp middleware that queues every update posted to a bot's webhook path for WEBHOOK_RECORD_FILE
+    as {"t": seconds since start, "update": anonymized payload}, one JSON object per line.
+    Updates of additional bots also carry their "path", so load_replay.py sends them to the same bot.
+    """
+    if request.method == "POST" and request.path in _recorded_paths:
+        try:
+            payload = json_loads(await request.read()) # The body is cached, so the handler can still read it
+            record = {"t": round(time.monotonic() - _recording_started, 4), "update": anonymize_update(payload)}
+            if request.path != WEBHOOK_PATH:
+                record["path"] = request.path
+            _recording_queue.put(json_dumps(record) + "\n")
+        except Exception as e:
+            print(f"Error recording webhook update: {e}")
+    return await handler(request)
+
 
 # Create Aiohttp app
-app = web.Application()
+app = web.Application(middlewares=[record_webhook_updates] if WEBHOOK_RECORD_FILE else [])
+if WEBHOOK_RECORD_FILE:
+    start_recording_writer()
+for served_bot in bots:
+    SimpleRequestHandler(dispatcher=dp, bot=served_bot, handle_in_background=WEBHOOK_HANDLE_IN_BACKGROUND).register(
+        app, path=settings_for(served_bot).webhook_path)
 setup_application(app, dp, bot=bot)
 
 app.on_startup.append(on_startup)
 app.on_shutdown.append(on_shutdown)
 
-@app.get("/")
 async def healthcheck(request):
     return web.Response(text="Bot is running!")
 
+app.router.add_get("/", healthcheck)
+
+
+async def profile_endpoint(request):
+    """HTTP equivalent of /profile, protected by PROFILE_HTTP_TOKEN."""
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {PROFILE_HTTP_TOKEN}".encode()):
+        raise web.HTTPUnauthorized()
+    seconds = _parse_profile_seconds(request.query.get("seconds", "10"))
+    if seconds is None:
+        raise web.HTTPBadRequest(text=f"seconds must be between 1 and {PROFILE_MAX_SECONDS:g}")
+    try:
+        report = await asyncio.to_thread(sampling_profiler.profile, seconds)
+    except RuntimeError as e:
+        raise web.HTTPConflict(text=str(e))
+    return web.Response(text=report)
+
+
+if PROFILE_HTTP_TOKEN:
+    app.router.add_get("/debug/profile", profile_endpoint)
+
 if __name__ == "__main__":
-    web.run_app(app, port=int(os.environ.get("PORT", 5000)))
+    if BOT_MODE == "polling":
+        asyncio.run(main())
+    else:
+        web.run_app(app, port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,246 @@
+# movie_catalog.py
+"""
+Memory-compact, in-process representation of the movie catalog.
+
+Instead of a dict of full Firestore dicts per movie, fields are kept in parallel columns
+(one list per field, timestamps in a float array) with a code -> row index. Codes and names
+are interned, and rows are handed out as small __slots__ records only when asked for.
+Name search runs over a single string of all normalized names (built lazily), so searching
+costs one C-level scan and no per-movie string objects.
+Codes merged into another movie (documents with 'alias_of') are kept apart from the rows:
+get() resolves them to that movie, while listings and search leave them out.
+"""
+import re
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_right
+
+# Separates names in the search string; cannot appear in a Telegram text query
+_SEARCH_SEPARATOR = '\x00'
+
+# Uzbek (and Russian) Cyrillic to Uzbek Latin, so both scripts of a title match each other
+_CYRILLIC_TO_LATIN = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh',
+    'ъ': "'", 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'ў': "o'", 'қ': 'q', 'ғ': "g'", 'ҳ': 'h',
+})
+# The many apostrophe look-alikes used in Uzbek Latin (o‘zbek, oʻzbek, o`zbek) become "'"
+_APOSTROPHES = str.maketrans({character: "'" for character in "ʻʼ‘’`´ʹ′"})
+_TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+MAX_NAME_TOKENS = 30
+
+
+def normalize_movie_name(text: str) -> str:
+    """Lowercases a name or query, unifies apostrophes, transliterates Cyrillic and collapses spaces."""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = text.translate(_APOSTROPHES).translate(_CYRILLIC_TO_LATIN)
+    return ' '.join(text.split())
+
+
+def name_tokens(normalized_name: str):
+    """Returns the distinct words of a normalized name, in order (at most MAX_NAME_TOKENS)."""
+    return list(dict.fromkeys(_TOKEN_PATTERN.findall(normalized_name)))[:MAX_NAME_TOKENS]
+
+
+def _timestamp_seconds(value) -> float:
+    """Converts a Firestore timestamp (datetime) to epoch seconds; 0.0 when missing."""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return value.timestamp()
+    except AttributeError:
+        return 0.0
+
+
+def code_sort_key(code: str):
+    """Numerical codes first (as integers), then the others alphabetically."""
+    return (int(code) if code.isdigit() else float('inf'), code)
+
+
+class MovieRecord:
+    """A read-only view of one catalog row."""
+    __slots__ = ('code', 'name', 'file_id', 'timestamp', 'file_unique_id')
+
+    def __init__(self, code: str, name: str, file_id: str, timestamp: float, file_unique_id: str = None):
+        self.code = code
+        self.name = name
+        self.file_id = file_id
+        self.timestamp = timestamp
+        self.file_unique_id = file_unique_id
+
+    def to_dict(self) -> dict:
+        """Returns the movie in the same shape as get_movie_data()."""
+        data = {'file_id': self.file_id, 'name': self.name}
+        if self.file_unique_id is not None:
+            data['file_unique_id'] = self.file_unique_id
+        return data
+
+
+class MovieCatalog:
+    """
+    Column-oriented store of all movies, keyed by code.
+    Not thread-safe for concurrent writers; readers should not hold rows across awaits
+    if the catalog may be modified meanwhile.
+    """
+    __slots__ = ('_codes', '_names', '_file_ids', '_timestamps', '_file_unique_ids', '_index', '_file_index',
+                 '_aliases', '_search_text', '_search_offsets')
+
+    def __init__(self):
+        self._codes = []
+        self._names = []
+        self._file_ids = []
+        self._timestamps = array('d')
+        self._file_unique_ids = [] # None for movies saved before file_unique_id was stored
+        self._index = {} # code -> row number
+        self._file_index = {} # file_unique_id -> code of one movie stored from that file
+        self._aliases = {} # merged code -> (code of the movie it now opens, timestamp)
+        self._search_text = None # All lowercased names joined by _SEARCH_SEPARATOR; None when stale
+        self._search_offsets = None # Start offset of each row's name in _search_text
+
+    @classmethod
+    def from_documents(cls, documents):
+        """Builds a catalog from (code, movie dict) pairs, e.g. dict.items() or a Firestore stream."""
+        catalog = cls()
+        for code, data in documents:
+            catalog.upsert(code, data)
+        return catalog
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._index or code in self._aliases
+
+    def upsert(self, code: str, data: dict):
+        """Adds a movie (or a merged code's alias) or replaces the existing entry with the same code."""
+        if not isinstance(data, dict):
+            return
+        if data.get('alias_of'):
+            self.remove(code)
+            self._aliases[sys.intern(code)] = (str(data['alias_of']), _timestamp_seconds(data.get('timestamp')))
+            return
+        self._aliases.pop(code, None)
+        name = sys.intern(str(data.get('name', 'Nomsiz Film')))
+        file_id = data.get('file_id')
+        timestamp = _timestamp_seconds(data.get('timestamp'))
+        file_unique_id = data.get('file_unique_id')
+        self._search_text = None
+        row = self._index.get(code)
+        if row is None:
+            code = sys.intern(code)
+            self._index[code] = len(self._codes)
+            self._codes.append(code)
+            self._names.append(name)
+            self._file_ids.append(file_id)
+            self._timestamps.append(timestamp)
+            self._file_unique_ids.append(file_unique_id)
+        else:
+            code = self._codes[row]
+            previous_file = self._file_unique_ids[row]
+            self._names[row] = name
+            self._file_ids[row] = file_id
+            self._timestamps[row] = timestamp
+            self._file_unique_ids[row] = file_unique_id
+            if previous_file != file_unique_id:
+                self._unindex_file(previous_file, code)
+        if file_unique_id is not None:
+            self._file_index.setdefault(file_unique_id, code)
+
+    def remove(self, code: str) -> bool:
+        """Removes a movie (or alias) by code in O(1) by moving the last row into its place."""
+        if self._aliases.pop(code, None) is not None:
+            return True
+        row = self._index.pop(code, None)
+        if row is None:
+            return False
+        self._search_text = None
+        file_unique_id = self._file_unique_ids[row]
+        last = len(self._codes) - 1
+        if row != last:
+            moved_code = self._codes[last]
+            self._codes[row] = moved_code
+            self._names[row] = self._names[last]
+            self._file_ids[row] = self._file_ids[last]
+            self._timestamps[row] = self._timestamps[last]
+            self._file_unique_ids[row] = self._file_unique_ids[last]
+            self._index[moved_code] = row
+        self._codes.pop()
+        self._names.pop()
+        self._file_ids.pop()
+        self._timestamps.pop()
+        self._file_unique_ids.pop()
+        self._unindex_file(file_unique_id, code)
+        return True
+
+    def _unindex_file(self, file_unique_id, code: str):
+        """Drops code from the file index, pointing it at another copy of the same file if one is left."""
+        if file_unique_id is None or self._file_index.get(file_unique_id) != code:
+            return
+        try:
+            self._file_index[file_unique_id] = self._codes[self._file_unique_ids.index(file_unique_id)]
+        except ValueError:
+            del self._file_index[file_unique_id]
+
+    def _record(self, row: int) -> MovieRecord:
+        return MovieRecord(self._codes[row], self._names[row], self._file_ids[row], self._timestamps[row],
+                           self._file_unique_ids[row])
+
+    def get(self, code: str):
+        """Returns the MovieRecord for a code (for a merged code, the movie it was merged into), or None."""
+        alias = self._aliases.get(code)
+        row = self._index.get(alias[0] if alias is not None else code)
+        return None if row is None else self._record(row)
+
+    def timestamp(self, code: str):
+        """Returns when the movie or alias stored under exactly this code was written, or None."""
+        alias = self._aliases.get(code)
+        if alias is not None:
+            return alias[1]
+        row = self._index.get(code)
+        return None if row is None else self._timestamps[row]
+
+    def code_for_file(self, file_unique_id: str):
+        """Returns the code of a movie stored from the file with this file_unique_id, or None. O(1)."""
+        return self._file_index.get(file_unique_id)
+
+    def codes(self):
+        """Returns a list of all codes in use (in storage order), merged codes last."""
+        return self._codes + list(self._aliases)
+
+    def sorted_names(self):
+        """Returns (code, name) pairs sorted by code, numerical codes first."""
+        return sorted(zip(self._codes, self._names), key=lambda item: code_sort_key(item[0]))
+
+    def _build_search_text(self):
+        offsets = array('L')
+        position = 0
+        lowered = []
+        for name in self._names:
+            name = normalize_movie_name(name) # Normalizing can change the length, so go name by name
+            offsets.append(position)
+            position += len(name) + 1
+            lowered.append(name)
+        self._search_text = _SEARCH_SEPARATOR.join(lowered)
+        self._search_offsets = offsets
+
+    def search(self, query: str):
+        """Returns MovieRecords whose normalized name contains the query (pass it through normalize_movie_name())."""
+        if not query or _SEARCH_SEPARATOR in query:
+            return []
+        if self._search_text is None:
+            self._build_search_text()
+        text, offsets = self._search_text, self._search_offsets
+        rows = []
+        position = text.find(query)
+        while position >= 0:
+            row = bisect_right(offsets, position) - 1
+            rows.append(row)
+            # Continue after this name so a row matching twice is reported once
+            next_start = offsets[row + 1] if row + 1 < len(offsets) else len(text)
+            position = text.find(query, next_start)
+        return [self._record(row) for row in rows]
@@ -0,0 +1,50 @@
+# query_cache.py
+"""
+Size- and TTL-bounded LRU cache for the final results of movie searches.
+
+Callers put the catalog revision into the key, so a save, delete or sync makes every older
+entry unreachable at once; those entries then age out through the LRU order. Used from the
+event loop only, so there is no locking.
+"""
+import time
+from collections import Counter, OrderedDict
+
+
+class QueryResultCache:
+    def __init__(self, max_size: int = 2000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (monotonic expiry time, result)
+        self.stats = Counter() # 'hits', 'misses', 'expired'
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached result for key, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return result
+
+    def put(self, key, result):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
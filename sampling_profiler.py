@@ -0,0 +1,97 @@
+# sampling_profiler.py
+"""
+Low-overhead wall-clock sampling profiler for the running bot process.
+
+While a profile runs, the stacks of all threads are sampled every `interval` seconds with
+sys._current_frames(). Nothing is installed into the profiled code (unlike cProfile), so the
+cost is independent of how many calls the bot makes and the profile can be taken on live
+traffic. Samples whose innermost frame is an idle wait (the event loop's select(), an idle
+worker thread) are counted separately, so the report shows where busy time goes.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# (file name, function) pairs where a thread is waiting for work rather than doing any
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"), # concurrent.futures worker blocked on its work queue
+}
+
+
+def _function_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005, top: int = 40):
+        self.interval = interval
+        self.top = top
+        self._lock = threading.Lock() # One profile at a time
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float) -> str:
+        """
+        Samples every thread for `seconds` and returns a plain-text report.
+        Blocks the calling thread; from async code run it with asyncio.to_thread().
+        Raises RuntimeError if another profile is already running.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(seconds)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float) -> str:
+        own_thread = threading.get_ident()
+        cumulative = Counter() # function -> busy samples with the function anywhere on the stack
+        own = Counter() # function -> busy samples with the function innermost
+        thread_samples = Counter() # thread name -> busy samples
+        busy = idle = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                    idle += 1
+                    continue
+                busy += 1
+                thread_samples[names.get(thread_id, str(thread_id))] += 1
+                own[_function_label(code)] += 1
+                seen = set() # Count recursive functions once per sample
+                while frame is not None:
+                    label = _function_label(frame.f_code)
+                    if label not in seen:
+                        seen.add(label)
+                        cumulative[label] += 1
+                    frame = frame.f_back
+            time.sleep(self.interval)
+        elapsed = time.perf_counter() - started
+        return self._format(elapsed, busy, idle, cumulative, own, thread_samples)
+
+    def _format(self, elapsed, busy, idle, cumulative, own, thread_samples) -> str:
+        lines = [
+            f"Sampling profile: {elapsed:.1f} s, one sample every {self.interval * 1000:.0f} ms per thread",
+            f"Busy samples: {busy}, idle samples: {idle}",
+            "",
+            "Busy samples per thread:",
+        ]
+        lines += [f"  {count:>8}  {name}" for name, count in thread_samples.most_common()]
+        lines += ["", f"Top {self.top} functions by cumulative (inclusive) busy samples:",
+                  f"  {'cum':>8} {'cum%':>6} {'self':>8} {'self%':>6}  function"]
+        for label, count in cumulative.most_common(self.top):
+            lines.append(f"  {count:>8} {count / busy * 100 if busy else 0:>5.1f}% "
+                         f"{own[label]:>8} {own[label] / busy * 100 if busy else 0:>5.1f}%  {label}")
+        return "\n".join(lines) + "\n"
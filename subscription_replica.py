@@ -0,0 +1,58 @@
+# subscription_replica.py
+"""
+In-memory replica of which users are subscribed to a bot's mandatory channels.
+
+Per (bot_id, user_id) it keeps two small ints, known_bits and member_bits, where bit i refers
+to the bot's i-th mandatory channel, plus the time the entry is due for a reload from Firestore.
+At most `max_size` users are kept; the least recently used are evicted first and are simply
+reloaded from Firestore the next time they are checked. Used from the event loop only,
+so there is no locking.
+"""
+import time
+from collections import OrderedDict
+
+
+class MembershipReplica:
+    def __init__(self, ttl: float = 3600.0, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._entries = OrderedDict() # (bot_id, user_id) -> (known_bits, member_bits, reload_at)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_loaded(self, key) -> bool:
+        """True if the key's entry exists and is not yet due for a reload."""
+        entry = self._entries.get(key)
+        return entry is not None and entry[2] > time.monotonic()
+
+    def reset(self, key):
+        """Forgets what is known about the key's channels and starts a new TTL period."""
+        self._store(key, (0, 0, time.monotonic() + self.ttl))
+
+    def set_membership(self, key, channel_index: int, is_member: bool):
+        """Records whether the user is a member of one channel."""
+        known_bits, member_bits, reload_at = self._entries.get(key, (0, 0, time.monotonic() + self.ttl))
+        bit = 1 << channel_index
+        known_bits |= bit
+        member_bits = member_bits | bit if is_member else member_bits & ~bit
+        self._store(key, (known_bits, member_bits, reload_at))
+
+    def channels_to_verify(self, key, channel_count: int):
+        """
+        Returns the indexes of the channels that must be checked with Telegram: every channel
+        the replica does not know the user is a member of. A "not a member" entry is never
+        trusted on its own, since a missed chat_member update must not lock out a user.
+        """
+        entry = self._entries.get(key)
+        confirmed = 0
+        if entry is not None:
+            self._entries.move_to_end(key)
+            confirmed = entry[0] & entry[1]
+        return [index for index in range(channel_count) if not confirmed & (1 << index)]
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,66 @@
+# tests/conftest.py
+import os
+import sys
+from collections import Counter, OrderedDict
+
+import pytest
+
+# The bot's modules live in the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """Stand-in for time.monotonic that only moves when a test advances `now`."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def firestore_db(monkeypatch):
+    """
+    Points firebase_utils at an empty in-memory fake Firestore and resets its module-level
+    caches (catalog, sync watermarks, code filter, negative cache, circuit breaker) for one test.
+    """
+    import firebase_utils
+    from fake_firestore import FakeFirestoreClient
+
+    client = FakeFirestoreClient(server_timestamp=firebase_utils.firestore.SERVER_TIMESTAMP)
+    monkeypatch.setattr(firebase_utils, 'db', client)
+    for name, value in {
+        '_catalog': None, '_catalog_loaded_at': 0.0, '_catalog_full_loaded_at': 0.0,
+        '_catalog_watermark': None, '_tombstone_watermark': None,
+        '_code_filter': None, '_code_filter_built_at': 0.0,
+    }.items():
+        monkeypatch.setattr(firebase_utils, name, value)
+    monkeypatch.setattr(firebase_utils, '_negative_cache', OrderedDict())
+    monkeypatch.setattr(firebase_utils, 'movie_lookup_stats', Counter())
+    monkeypatch.setattr(firebase_utils, 'firestore_breaker', firebase_utils.CircuitBreaker(5, 30))
+    yield client
+    # Let a refresh started in the background by a lookup finish before the state above is restored
+    with firebase_utils._background_refresh_lock:
+        pass
+
+
+@pytest.fixture
+def keys_only_scans(monkeypatch):
+    """Records every select([]) (document IDs only) query made against the fake Firestore."""
+    from fake_firestore import FakeQuery
+
+    scans = []
+    original_select = FakeQuery.select
+
+    def recording_select(self, field_paths):
+        if not list(field_paths):
+            scans.append(self._collection_name)
+        return original_select(self, field_paths)
+
+    monkeypatch.setattr(FakeQuery, 'select', recording_select)
+    return scans
@@ -0,0 +1,118 @@
+# tests/test_activity_stats.py
+import datetime
+import threading
+
+import pytest
+
+import firebase_utils
+from activity_stats import LIFETIME_SKETCH_ID, ActivityTracker, HyperLogLog, day_sketch_id
+
+DAY = datetime.date(2026, 3, 1)
+
+
+def _sketch(users, precision=14):
+    sketch = HyperLogLog(precision)
+    for user in users:
+        sketch.add(user)
+    return sketch
+
+
+@pytest.mark.parametrize('count', [10, 1000, 100000])
+def test_estimate_stays_within_the_error_bound(count):
+    # 1.04 / sqrt(2^14) is 0.8%; allow four standard errors
+    assert abs(_sketch(range(count)).count() - count) <= max(1, 0.032 * count)
+
+
+def test_repeated_users_are_counted_once():
+    assert _sketch([7, 7, 7, "7"]).count() == 1
+
+
+def test_merge_is_idempotent_and_commutative():
+    first, second = _sketch(range(0, 6000)), _sketch(range(4000, 10000))
+
+    left = first.copy()
+    left.merge(second)
+    right = second.copy()
+    right.merge(first)
+    twice = left.copy()
+    twice.merge(second)
+    twice.merge(first)
+
+    assert left.registers == right.registers == twice.registers
+    assert abs(left.count() - 10000) <= 320
+
+
+def test_sketches_of_different_precision_do_not_merge():
+    with pytest.raises(ValueError):
+        HyperLogLog(14).merge(HyperLogLog(12))
+
+
+def test_days_past_retention_roll_into_the_lifetime_sketch():
+    tracker = ActivityTracker(precision=10, retention_days=3)
+    tracker.record(1, DAY)
+    tracker.record(2, DAY + datetime.timedelta(days=1))
+
+    tracker.record(1, DAY + datetime.timedelta(days=3)) # DAY falls out of the window
+
+    assert DAY not in tracker.daily
+    assert tracker.lifetime.count() == 1
+    summary = tracker.summary(DAY + datetime.timedelta(days=3))
+    assert summary['dau'] == 1 and summary['returning_today'] == 1 and summary['new_today'] == 0
+    assert summary['wau'] == 2 # The lifetime sketch is not part of the weekly window
+
+
+def test_summary_splits_new_and_returning_users():
+    tracker = ActivityTracker(precision=14, retention_days=30)
+    for user in range(50):
+        tracker.record(user, DAY - datetime.timedelta(days=1))
+    for user in range(40, 60):
+        tracker.record(user, DAY)
+
+    summary = tracker.summary(DAY)
+
+    assert summary['dau'] == 20
+    assert summary['new_today'] == 10 and summary['returning_today'] == 10
+    assert summary['mau'] == 60
+
+
+def test_persisted_sketches_merge_into_the_right_day():
+    tracker = ActivityTracker(precision=10, retention_days=3)
+    registers = bytes(_sketch(range(5), precision=10).registers)
+
+    tracker.merge_sketch(day_sketch_id(DAY), registers, today=DAY)
+    tracker.merge_sketch(day_sketch_id(DAY - datetime.timedelta(days=3)), registers, today=DAY)
+    tracker.merge_sketch(day_sketch_id(DAY), bytes(16), today=DAY) # Another precision: ignored
+
+    assert tracker.daily[DAY].count() == 5
+    assert tracker.lifetime.count() == 5
+
+
+def test_take_dirty_returns_changed_days_once():
+    tracker = ActivityTracker(precision=10, retention_days=3)
+    tracker.record(1, DAY)
+
+    dirty = tracker.take_dirty(today=DAY)
+
+    assert set(dirty) == {day_sketch_id(DAY), LIFETIME_SKETCH_ID}
+    assert tracker.take_dirty(today=DAY) == {}
+    tracker.mark_dirty(dirty)
+    assert set(tracker.take_dirty(today=DAY)) == set(dirty)
+
+
+def test_concurrent_merges_into_firestore_keep_every_register(firestore_db):
+    firestore_db._latency = 0.005 # Widens the window between a merge's read and its write
+    sketches = [_sketch(range(start, start + 300), precision=10) for start in range(0, 2400, 300)]
+
+    workers = [threading.Thread(target=firebase_utils.merge_activity_sketch,
+                                args=("day-2026-03-01", bytes(sketch.registers)))
+               for sketch in sketches]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    union = HyperLogLog(10)
+    for sketch in sketches:
+        union.merge(sketch)
+    stored = firebase_utils.get_activity_sketches(["day-2026-03-01"])["day-2026-03-01"]
+    assert stored == bytes(union.registers)
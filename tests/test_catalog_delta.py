@@ -0,0 +1,147 @@
+# tests/test_catalog_delta.py
+import threading
+
+import pytest
+
+import firebase_utils
+from firebase_admin import firestore
+
+
+def _save_as_other_worker(db, code, name):
+    db.collection('movies').document(code).set(
+        {'file_id': f"file-{code}", 'name': name, 'timestamp': firestore.SERVER_TIMESTAMP})
+
+
+def _delete_as_other_worker(db, code):
+    db.collection('movies').document(code).delete()
+    db.collection('movie_tombstones').document(code).set({'deleted_at': firestore.SERVER_TIMESTAMP})
+
+
+def _expire_catalog(monkeypatch):
+    monkeypatch.setattr(firebase_utils, '_catalog_loaded_at', 0.0)
+
+
+def _wait_for_background_refresh():
+    with firebase_utils._background_refresh_lock:
+        pass
+
+
+def _load_catalog(firestore_db):
+    _save_as_other_worker(firestore_db, "1", "Avatar")
+    _save_as_other_worker(firestore_db, "2", "Titanik")
+    return firebase_utils.get_movie_catalog()
+
+
+def test_delta_sync_picks_up_movies_saved_elsewhere(firestore_db, monkeypatch):
+    _load_catalog(firestore_db)
+    full_loaded_at = firebase_utils._catalog_full_loaded_at
+    revision = firebase_utils.catalog_revision()
+
+    _save_as_other_worker(firestore_db, "3", "Shrek")
+    _expire_catalog(monkeypatch)
+    catalog = firebase_utils.get_movie_catalog()
+
+    assert catalog.get("3").name == "Shrek"
+    assert firebase_utils._catalog_full_loaded_at == full_loaded_at # Delta, not a full reload
+    assert firebase_utils.catalog_revision() > revision
+    assert "3" in firebase_utils._code_filter
+
+
+def test_delta_sync_without_changes_keeps_the_revision(firestore_db, monkeypatch):
+    _load_catalog(firestore_db)
+    revision = firebase_utils.catalog_revision()
+
+    _expire_catalog(monkeypatch)
+    firebase_utils.get_movie_catalog()
+
+    assert firebase_utils.catalog_revision() == revision
+
+
+def test_delta_sync_applies_tombstones(firestore_db, monkeypatch):
+    _load_catalog(firestore_db)
+
+    _delete_as_other_worker(firestore_db, "1")
+    _expire_catalog(monkeypatch)
+    catalog = firebase_utils.get_movie_catalog()
+
+    assert "1" not in catalog and "2" in catalog
+    assert firebase_utils.get_movie_data("1") is None
+    assert firebase_utils.movie_lookup_stats['negative_cache'] == 1
+
+
+def test_movie_added_again_after_its_tombstone_is_kept(firestore_db, monkeypatch):
+    _load_catalog(firestore_db)
+
+    _delete_as_other_worker(firestore_db, "1")
+    _save_as_other_worker(firestore_db, "1", "Avatar 2")
+    _expire_catalog(monkeypatch)
+    catalog = firebase_utils.get_movie_catalog()
+
+    assert catalog.get("1").name == "Avatar 2"
+
+
+def test_delta_sync_keeps_the_code_filter_fresh_without_a_scan(firestore_db, monkeypatch, keys_only_scans):
+    _load_catalog(firestore_db)
+    _save_as_other_worker(firestore_db, "3", "Shrek")
+    # Both the catalog and the code filter are due for a refresh
+    _expire_catalog(monkeypatch)
+    monkeypatch.setattr(firebase_utils, '_code_filter_built_at', 0.0)
+
+    assert firebase_utils.get_movie_data("999") is None # Answered by the current filter
+    _wait_for_background_refresh()
+    assert firebase_utils.get_movie_data("3")['name'] == "Shrek"
+
+    assert keys_only_scans == []
+    assert firebase_utils.movie_lookup_stats['filter'] == 1
+
+
+def test_lookup_does_not_wait_for_a_catalog_refresh(firestore_db, monkeypatch):
+    _load_catalog(firestore_db)
+    _expire_catalog(monkeypatch)
+    monkeypatch.setattr(firebase_utils, '_code_filter_built_at', 0.0)
+    results = []
+
+    with firebase_utils._catalog_lock: # As if another thread were in the middle of a slow refresh
+        lookup = threading.Thread(target=lambda: results.append(firebase_utils.get_movie_data("999")))
+        lookup.start()
+        lookup.join(timeout=2)
+        assert not lookup.is_alive()
+    _wait_for_background_refresh()
+
+    assert results == [None]
+    assert firebase_utils.movie_lookup_stats == {'filter': 1}
+
+
+def test_code_filter_is_rebuilt_by_a_scan_without_a_cached_catalog(firestore_db, keys_only_scans):
+    _save_as_other_worker(firestore_db, "1", "Avatar")
+
+    assert firebase_utils.get_movie_data("999") is None
+
+    assert keys_only_scans == ['movies']
+
+
+@pytest.mark.parametrize('full_reload', [False, True])
+def test_save_during_a_catalog_sync_is_not_lost(firestore_db, monkeypatch, full_reload):
+    _load_catalog(firestore_db)
+    _save_as_other_worker(firestore_db, "3", "Shrek")
+    _expire_catalog(monkeypatch)
+    if full_reload:
+        monkeypatch.setattr(firebase_utils, '_catalog_full_loaded_at', 0.0)
+    saves = []
+    original_timestamp_of = firebase_utils._timestamp_of
+
+    def save_while_syncing(data, field):
+        # The first document the sync reads: run an admin's save in another thread meanwhile
+        if not saves:
+            saves.append(threading.Thread(target=firebase_utils.save_movie_data, args=("4", "file-4", "Titanik 2")))
+            saves[0].start()
+            saves[0].join(timeout=0.2)
+        return original_timestamp_of(data, field)
+
+    monkeypatch.setattr(firebase_utils, '_timestamp_of', save_while_syncing)
+    firebase_utils.get_movie_catalog()
+    saves[0].join()
+
+    catalog = firebase_utils.get_movie_catalog()
+    assert catalog.get("3").name == "Shrek"
+    assert catalog.get("4").name == "Titanik 2"
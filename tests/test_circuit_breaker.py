@@ -0,0 +1,128 @@
+# tests/test_circuit_breaker.py
+import asyncio
+import time
+
+import pytest
+
+import firebase_utils
+from firebase_utils import CircuitBreaker, FirestoreUnavailableError
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    monkeypatch.setattr(firebase_utils.time, 'monotonic', clock)
+    return CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+
+def _fail_firestore_calls(monkeypatch, firestore_db):
+    """Makes every Firestore call fail and returns a list recording the attempted calls."""
+    attempts = []
+
+    def failing_collection(name):
+        attempts.append(name)
+        raise ConnectionError("Firestore unreachable")
+
+    monkeypatch.setattr(firestore_db, 'collection', failing_collection)
+    return attempts
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.stats == {'failures': 3, 'opened': 1, 'rejected': 1}
+
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == 'closed'
+
+
+def test_half_open_breaker_lets_one_trial_call_through(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.now += 29
+    assert breaker.state == 'open' and not breaker.allow()
+    clock.now += 1
+    assert breaker.state == 'half-open'
+    assert breaker.allow() # The trial call
+    assert not breaker.allow() # Everyone else waits for its outcome
+
+    breaker.record_success()
+
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_failed_trial_call_opens_the_breaker_again(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == 'open' and not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_open_breaker_skips_firestore_and_serves_the_stale_catalog(firestore_db, monkeypatch, clock):
+    monkeypatch.setattr(firebase_utils.time, 'monotonic', clock)
+    monkeypatch.setattr(firebase_utils, 'firestore_breaker', CircuitBreaker(2, 30))
+    firebase_utils.save_movie_data("1", "file-1", "Avatar")
+    firebase_utils.get_movie_catalog()
+    attempts = _fail_firestore_calls(monkeypatch, firestore_db)
+
+    clock.now += firebase_utils.CATALOG_CACHE_TTL_SECONDS + 1
+    assert firebase_utils.get_movie_catalog().get("1").name == "Avatar"
+    assert firebase_utils.get_movie_data("1")['name'] == "Avatar"
+    assert firebase_utils.firestore_breaker.state == 'open'
+    assert firebase_utils.catalog_is_stale()
+
+    attempts.clear()
+    assert firebase_utils.get_movie_data("1")['name'] == "Avatar"
+    assert firebase_utils.get_movie_catalog().get("1").name == "Avatar"
+    assert attempts == [] # Answered without calling Firestore
+    assert firebase_utils.movie_lookup_stats['stale_catalog'] == 2
+    assert firebase_utils.catalog_stats['stale'] >= 2
+
+
+def test_successful_trial_call_resumes_firestore(firestore_db, monkeypatch, clock):
+    monkeypatch.setattr(firebase_utils.time, 'monotonic', clock)
+    monkeypatch.setattr(firebase_utils, 'firestore_breaker', CircuitBreaker(1, 30))
+    firebase_utils.save_movie_data("1", "file-1", "Avatar")
+    with monkeypatch.context() as patch:
+        _fail_firestore_calls(patch, firestore_db)
+        with pytest.raises(ConnectionError):
+            firebase_utils.get_movie_data("1", use_filters=False)
+    assert firebase_utils.firestore_breaker.state == 'open'
+
+    clock.now += 30
+
+    assert firebase_utils.get_movie_data("1", use_filters=False)['name'] == "Avatar"
+    assert firebase_utils.firestore_breaker.state == 'closed'
+
+
+def test_waiter_timeout_does_not_count_as_a_failure(firestore_db):
+    def slow_call():
+        time.sleep(0.2)
+        return "done"
+
+    async def wait_briefly():
+        with pytest.raises(FirestoreUnavailableError):
+            await firebase_utils._single_flight(('slow',), slow_call, deadline=0.01)
+
+    asyncio.run(wait_briefly())
+
+    assert firebase_utils.firestore_breaker.stats['failures'] == 0
+    assert firebase_utils.firestore_breaker.state == 'closed'
@@ -0,0 +1,54 @@
+# tests/test_code_filter.py
+import random
+import string
+
+import firebase_utils
+from firebase_utils import BloomFilter
+
+
+def _random_codes(count, seed):
+    rng = random.Random(seed)
+    return {''.join(rng.choices(string.ascii_lowercase + string.digits, k=12)) for _ in range(count)}
+
+
+def test_bloom_filter_has_no_false_negatives():
+    codes = _random_codes(5000, seed=1)
+    bloom = BloomFilter(5000, 0.01)
+    for code in codes:
+        bloom.add(code)
+    assert all(code in bloom for code in codes)
+
+
+def test_bloom_filter_false_positive_rate_stays_near_target():
+    bloom = BloomFilter(10000, 0.01)
+    for code in _random_codes(10000, seed=2):
+        bloom.add(code)
+    others = _random_codes(20000, seed=3)
+    false_positives = sum(1 for code in others if code in bloom)
+    assert false_positives / len(others) < 0.02
+
+
+def test_unknown_code_is_answered_by_the_filter(firestore_db):
+    firebase_utils.save_movie_data("1", "file-1", "Avatar")
+
+    assert firebase_utils.get_movie_data("999") is None
+    assert firebase_utils.movie_lookup_stats == {'filter': 1}
+
+
+def test_saved_code_passes_the_filter(firestore_db):
+    firebase_utils.save_movie_data("1", "file-1", "Avatar")
+    assert firebase_utils.get_movie_data("2") is None # Builds the filter without code "2"
+
+    firebase_utils.save_movie_data("2", "file-2", "Titanik")
+
+    assert firebase_utils.get_movie_data("2")['name'] == "Titanik"
+
+
+def test_deleted_code_is_answered_by_the_negative_cache(firestore_db):
+    firebase_utils.save_movie_data("1", "file-1", "Avatar")
+    assert firebase_utils.get_movie_data("1")['name'] == "Avatar"
+
+    firebase_utils.delete_movie_code("1")
+
+    assert firebase_utils.get_movie_data("1") is None
+    assert firebase_utils.movie_lookup_stats['negative_cache'] == 1
@@ -0,0 +1,92 @@
+# tests/test_duplicate_movies.py
+import firebase_utils
+from firebase_admin import firestore
+
+
+def _save_duplicates():
+    firebase_utils.save_movie_data("2", "file-a1", "Avatar", file_unique_id="unique-a")
+    firebase_utils.save_movie_data("10", "file-a2", "Avatar (qayta)", file_unique_id="unique-a")
+    firebase_utils.save_movie_data("3", "file-t", "Titanik", file_unique_id="unique-t")
+
+
+def _save_legacy_duplicates(db):
+    # Movies saved before file_unique_id was stored can only be matched by an identical file_id
+    for code, name in (("7", "Shrek"), ("5", "Shrek 1")):
+        db.collection('movies').document(code).set(
+            {'file_id': "file-s", 'name': name, 'timestamp': firestore.SERVER_TIMESTAMP})
+
+
+def test_groups_movies_stored_from_the_same_file(firestore_db):
+    _save_duplicates()
+    _save_legacy_duplicates(firestore_db)
+
+    groups = firebase_utils.find_duplicate_movies(page_size=2)
+
+    assert groups == [
+        {'file_unique_id': "unique-a", 'movies': [("2", "Avatar"), ("10", "Avatar (qayta)")]},
+        {'file_unique_id': None, 'movies': [("5", "Shrek 1"), ("7", "Shrek")]},
+    ]
+
+
+def test_merged_codes_keep_opening_the_kept_movie(firestore_db):
+    _save_duplicates()
+    catalog = firebase_utils.get_movie_catalog()
+
+    merged = firebase_utils.merge_duplicate_movies(firebase_utils.find_duplicate_movies())
+
+    assert merged == 1
+    assert firestore_db.collection('movies').document("10").get().to_dict()['alias_of'] == "2"
+    assert firebase_utils.get_movie_data("10")['file_id'] == "file-a1"
+    assert firebase_utils.get_movie_data("10", use_filters=False)['name'] == "Avatar"
+    assert catalog.get("10").code == "2"
+    assert [code for code, _ in catalog.sorted_names()] == ["2", "3"]
+    assert [movie.code for movie in catalog.search("avatar")] == ["2"]
+    assert firebase_utils.find_duplicate_movies() == []
+
+
+def test_merge_points_the_file_index_at_the_kept_code(firestore_db):
+    firebase_utils.save_movie_data("10", "file-a2", "Avatar (qayta)", file_unique_id="unique-a")
+    firebase_utils.save_movie_data("2", "file-a1", "Avatar", file_unique_id="unique-a")
+    assert firestore_db.collection('movie_files').document("unique-a").get().to_dict() == {'code': "2"}
+    firestore_db.collection('movie_files').document("unique-a").set({'code': "10"})
+
+    firebase_utils.merge_duplicate_movies(firebase_utils.find_duplicate_movies())
+
+    assert firestore_db.collection('movie_files').document("unique-a").get().to_dict() == {'code': "2"}
+    assert firebase_utils.find_movie_by_file("unique-a")[0] == "2"
+
+
+def test_listings_skip_merged_codes_but_keep_them_taken(firestore_db):
+    _save_duplicates()
+    firebase_utils.merge_duplicate_movies(firebase_utils.find_duplicate_movies())
+
+    listed = [code for page in firebase_utils.iter_movie_pages() for code, _ in page]
+    taken = [code for page in firebase_utils.iter_movie_pages((), include_aliases=True) for code, _ in page]
+
+    assert listed == ["2", "3"]
+    assert sorted(taken) == ["10", "2", "3"]
+    assert sorted(firebase_utils.get_movie_catalog().codes()) == ["10", "2", "3"]
+
+
+def test_other_workers_pick_up_merges_with_a_delta_sync(firestore_db, monkeypatch):
+    _save_duplicates()
+    catalog = firebase_utils.get_movie_catalog()
+    # Another worker merges: only the Firestore documents change
+    firestore_db.collection('movies').document("10").set(
+        {'alias_of': "2", 'timestamp': firestore.SERVER_TIMESTAMP})
+
+    monkeypatch.setattr(firebase_utils, '_catalog_loaded_at', 0.0)
+    firebase_utils.get_movie_catalog()
+
+    assert catalog.get("10").code == "2"
+    assert len(catalog) == 2
+
+
+def test_alias_of_a_deleted_movie_finds_nothing(firestore_db):
+    _save_duplicates()
+    firebase_utils.merge_duplicate_movies(firebase_utils.find_duplicate_movies())
+
+    firebase_utils.delete_movie_code("2")
+
+    assert firebase_utils.get_movie_data("10", use_filters=False) is None
+    assert firebase_utils.get_movie_catalog().get("10") is None
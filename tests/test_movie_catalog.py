@@ -0,0 +1,75 @@
+# tests/test_movie_catalog.py
+from movie_catalog import MovieCatalog, normalize_movie_name
+
+
+def _catalog():
+    return MovieCatalog.from_documents({
+        "1": {"name": "Avatar", "file_id": "file-1"},
+        "2": {"name": "Avatar: Suv Yo'li", "file_id": "file-2", "file_unique_id": "unique-2"},
+        "10": {"name": "Titanik", "file_id": "file-10"},
+        "shrek": {"name": "Shrek", "file_id": "file-shrek"},
+    }.items())
+
+
+def _codes(records):
+    return sorted(record.code for record in records)
+
+
+def test_normalize_movie_name_unifies_case_spaces_and_apostrophes():
+    assert normalize_movie_name("  O‘zbek   KINO ") == "o'zbek kino"
+    assert normalize_movie_name("Oʻzbek kino") == normalize_movie_name("O`zbek kino")
+
+
+def test_normalize_movie_name_transliterates_cyrillic():
+    assert normalize_movie_name("Аватар") == "avatar"
+    assert normalize_movie_name("Ўзбек") == "o'zbek"
+
+
+def test_search_matches_substrings_once_per_movie():
+    catalog = _catalog()
+    assert _codes(catalog.search("avatar")) == ["1", "2"]
+    assert _codes(catalog.search(normalize_movie_name("Аватар"))) == ["1", "2"]
+    assert _codes(catalog.search("a")) == ["1", "10", "2"]
+    assert catalog.search("") == []
+
+
+def test_search_sees_upserts_and_removals():
+    catalog = _catalog()
+    catalog.upsert("10", {"name": "Titanik 2", "file_id": "file-10b"})
+    catalog.remove("1")
+
+    assert _codes(catalog.search("avatar")) == ["2"]
+    assert catalog.get("10").file_id == "file-10b"
+    assert "1" not in catalog and len(catalog) == 3
+
+
+def test_sorted_names_puts_numerical_codes_first():
+    assert [code for code, _ in _catalog().sorted_names()] == ["1", "2", "10", "shrek"]
+
+
+def test_file_index_follows_removals():
+    catalog = _catalog()
+    catalog.upsert("3", {"name": "Avatar (copy)", "file_id": "file-3", "file_unique_id": "unique-2"})
+    assert catalog.code_for_file("unique-2") == "2"
+
+    catalog.remove("2")
+    assert catalog.code_for_file("unique-2") == "3"
+    catalog.remove("3")
+    assert catalog.code_for_file("unique-2") is None
+
+
+def test_aliases_resolve_to_their_movie_but_are_not_listed():
+    catalog = _catalog()
+    catalog.upsert("2", {"alias_of": "1", "timestamp": 5.0})
+
+    assert catalog.get("2").code == "1"
+    assert catalog.timestamp("2") == 5.0
+    assert "2" in catalog and len(catalog) == 3
+    assert _codes(catalog.search("avatar")) == ["1"]
+    assert "2" not in [code for code, _ in catalog.sorted_names()]
+    assert catalog.code_for_file("unique-2") is None
+
+    catalog.upsert("2", {"name": "Avatar 2", "file_id": "file-2b"})
+    assert catalog.get("2").name == "Avatar 2" and len(catalog) == 4
+    catalog.upsert("2", {"alias_of": "1"})
+    assert catalog.remove("2") and "2" not in catalog
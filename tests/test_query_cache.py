@@ -0,0 +1,42 @@
+# tests/test_query_cache.py
+import query_cache
+from query_cache import QueryResultCache
+
+
+def test_hit_after_put_and_miss_for_another_revision():
+    cache = QueryResultCache(max_size=10, ttl=60)
+    cache.put((1, "avatar"), ('movie', "1", "file-1", "Avatar"))
+
+    assert cache.get((1, "avatar")) == ('movie', "1", "file-1", "Avatar")
+    assert cache.get((2, "avatar")) is None # A catalog change bumps the revision in the key
+    assert cache.stats == {'hits': 1, 'misses': 1}
+    assert cache.hit_rate == 0.5
+
+
+def test_entries_expire_after_the_ttl(monkeypatch, clock):
+    monkeypatch.setattr(query_cache.time, 'monotonic', clock)
+    cache = QueryResultCache(max_size=10, ttl=60)
+    cache.put("avatar", ('none',))
+
+    clock.now += 59
+    assert cache.get("avatar") == ('none',)
+    clock.now += 2
+    assert cache.get("avatar") is None
+    assert cache.stats['expired'] == 1 and len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryResultCache(max_size=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_zero_size_disables_the_cache():
+    cache = QueryResultCache(max_size=0, ttl=60)
+    cache.put("a", 1)
+    assert cache.get("a") is None and len(cache) == 0
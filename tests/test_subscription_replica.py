@@ -0,0 +1,68 @@
+# tests/test_subscription_replica.py
+import subscription_replica
+from subscription_replica import MembershipReplica
+
+KEY = (1, 42) # (bot_id, user_id)
+
+
+def test_unknown_user_is_verified_on_every_channel():
+    replica = MembershipReplica(ttl=60, max_size=10)
+
+    assert replica.channels_to_verify(KEY, 3) == [0, 1, 2]
+    assert not replica.is_loaded(KEY)
+
+
+def test_known_members_need_no_verification():
+    replica = MembershipReplica(ttl=60, max_size=10)
+    replica.set_membership(KEY, 0, True)
+    replica.set_membership(KEY, 2, True)
+
+    assert replica.channels_to_verify(KEY, 3) == [1]
+
+
+def test_not_a_member_is_always_verified_with_telegram():
+    replica = MembershipReplica(ttl=60, max_size=10)
+    replica.set_membership(KEY, 0, True)
+    replica.set_membership(KEY, 1, False)
+
+    assert replica.channels_to_verify(KEY, 2) == [1]
+
+    replica.set_membership(KEY, 0, False) # The user left the channel
+    assert replica.channels_to_verify(KEY, 2) == [0, 1]
+
+
+def test_entries_are_reloaded_after_the_ttl(monkeypatch, clock):
+    monkeypatch.setattr(subscription_replica.time, 'monotonic', clock)
+    replica = MembershipReplica(ttl=60, max_size=10)
+    replica.reset(KEY)
+    replica.set_membership(KEY, 0, True)
+
+    clock.now += 59
+    assert replica.is_loaded(KEY)
+    clock.now += 2
+    assert not replica.is_loaded(KEY)
+
+    replica.reset(KEY) # Reloaded: what was known before is dropped until Firestore says otherwise
+    assert replica.is_loaded(KEY)
+    assert replica.channels_to_verify(KEY, 1) == [0]
+
+
+def test_least_recently_checked_users_are_evicted():
+    replica = MembershipReplica(ttl=60, max_size=2)
+    replica.set_membership((1, 1), 0, True)
+    replica.set_membership((1, 2), 0, True)
+    replica.channels_to_verify((1, 1), 1) # Checking a user keeps it
+
+    replica.set_membership((1, 3), 0, True)
+
+    assert len(replica) == 2
+    assert replica.channels_to_verify((1, 1), 1) == []
+    assert replica.channels_to_verify((1, 2), 1) == [0] # Evicted, so verified again
+    assert not replica.is_loaded((1, 2))
+
+
+def test_bots_keep_separate_entries_for_the_same_user():
+    replica = MembershipReplica(ttl=60, max_size=10)
+    replica.set_membership((1, 42), 0, True)
+
+    assert replica.channels_to_verify((2, 42), 1) == [0]
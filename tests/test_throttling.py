@@ -0,0 +1,126 @@
+# tests/test_throttling.py
+import asyncio
+import datetime
+
+import pytest
+from aiogram import types
+from aiogram.dispatcher.event.handler import HandlerObject
+
+import throttling
+from throttling import ThrottlingMiddleware
+
+USER = types.User(id=42, is_bot=False, first_name="Ali")
+ADMIN = types.User(id=1, is_bot=False, first_name="Admin")
+
+
+async def search_handler(event, data):
+    return "handled"
+
+
+async def other_handler(event, data):
+    return "handled"
+
+
+def _message(user=USER):
+    return types.Message(message_id=1, date=datetime.datetime.now(datetime.timezone.utc),
+                         chat=types.Chat(id=user.id, type="private"), from_user=user, text="avatar")
+
+
+def _callback(user=USER):
+    return types.CallbackQuery(id="1", from_user=user, chat_instance="1", data="page:2")
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """Records the texts events are answered with instead of calling the Bot API."""
+    sent = []
+
+    async def answer(self, text=None, **kwargs):
+        sent.append((type(self).__name__, text))
+
+    monkeypatch.setattr(types.Message, 'answer', answer)
+    monkeypatch.setattr(types.CallbackQuery, 'answer', answer)
+    return sent
+
+
+@pytest.fixture
+def middleware(monkeypatch, clock):
+    monkeypatch.setattr(throttling.time, 'monotonic', clock)
+    return ThrottlingMiddleware(limit=3, window=10, is_exempt=lambda user_id, bot: user_id == ADMIN.id)
+
+
+def _feed(middleware, event, callback=search_handler, flags=None):
+    data = {"event_from_user": event.from_user, "bot": None,
+            "handler": HandlerObject(callback=callback, flags=flags or {})}
+    return asyncio.run(middleware(callback, event, data))
+
+
+def test_limit_applies_within_a_sliding_window(middleware, answers, clock):
+    results = []
+    for _ in range(4):
+        results.append(_feed(middleware, _message()))
+        clock.now += 1
+
+    assert results == ["handled", "handled", "handled", None]
+    assert middleware.throttled_events == {'search_handler': 1}
+
+    clock.now += 6 # 10 s after the first hit, it leaves the window; the other two remain
+    assert _feed(middleware, _message()) == "handled"
+    assert _feed(middleware, _message()) is None
+
+
+def test_limit_is_per_user_and_per_handler(middleware, answers):
+    for _ in range(3):
+        _feed(middleware, _message())
+    assert _feed(middleware, _message()) is None
+
+    other_user = types.User(id=43, is_bot=False, first_name="Vali")
+    assert _feed(middleware, _message(other_user)) == "handled"
+    assert _feed(middleware, _message(), callback=other_handler) == "handled"
+    assert _feed(middleware, _message(ADMIN)) == "handled"
+
+
+def test_zero_limit_disables_flood_control(monkeypatch, clock, answers):
+    monkeypatch.setattr(throttling.time, 'monotonic', clock)
+    disabled = ThrottlingMiddleware(limit=0, window=10)
+    assert all(_feed(disabled, _message()) == "handled" for _ in range(20))
+
+    limited = ThrottlingMiddleware(limit=3, window=10)
+    assert all(_feed(limited, _message(), flags={"rate_limit": (0, 10)}) == "handled" for _ in range(20))
+    assert answers == []
+
+
+def test_handler_flag_overrides_the_default_limit(middleware, answers):
+    results = [_feed(middleware, _message(), flags={"rate_limit": (1, 60)}) for _ in range(2)]
+
+    assert results == ["handled", None]
+
+
+def test_user_is_warned_once_per_flood(middleware, answers, clock):
+    for _ in range(6):
+        _feed(middleware, _message())
+
+    assert [kind for kind, _ in answers] == ["Message"]
+
+    clock.now += 11 # The flood is over
+    for _ in range(4):
+        _feed(middleware, _message())
+    assert len(answers) == 2
+
+
+def test_dropped_callbacks_are_always_answered(middleware, answers):
+    for _ in range(6):
+        _feed(middleware, _callback())
+
+    # One warning, then empty answers that only stop the button's loading spinner
+    assert answers[0][0] == "CallbackQuery" and answers[0][1]
+    assert answers[1:] == [("CallbackQuery", None)] * 2
+
+
+def test_idle_keys_are_purged(middleware, answers, clock):
+    _feed(middleware, _message())
+    clock.now += 11
+
+    _feed(middleware, _message(types.User(id=43, is_bot=False, first_name="Vali")))
+
+    assert list(middleware._hits) == [(43, 'search_handler')]
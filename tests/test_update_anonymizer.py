@@ -0,0 +1,111 @@
+# tests/test_update_anonymizer.py
+from update_anonymizer import anonymize_update
+
+USER = {"id": 111, "is_bot": False, "first_name": "Ali", "last_name": "Valiyev", "username": "ali"}
+OTHER_USER = {"id": 222, "is_bot": False, "first_name": "Vali", "username": "vali"}
+GROUP = {"id": -100123, "title": "Kino guruhi", "type": "supergroup", "username": "kino_guruhi"}
+PRIVATE_CHAT = {"id": 111, "first_name": "Ali", "username": "ali", "type": "private"}
+
+
+def _message(**fields):
+    return {"message_id": 5, "date": 1700000000, "from": USER, "chat": PRIVATE_CHAT, **fields}
+
+
+def _values(payload):
+    if isinstance(payload, dict):
+        for value in payload.values():
+            yield from _values(value)
+    elif isinstance(payload, list):
+        for item in payload:
+            yield from _values(item)
+    else:
+        yield payload
+
+
+def _leaks(payload):
+    """Returns the real IDs and names still present anywhere in an anonymized payload."""
+    secrets = {111, 222, -100123, "Ali", "Valiyev", "ali", "Vali", "vali", "Kino guruhi", "kino_guruhi",
+               "998901234567"}
+    return [value for value in _values(payload) if not isinstance(value, bool) and value in secrets]
+
+
+def test_message_keeps_its_text_and_pseudonymizes_sender_and_chat():
+    update = {"update_id": 1, "message": _message(text="123")}
+
+    anonymized = anonymize_update(update)
+
+    message = anonymized["message"]
+    assert message["text"] == "123" and message["message_id"] == 5
+    assert message["from"]["id"] == message["chat"]["id"] # Same user, same pseudonym
+    assert message["from"]["id"] > 0 and message["from"]["is_bot"] is False
+    assert set(message["from"]) == {"id", "is_bot"}
+    assert _leaks(anonymized) == []
+
+
+def test_chats_without_names_are_pseudonymized():
+    anonymized = anonymize_update({"message": _message(text="1", chat={"id": 111, "type": "private"})})
+
+    assert anonymized["message"]["chat"]["id"] == anonymized["message"]["from"]["id"]
+    assert _leaks(anonymized) == []
+
+
+def test_pseudonyms_are_stable_and_keep_the_sign():
+    first = anonymize_update({"message": _message(text="a")})
+    second = anonymize_update({"my_chat_member": {"chat": GROUP, "from": USER}})
+
+    assert first["message"]["from"]["id"] == second["my_chat_member"]["from"]["id"]
+    assert second["my_chat_member"]["chat"]["id"] < 0
+
+
+def test_forward_origins_are_anonymized():
+    update = {"message": _message(
+        text="Avatar",
+        forward_origin={"type": "user", "date": 1700000000, "sender_user": OTHER_USER},
+        external_reply={"origin": {"type": "chat", "date": 1700000000, "sender_chat": GROUP}},
+    )}
+
+    anonymized = anonymize_update(update)
+
+    assert anonymized["message"]["forward_origin"]["type"] == "user"
+    assert _leaks(anonymized) == []
+
+
+def test_members_in_lists_and_service_messages_are_anonymized():
+    joined = anonymize_update({"message": _message(chat=GROUP, new_chat_members=[USER, OTHER_USER])})
+    left = anonymize_update({"message": _message(chat=GROUP, left_chat_member=OTHER_USER)})
+
+    assert len(joined["message"]["new_chat_members"]) == 2
+    assert _leaks(joined) == [] and _leaks(left) == []
+
+
+def test_chat_member_updates_are_anonymized():
+    update = {"chat_member": {
+        "chat": GROUP, "from": USER, "date": 1700000000,
+        "old_chat_member": {"status": "left", "user": OTHER_USER},
+        "new_chat_member": {"status": "member", "user": OTHER_USER},
+    }}
+
+    anonymized = anonymize_update(update)["chat_member"]
+
+    assert anonymized["new_chat_member"]["status"] == "member"
+    assert anonymized["new_chat_member"]["user"]["id"] == anonymized["old_chat_member"]["user"]["id"]
+    assert _leaks(anonymized) == []
+
+
+def test_contacts_are_dropped_at_any_depth():
+    contact = {"phone_number": "998901234567", "first_name": "Ali", "user_id": 111}
+    update = {"message": _message(text="ok", reply_to_message=_message(contact=contact))}
+
+    anonymized = anonymize_update(update)
+
+    assert "contact" not in anonymized["message"]["reply_to_message"]
+    assert _leaks(anonymized) == []
+
+
+def test_bare_user_ids_are_pseudonymized():
+    update = {"chat_join_request": {"chat": GROUP, "from": USER, "user_chat_id": 111, "date": 1700000000}}
+
+    anonymized = anonymize_update(update)["chat_join_request"]
+
+    assert anonymized["user_chat_id"] == anonymized["from"]["id"]
+    assert _leaks(anonymized) == []
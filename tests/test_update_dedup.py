@@ -0,0 +1,32 @@
+# tests/test_update_dedup.py
+import update_dedup
+from update_dedup import UpdateDeduplicator
+
+
+def test_redelivered_key_is_rejected_within_the_window(monkeypatch, clock):
+    monkeypatch.setattr(update_dedup.time, 'monotonic', clock)
+    dedup = UpdateDeduplicator(window=600, max_size=100)
+
+    assert dedup.claim("bot:1")
+    assert not dedup.claim("bot:1")
+    assert dedup.claim("other-bot:1") # update_id is only unique per bot
+
+    clock.now += 601
+    assert dedup.claim("bot:1")
+
+
+def test_released_key_can_be_claimed_again():
+    dedup = UpdateDeduplicator(window=600, max_size=100)
+    assert dedup.claim("bot:1")
+    dedup.release("bot:1")
+    assert dedup.claim("bot:1")
+
+
+def test_oldest_keys_are_forgotten_beyond_max_size():
+    dedup = UpdateDeduplicator(window=600, max_size=2)
+    for key in ("bot:1", "bot:2", "bot:3"):
+        assert dedup.claim(key)
+
+    assert len(dedup) == 2
+    assert dedup.claim("bot:1") # Evicted, so no longer recognized
+    assert not dedup.claim("bot:3")
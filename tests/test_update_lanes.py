@@ -0,0 +1,77 @@
+# tests/test_update_lanes.py
+import asyncio
+
+import pytest
+from aiogram import types
+
+from update_lanes import UpdateLanes, select_lane
+
+_USER = {"id": 1, "is_bot": False, "first_name": "User"}
+_MESSAGE = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "from": _USER, "text": "avatar"}
+
+
+def _message_update():
+    return types.Update.model_validate({"update_id": 1, "message": _MESSAGE})
+
+
+def _callback_update():
+    return types.Update.model_validate({"update_id": 2, "callback_query": {
+        "id": "1", "from": _USER, "chat_instance": "1", "data": "select_movie:1", "message": _MESSAGE}})
+
+
+def test_plain_messages_go_to_the_user_lane():
+    assert select_lane(_message_update(), None, from_admin=False) == 'user'
+
+
+def test_button_presses_go_to_the_callback_lane():
+    assert select_lane(_callback_update(), None, from_admin=False) == 'callback'
+
+
+def test_admin_updates_go_to_the_admin_lane():
+    assert select_lane(_message_update(), None, from_admin=True) == 'admin'
+    assert select_lane(_callback_update(), None, from_admin=True) == 'admin'
+
+
+def test_fsm_steps_go_to_the_fsm_lane_even_from_admins():
+    state = "AddMovieStates:waiting_for_movie_code"
+    assert select_lane(_message_update(), state, from_admin=True) == 'fsm'
+    assert select_lane(_callback_update(), state, from_admin=False) == 'fsm'
+
+
+def test_full_user_lane_does_not_delay_other_lanes():
+    async def scenario():
+        lanes = UpdateLanes({'admin': 1, 'user': 2}, default='user')
+        release_users = asyncio.Event()
+
+        async def slow_user_handler():
+            await release_users.wait()
+
+        async def admin_handler():
+            return "done"
+
+        user_tasks = [asyncio.create_task(lanes.run('user', slow_user_handler)) for _ in range(10)]
+        await asyncio.sleep(0)
+        admin_result = await asyncio.wait_for(lanes.run('admin', admin_handler), timeout=1)
+        user_lane = lanes.lanes['user'].summary()
+        release_users.set()
+        await asyncio.gather(*user_tasks)
+        return admin_result, user_lane, lanes.lanes['user'].summary()
+
+    admin_result, busy_user_lane, user_lane = asyncio.run(scenario())
+    assert admin_result == "done"
+    assert busy_user_lane['running'] == 2 and busy_user_lane['waiting'] == 8
+    assert user_lane['handled'] == 10 and user_lane['running'] == 0
+
+
+def test_unknown_lane_falls_back_to_the_default_and_failures_free_the_slot():
+    async def scenario():
+        lanes = UpdateLanes({'user': 1}, default='user')
+
+        async def failing_handler():
+            raise RuntimeError("handler failed")
+
+        with pytest.raises(RuntimeError):
+            await lanes.run('missing', failing_handler)
+        return await asyncio.wait_for(lanes.run('user', asyncio.sleep, 0, "ok"), timeout=1)
+
+    assert asyncio.run(scenario()) == "ok"
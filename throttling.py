@@ -0,0 +1,79 @@
+# throttling.py
+"""
+Per-user, per-handler flood control for the bot's message and callback handlers.
+
+Registered as an inner middleware, so it runs after filters: the matched handler is known,
+its flags={"rate_limit": (limit, window_seconds)} can override the defaults, and each
+handler is limited separately. Dropped events are not handled; the user is warned once per
+flood, and dropped button presses are still answered so their loading spinner stops.
+"""
+import time
+from collections import Counter, deque
+
+from aiogram import BaseMiddleware, types
+from aiogram.dispatcher.flags import get_flag
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Sliding-window rate limiter applied per user and per handler.
+    Each (user_id, handler name) key keeps at most `limit` timestamps in a bounded deque,
+    so memory stays constant per active user. Idle keys are purged periodically.
+    Users for whom is_exempt(user_id, bot) is true (the bot's admins) are never throttled.
+    """
+    def __init__(self, limit: int, window: float, is_exempt=None):
+        self.limit = limit
+        self.window = window
+        self.is_exempt = is_exempt or (lambda user_id, bot: False)
+        self._hits: dict[tuple[int, str], deque] = {}
+        self._notified: set[tuple[int, str]] = set() # Keys already warned during the current flood
+        self._max_window = window
+        self._last_purge = time.monotonic()
+        self.throttled_events = Counter() # handler name -> number of dropped events
+
+    def _purge(self, now: float):
+        """Drops keys whose most recent hit is older than the longest window in use."""
+        if now - self._last_purge < self._max_window:
+            return
+        self._last_purge = now
+        for key in [k for k, hits in self._hits.items() if now - hits[-1] > self._max_window]:
+            del self._hits[key]
+            self._notified.discard(key)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or self.is_exempt(user.id, data["bot"]):
+            return await handler(event, data) # Admins and service updates bypass the limit
+
+        handler_object = data.get("handler")
+        handler_name = handler_object.callback.__name__ if handler_object else "unknown"
+        limit, window = get_flag(data, "rate_limit", default=(self.limit, self.window))
+        if limit <= 0:
+            return await handler(event, data) # Flood control is disabled
+        self._max_window = max(self._max_window, window)
+
+        now = time.monotonic()
+        self._purge(now)
+
+        key = (user.id, handler_name)
+        hits = self._hits.get(key)
+        if hits is None or hits.maxlen != limit:
+            hits = self._hits[key] = deque(hits or (), maxlen=limit)
+
+        if len(hits) == limit and now - hits[0] < window:
+            self.throttled_events[handler_name] += 1
+            if key not in self._notified:
+                # Warn the user only once per flood to avoid spending Bot API calls on them
+                self._notified.add(key)
+                print(f"Throttling user {user.id} on handler '{handler_name}' "
+                      f"(total throttled for this handler: {self.throttled_events[handler_name]})")
+                warning_text = "Juda ko'p so'rov yubordingiz. Iltimos, biroz kuting va qaytadan urinib ko'ring."
+                if isinstance(event, (types.Message, types.CallbackQuery)):
+                    await event.answer(warning_text)
+            elif isinstance(event, types.CallbackQuery):
+                await event.answer() # Stop the button's loading animation without warning again
+            return None # Drop the event without calling the handler
+
+        hits.append(now)
+        self._notified.discard(key)
+        return await handler(event, data)
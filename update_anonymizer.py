@@ -0,0 +1,56 @@
+# update_anonymizer.py
+"""
+Anonymization of raw Telegram update payloads for the webhook traffic recorder.
+
+Any object shaped like a User or Chat (an integer "id" next to a name, a title, "is_bot" or
+a chat "type"), wherever it appears in the update, gets its ID replaced by a stable pseudonym
+and its names removed, so new update types are covered without listing every field that holds one.
+Message text is kept, since codes and search queries are what drives the bot's workload.
+"""
+import hashlib
+import hmac
+import os
+
+# Fields that mark a dict as a User or Chat
+_IDENTITY_MARKERS = {"first_name", "title", "is_bot", "type"}
+_NAME_FIELDS = {"first_name", "last_name", "username", "title", "bio", "phone_number"}
+# Bare IDs of users and chats stored outside of a User/Chat object
+_ID_FIELDS = {"user_id", "user_chat_id", "chat_id", "migrate_to_chat_id", "migrate_from_chat_id"}
+# Message parts that carry personal data and are irrelevant to the bot's workload
+_DROPPED_FIELDS = {"contact", "location", "venue", "photo", "sticker", "voice"}
+# Per-process random key: the same user maps to the same pseudonym within one recording,
+# but pseudonyms can't be linked back to real IDs or across recordings.
+_recording_key = os.urandom(32)
+
+
+def _pseudonymize_id(value: int) -> int:
+    digest = hmac.new(_recording_key, str(value).encode(), hashlib.sha256).digest()
+    pseudonym = int.from_bytes(digest[:5], "big") + 1
+    return -pseudonym if value < 0 else pseudonym # Keep the sign: negative IDs are groups/channels
+
+
+def _is_identity(payload: dict) -> bool:
+    return isinstance(payload.get("id"), int) and not _IDENTITY_MARKERS.isdisjoint(payload)
+
+
+def anonymize_update(payload):
+    """
+    Returns a copy of a raw update payload with user and chat IDs replaced by stable pseudonyms
+    and names, usernames and contact/location data removed, at any depth and inside lists.
+    """
+    if isinstance(payload, list):
+        return [anonymize_update(item) for item in payload]
+    if not isinstance(payload, dict):
+        return payload
+    identity = _is_identity(payload)
+    anonymized = {}
+    for key, value in payload.items():
+        if key in _DROPPED_FIELDS or (identity and key in _NAME_FIELDS):
+            continue
+        if (key in _ID_FIELDS or (identity and key == "id")) and isinstance(value, int) \
+                and not isinstance(value, bool):
+            value = _pseudonymize_id(value)
+        else:
+            value = anonymize_update(value)
+        anonymized[key] = value
+    return anonymized
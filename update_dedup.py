@@ -0,0 +1,42 @@
+# update_dedup.py
+"""
+Bounded, time-windowed memory of update IDs already taken for processing.
+
+Telegram redelivers an update when the webhook answers slowly or with an error, and each
+redelivery would run the handlers again (sending the same video twice, repeating writes).
+Keys are remembered for `window` seconds and at most `max_size` of them are kept, oldest
+first out. Used from the event loop only, so there is no locking.
+"""
+import time
+from collections import Counter, OrderedDict
+
+
+class UpdateDeduplicator:
+    def __init__(self, window: float = 600.0, max_size: int = 50000):
+        self.window = window
+        self.max_size = max_size
+        self._seen = OrderedDict() # key -> monotonic expiry time, oldest first
+        self.stats = Counter() # 'processed', 'dropped_memory', 'dropped_shared', 'shared_errors'
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def claim(self, key) -> bool:
+        """Returns True the first time a key is seen within the window, False for repeats."""
+        now = time.monotonic()
+        # Entries are inserted with the same window, so expired ones are all at the front
+        while self._seen:
+            oldest_key, expires_at = next(iter(self._seen.items()))
+            if expires_at >= now:
+                break
+            del self._seen[oldest_key]
+        if key in self._seen:
+            return False
+        self._seen[key] = now + self.window
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return True
+
+    def release(self, key):
+        """Forgets a key, so a redelivery of an update whose processing failed is handled again."""
+        self._seen.pop(key, None)
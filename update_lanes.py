@@ -0,0 +1,91 @@
+# update_lanes.py
+"""
+Priority lanes for update handling.
+
+Each lane has its own concurrency limit, so a flood in one lane (e.g. thousands of users
+searching at once) queues only behind itself: updates in the other lanes still find free
+slots and run immediately. Per lane, the time spent waiting for a slot and the total time
+to handle an update are kept for the most recent updates and reported as percentiles.
+"""
+import asyncio
+import time
+from collections import deque
+
+
+def select_lane(update, raw_state, from_admin: bool) -> str:
+    """
+    Picks the lane of an update: 'fsm' for a step of a multi-step flow (raw_state is the sender's
+    FSM state; only admins' flows set one, so this is checked before 'admin'), 'admin' for other
+    admin updates, 'callback' for button presses and 'user' for everything else.
+    """
+    if raw_state is not None:
+        return 'fsm'
+    if from_admin:
+        return 'admin'
+    if update.callback_query is not None:
+        return 'callback'
+    return 'user'
+
+
+def _percentile(sorted_values, percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Lane:
+    def __init__(self, name: str, concurrency: int, samples: int = 1000):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.handled = 0
+        self.wait_times = deque(maxlen=samples) # Seconds spent waiting for a slot
+        self.latencies = deque(maxlen=samples) # Seconds from arrival to handled, waiting included
+
+    async def run(self, handler, *args):
+        """Runs handler(*args) in one of the lane's slots and records its timings."""
+        arrived = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.running += 1
+        try:
+            return await handler(*args)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            finished = time.perf_counter()
+            self.handled += 1
+            self.wait_times.append(started - arrived)
+            self.latencies.append(finished - arrived)
+
+    def summary(self) -> dict:
+        """Returns handled/waiting/running counts and p50/p95/max latency and wait in milliseconds."""
+        latencies = sorted(self.latencies)
+        wait_times = sorted(self.wait_times)
+        return {
+            'handled': self.handled,
+            'waiting': self.waiting,
+            'running': self.running,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p95_ms': _percentile(latencies, 95) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            'wait_p95_ms': _percentile(wait_times, 95) * 1000,
+        }
+
+
+class UpdateLanes:
+    """A fixed set of named lanes; `default` receives every update not assigned to another lane."""
+    def __init__(self, concurrency_by_lane: dict, default: str):
+        self.lanes = {name: Lane(name, concurrency) for name, concurrency in concurrency_by_lane.items()}
+        self.default = default
+
+    async def run(self, lane_name: str, handler, *args):
+        lane = self.lanes.get(lane_name) or self.lanes[self.default]
+        return await lane.run(handler, *args)